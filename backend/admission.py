@@ -0,0 +1,129 @@
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+
+class ServerBusyError(Exception):
+    """LLM 并发已满，且等待队列已满或等待超过截止时间"""
+
+    def __init__(self, message: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    __slots__ = ("event", "granted", "cancelled")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.granted = False
+        self.cancelled = False
+
+
+class AdmissionController:
+    """LLM 调用的准入控制：限制并发数，超出部分进入有界优先级队列等待。
+
+    priority 越大越先被放行；同优先级按到达顺序。队列已满时立即拒绝，
+    等待超过 timeout 仍未轮到时同样拒绝，调用方应返回 429。
+    """
+
+    def __init__(self, max_concurrent: int = 4, max_queue: int = 16, timeout: float = 30.0):
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queue = max(0, max_queue)
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._active = 0
+        self._queue = []  # (-priority, seq, waiter)
+        self._waiting = 0
+        self._seq = itertools.count()
+        # 指标
+        self._admitted = 0
+        self._rejected_full = 0
+        self._rejected_timeout = 0
+        self._max_depth = 0
+        self._wait_times = deque(maxlen=1000)
+
+    @contextmanager
+    def slot(self, priority: int = 0, timeout: Optional[float] = None):
+        """占用一个 LLM 并发名额，退出时归还"""
+        self.acquire(priority, timeout)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def acquire(self, priority: int = 0, timeout: Optional[float] = None):
+        timeout = self.timeout if timeout is None else timeout
+        start = time.monotonic()
+        with self._lock:
+            if self._active < self.max_concurrent and self._waiting == 0:
+                self._active += 1
+                self._record_admit(0.0)
+                return
+            if self._waiting >= self.max_queue:
+                self._rejected_full += 1
+                raise ServerBusyError("当前咨询人数较多，请稍后再试", retry_after=self._suggest_retry_after())
+            waiter = _Waiter()
+            heapq.heappush(self._queue, (-priority, next(self._seq), waiter))
+            self._waiting += 1
+            self._max_depth = max(self._max_depth, self._waiting)
+
+        waiter.event.wait(max(0.0, timeout))
+        with self._lock:
+            if waiter.granted:
+                self._record_admit(time.monotonic() - start)
+                return
+            waiter.cancelled = True
+            self._waiting -= 1
+            self._rejected_timeout += 1
+        raise ServerBusyError("排队等待超时，请稍后再试", retry_after=self._suggest_retry_after())
+
+    def try_acquire(self) -> bool:
+        """不排队地尝试占用一个名额（用于对冲等可选调用）；有空闲名额且无人排队时返回 True"""
+        with self._lock:
+            if self._active < self.max_concurrent and self._waiting == 0:
+                self._active += 1
+                return True
+            return False
+
+    def release(self):
+        with self._lock:
+            while self._queue:
+                _, _, waiter = heapq.heappop(self._queue)
+                if waiter.cancelled:
+                    continue
+                # 名额直接转交给队首等待者，_active 保持不变
+                waiter.granted = True
+                self._waiting -= 1
+                waiter.event.set()
+                return
+            self._active -= 1
+
+    def _record_admit(self, waited: float):
+        self._admitted += 1
+        self._wait_times.append(waited)
+
+    def _suggest_retry_after(self) -> float:
+        waits = sorted(self._wait_times)
+        return round(max(1.0, waits[len(waits) // 2]) if waits else 1.0, 1)
+
+    def metrics(self) -> Dict:
+        with self._lock:
+            waits = sorted(self._wait_times)
+            return {
+                "max_concurrent": self.max_concurrent,
+                "active": self._active,
+                "queue_depth": self._waiting,
+                "queue_capacity": self.max_queue,
+                "max_queue_depth": self._max_depth,
+                "admitted": self._admitted,
+                "rejected_queue_full": self._rejected_full,
+                "rejected_timeout": self._rejected_timeout,
+                "wait_seconds_p50": waits[len(waits) // 2] if waits else 0.0,
+                "wait_seconds_p95": waits[int(len(waits) * 0.95)] if waits else 0.0,
+                "wait_seconds_max": waits[-1] if waits else 0.0,
+            }
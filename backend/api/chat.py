@@ -1,7 +1,12 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Header, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from itertools import chain
 from pydantic import BaseModel
-from typing import List, Dict, Optional
+from typing import Any, List, Dict, Optional
+import json
 from backend.chatbot import Chatbot
+from backend.admission import ServerBusyError
 import logging
 
 # 配置日志
@@ -16,6 +21,24 @@ router = APIRouter(prefix="/chat", tags=["chat"])
 # 数据模型
 class ChatRequest(BaseModel):
     message: str
+    priority: int = 0  # 数值越大越优先获得 LLM 调用名额
+    user_id: Optional[str] = None  # 也可通过 X-User-Id 请求头传入，请求头优先
+    timeout: Optional[float] = None  # 本次请求的延迟预算（秒），不超过服务端的 CHAT_DEADLINE
+    location: Optional[str] = None  # 用户位置 "经度,纬度"，分片索引下只检索附近的分片
+
+class BatchItem(BaseModel):
+    id: Optional[str] = None
+    question: Optional[str] = None
+    user_id: Optional[str] = None  # 使用已保存的用户偏好
+    preferences: Optional[Dict[str, Any]] = None  # 或直接传入偏好（格式同 /api/preferences）
+    location: Optional[str] = None  # 用户位置 "经度,纬度"
+
+class BatchRequest(BaseModel):
+    items: List[BatchItem]
+    concurrency: Optional[int] = None  # LLM 并发数，服务端有上限
+
+# 单次 /chat/batch 请求的条目上限，更大的离线任务使用 python -m backend.batch_recommend
+BATCH_MAX_ITEMS = 1000
 
 class ChatResponse(BaseModel):
     response: str
@@ -30,14 +53,23 @@ class HistoryEntry(BaseModel):
 chatbot = Chatbot.get_instance()
 
 @router.post("/send", response_model=ChatResponse)
-async def chat_with_ai(request: ChatRequest):
+async def chat_with_ai(request: ChatRequest, x_user_id: Optional[str] = Header(None)):
     """处理用户的聊天请求"""
     try:
         logger.info(f"收到聊天请求体: {request}")
         logger.info(f"用户消息内容: {request.message}")
-        response = chatbot.chat(request.message)
+        # 在线程池中执行，避免阻塞事件循环，使并发请求能够进入准入队列
+        response = await run_in_threadpool(chatbot.chat, request.message, request.priority,
+                                           x_user_id or request.user_id, request.timeout, request.location)
         logger.info(f"成功生成回复: {response[:100]}...")  # 只记录前100个字符
         return ChatResponse(response=response)
+    except ServerBusyError as e:
+        logger.warning(f"LLM 繁忙，拒绝请求: {str(e)}")
+        raise HTTPException(
+            status_code=429,
+            detail=str(e),
+            headers={"Retry-After": str(int(e.retry_after + 0.5))}
+        )
     except Exception as e:
         logger.error(f"处理请求时发生错误: {str(e)}")
         logger.error(f"错误类型: {type(e)}")
@@ -46,12 +78,45 @@ async def chat_with_ai(request: ChatRequest):
             error=f"处理请求时发生错误: {str(e)}"
         )
 
+@router.post("/stream")
+async def chat_stream(request: ChatRequest, x_user_id: Optional[str] = Header(None)):
+    """流式返回回复；相同的并发请求共享同一个 token 流"""
+    logger.info(f"收到流式聊天请求: {request.message}")
+    stream = chatbot.chat_stream(request.message, request.priority, x_user_id or request.user_id,
+                                 request.timeout, request.location)
+    try:
+        # 先取第一个分片，使排队被拒能以 429 返回而不是中断的流
+        first = await run_in_threadpool(next, stream, "")
+    except ServerBusyError as e:
+        logger.warning(f"LLM 繁忙，拒绝请求: {str(e)}")
+        raise HTTPException(
+            status_code=429,
+            detail=str(e),
+            headers={"Retry-After": str(int(e.retry_after + 0.5))}
+        )
+    except Exception as e:
+        logger.error(f"流式请求出错: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"处理请求时发生错误: {str(e)}")
+    return StreamingResponse(chain([first], stream), media_type="text/plain; charset=utf-8")
+
+@router.post("/batch")
+async def chat_batch(request: BatchRequest):
+    """批量推荐：按完成顺序以 NDJSON 逐行返回结果，每行带原始下标 index，单条失败时 error 非空"""
+    if len(request.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"单次最多 {BATCH_MAX_ITEMS} 条")
+    logger.info(f"收到批量推荐请求: {len(request.items)} 条")
+    items = [item.model_dump() for item in request.items]
+    # 同步生成器由 StreamingResponse 在线程池中迭代
+    lines = (json.dumps(result, ensure_ascii=False) + "\n"
+             for result in chatbot.chat_batch(items, request.concurrency))
+    return StreamingResponse(lines, media_type="application/x-ndjson")
+
 @router.get("/history", response_model=List[HistoryEntry])
-async def get_history():
-    """获取聊天历史"""
+async def get_history(user_id: Optional[str] = None, x_user_id: Optional[str] = Header(None)):
+    """获取某个用户的聊天历史；用户由 X-User-Id 请求头或 user_id 查询参数指定，未提供时为默认用户"""
     try:
         logger.info("获取聊天历史")
-        history = chatbot.get_history()
+        history = chatbot.get_history(x_user_id or user_id)
         logger.info(f"成功获取历史记录，共 {len(history)} 条")
         return history
     except Exception as e:
@@ -62,11 +127,11 @@ async def get_history():
         )
 
 @router.post("/clear-history")
-async def clear_history():
-    """清空聊天历史"""
+async def clear_history(user_id: Optional[str] = None, x_user_id: Optional[str] = Header(None)):
+    """清空某个用户的聊天历史与对话记忆"""
     try:
         logger.info("清空聊天历史")
-        chatbot.clear_history()
+        chatbot.clear_history(x_user_id or user_id)
         logger.info("聊天历史已清空")
         return {"status": "ok"}
     except Exception as e:
@@ -76,6 +141,22 @@ async def clear_history():
             detail=f"清空历史记录时出错: {str(e)}"
         )
 
+@router.get("/metrics")
+async def metrics():
+    """运行指标：LLM 准入队列、请求合并、token 用量与前缀缓存命中、检索深度、LLM 连接池、超时降级、画像候选集、索引分片"""
+    return {
+        "admission": chatbot.admission.metrics(),
+        "singleflight": chatbot.flights.metrics(),
+        "llm": chatbot.llm_usage.metrics(),
+        "intent": chatbot.router.metrics() if chatbot.router else None,
+        "embedding_cache": chatbot.embedder.metrics(),
+        "retrieval": chatbot.depth_stats.metrics(),
+        "http_pool": chatbot.http_clients.metrics(),
+        "deadline": chatbot.deadline_stats.metrics(),
+        "candidates": chatbot.candidates.metrics() if chatbot.candidates else None,
+        "shards": chatbot.index_manager.shards.metrics() if chatbot.index_manager.shards else None
+    }
+
 @router.get("/health")
 async def health_check():
     """健康检查端点"""
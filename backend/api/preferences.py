@@ -1,35 +1,33 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Header, HTTPException
 from pydantic import BaseModel
-import json
-import os
-from typing import Dict, Union
+from typing import Dict, Optional
+from backend.preference_store import PreferenceStore
+import logging
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()  # 使用 APIRouter 而不是 FastAPI 实例
 
+store = PreferenceStore.get_instance()
+
 class UserPreferences(BaseModel):
     priceRange: Dict[str, float]
     ratings: Dict[str, float]
     preferences: Dict[str, str]
 
 @router.post("/api/preferences")
-async def save_preferences(preferences: UserPreferences):
+async def save_preferences(preferences: UserPreferences,
+                           x_user_id: Optional[str] = Header(None)):
+    """保存用户偏好；用户由 X-User-Id 请求头区分，未提供时为默认用户"""
     try:
-        # 确保保存路径存在
-        save_dir = os.path.join(os.path.dirname(__file__), "..", "data")
-        os.makedirs(save_dir, exist_ok=True)
-        
-        # 使用绝对路径保存文件
-        file_path = os.path.join(save_dir, "user_preferences.json")
-        
-        # 打印调试信息
-        print(f"Saving preferences to: {file_path}")
-        print(f"Preferences data: {preferences.dict()}")
-        
-        with open(file_path, "w", encoding="utf-8") as f:
-            json.dump(preferences.dict(), f, ensure_ascii=False, indent=2)
-        
-        print("Successfully saved preferences")
-        return {"status": "success"}
+        snapshot = store.save(x_user_id, preferences.model_dump())
+        logger.info(f"已保存用户 {snapshot.user_id} 的偏好 (version={snapshot.version})")
+        return {"status": "success", "user_id": snapshot.user_id, "version": snapshot.version}
     except Exception as e:
-        print(f"Error saving preferences: {str(e)}")
+        logger.error(f"保存偏好时出错: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/api/preferences")
+async def get_preferences(x_user_id: Optional[str] = Header(None)):
+    """读取用户当前的偏好及版本号"""
+    return store.get(x_user_id).to_dict()
@@ -0,0 +1,70 @@
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+from email.utils import formatdate
+from backend.restaurant_store import RestaurantTable
+import logging
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/restaurants", tags=["restaurants"])
+
+# 批量查询单次最多返回的餐厅数
+MAX_BATCH_IDS = 100
+
+def _cache_headers(table: RestaurantTable) -> dict:
+    """ETag / Last-Modified 由索引版本与数据快照决定：同一版本内餐厅数据不变"""
+    return {
+        "ETag": f'"{table.version}-{int(table.modified_at)}"',
+        "Last-Modified": formatdate(table.modified_at, usegmt=True),
+        "Cache-Control": "public, max-age=60",
+    }
+
+def _not_modified(request: Request, headers: dict) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        return headers["ETag"] in {tag.strip() for tag in if_none_match.split(",")} or if_none_match.strip() == "*"
+    return request.headers.get("if-modified-since") == headers["Last-Modified"]
+
+def _parse_ids(ids: str) -> list:
+    parsed = [x.strip() for x in ids.split(",") if x.strip()]
+    if len(parsed) > MAX_BATCH_IDS:
+        raise HTTPException(status_code=400, detail=f"单次最多查询 {MAX_BATCH_IDS} 家餐厅")
+    return list(dict.fromkeys(parsed))
+
+def _resolve(table: RestaurantTable, restaurant_id: str):
+    """餐厅 id 解析为行号：优先按稳定的 key（跨索引版本不变），
+    纯数字时按行号解析（行号只在同一索引版本内有效，应与 ETag 中的版本一起使用）"""
+    row_id = table.ids_by_key.get(restaurant_id)
+    if row_id is None and restaurant_id.isdigit() and int(restaurant_id) < len(table):
+        row_id = int(restaurant_id)
+    return row_id
+
+@router.get("")
+async def get_restaurants(request: Request, response: Response,
+                          ids: str = Query(..., description="逗号分隔的餐厅 key（或当前版本的行号 id）")):
+    """批量获取餐厅完整信息；不存在的 id 列在 missing 中"""
+    table = RestaurantTable.get_instance()
+    headers = _cache_headers(table)
+    if _not_modified(request, headers):
+        return Response(status_code=304, headers=headers)
+    found, missing = [], []
+    for restaurant_id in _parse_ids(ids):
+        row_id = _resolve(table, restaurant_id)
+        if row_id is not None:
+            found.append(table.row_dict(row_id))
+        else:
+            missing.append(restaurant_id)
+    response.headers.update(headers)
+    return {"version": table.version, "restaurants": found, "missing": missing}
+
+@router.get("/{restaurant_id}")
+async def get_restaurant(restaurant_id: str, request: Request, response: Response):
+    """按 key（或当前版本的行号 id）获取单家餐厅的完整信息（评分、营业时间、位置、推荐菜、评论）"""
+    table = RestaurantTable.get_instance()
+    headers = _cache_headers(table)
+    if _not_modified(request, headers):
+        return Response(status_code=304, headers=headers)
+    row_id = _resolve(table, restaurant_id)
+    if row_id is None:
+        raise HTTPException(status_code=404, detail=f"餐厅 {restaurant_id} 不存在")
+    response.headers.update(headers)
+    return table.row_dict(row_id)
@@ -0,0 +1,27 @@
+from fastapi import APIRouter, Query
+from typing import Optional
+from backend.restaurant_store import RestaurantTable
+from backend.suggest import SUGGEST_LIMIT_DEFAULT, SUGGEST_LIMIT_MAX, KIND_PRIORITY, get_suggest_index
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/search", tags=["search"])
+
+# 启动时构建补全索引（只依赖餐厅表，不加载嵌入模型）
+get_suggest_index(RestaurantTable.get_instance())
+
+@router.get("/suggest")
+async def suggest(q: str = Query(..., min_length=1, description="用户已输入的前缀，支持拼音全拼/首字母"),
+                  limit: int = Query(SUGGEST_LIMIT_DEFAULT, ge=1, le=SUGGEST_LIMIT_MAX),
+                  kinds: Optional[str] = Query(None, description="逗号分隔的类型过滤: name,dish,type,tag")):
+    """餐厅名称、推荐菜、类型与标签的前缀补全"""
+    start = time.perf_counter()
+    kind_filter = {k for k in kinds.split(",") if k in KIND_PRIORITY} if kinds else None
+    index = get_suggest_index(RestaurantTable.get_instance())
+    suggestions = index.suggest(q, limit=limit, kinds=kind_filter)
+    took_ms = (time.perf_counter() - start) * 1000
+    if took_ms > 5:
+        logger.warning(f"补全请求耗时 {took_ms:.1f} 毫秒: q={q!r}")
+    return {"query": q, "suggestions": suggestions, "took_ms": round(took_ms, 3)}
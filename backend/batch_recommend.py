@@ -0,0 +1,81 @@
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+from backend.chatbot import BATCH_CONCURRENCY_DEFAULT, Chatbot
+
+# ========== 常量定义 ==========
+# 每次交给 Chatbot.chat_batch 的条目数：同一块内的问题一次编码、一次矩阵检索
+BATCH_CHUNK_SIZE = 256
+
+
+def read_items(input_path: Path, questions_path: Optional[Path] = None) -> Iterator[Dict]:
+    """读取批量条目。
+
+    input 为 JSONL，每行 {"id", "question", "user_id" 或 "preferences", 可选 "location"}；
+    指定 questions（每行一个问题）时，input 的每行视为一份用户画像，与每个问题组合成一条。
+    """
+    questions = None
+    if questions_path is not None:
+        with open(questions_path, "r", encoding="utf-8") as f:
+            questions = [line.strip() for line in f if line.strip()]
+    with open(input_path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            if questions is None:
+                item.setdefault("id", str(line_no))
+                yield item
+                continue
+            profile_id = item.get("id") or item.get("user_id") or str(line_no)
+            for q_no, question in enumerate(questions, 1):
+                yield {**item, "id": f"{profile_id}#{q_no}", "question": question}
+
+
+def _chunks(items: Iterator[Dict], size: int) -> Iterator[List[Dict]]:
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def run(input_path: Path, output_path: Optional[Path], questions_path: Optional[Path] = None,
+        concurrency: int = BATCH_CONCURRENCY_DEFAULT, chunk_size: int = BATCH_CHUNK_SIZE):
+    """逐块运行批量推荐，结果按完成顺序写为 NDJSON（index 为在整个输入中的下标）"""
+    chatbot = Chatbot.get_instance()
+    out = open(output_path, "w", encoding="utf-8") if output_path else sys.stdout
+    start = time.time()
+    total = errors = offset = 0
+    try:
+        for chunk in _chunks(read_items(input_path, questions_path), chunk_size):
+            for result in chatbot.chat_batch(chunk, concurrency):
+                result["index"] += offset
+                errors += result["error"] is not None
+                out.write(json.dumps(result, ensure_ascii=False) + "\n")
+            out.flush()
+            offset += len(chunk)
+            total += len(chunk)
+            print(f"已完成 {total} 条（失败 {errors} 条），耗时 {time.time() - start:.1f}s", file=sys.stderr)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="批量生成餐厅推荐，结果输出为 NDJSON")
+    parser.add_argument("input", help="JSONL 文件，每行一条 {id, question, user_id | preferences, location?}")
+    parser.add_argument("--questions", help="每行一个问题；指定时 input 每行视为一份用户画像，与每个问题组合")
+    parser.add_argument("--output", help="输出文件，默认写到标准输出")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY_DEFAULT)
+    parser.add_argument("--chunk-size", type=int, default=BATCH_CHUNK_SIZE)
+    args = parser.parse_args()
+    run(Path(args.input), Path(args.output) if args.output else None,
+        Path(args.questions) if args.questions else None, args.concurrency, args.chunk_size)
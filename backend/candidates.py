@@ -0,0 +1,241 @@
+import queue
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+# ========== 常量定义 ==========
+# 每个画像保留的候选餐厅数
+CANDIDATE_SET_SIZE = 60
+# 最多缓存的用户画像数（LRU）
+CANDIDATE_CACHE_MAX_USERS = 10000
+# 检索重排时画像先验所占权重（其余为向量检索/分面排序的名次）
+PRIOR_WEIGHT = 0.3
+# 偏好页评分项（frontend-web PreferenceContext 的 ratings 键）-> 餐厅表数值列。
+# 只映射有对应数据的项；卫生、距离、排队、健康、热量、辣度等没有数据列，
+# 在画像打分中直接忽略（不计入权重，也不借用其他列）。valueForMoney 在下方单独按评分/人均计算
+RATING_COLUMNS = {
+    "taste": "dp_taste_rating",
+    "environment": "dp_env_rating",
+    "service": "dp_service_rating",
+    "platformRating": "dp_rating",
+}
+# 画像得分构成：预算匹配、评分项加权质量、人气
+BUDGET_WEIGHT = 0.4
+QUALITY_WEIGHT = 0.4
+POPULARITY_WEIGHT = 0.2
+LIKE_BONUS = 0.2
+DISLIKE_FACTOR = 0.3
+
+_TERM_SPLIT_RE = re.compile(r"[,，、;；/\s]+")
+_EMPTY_TERMS = {"", "无", "没有", "暂无", "不限"}
+
+
+def _normalize(values: np.ndarray) -> np.ndarray:
+    """按百分位缩放到 [0, 1]（不受极端值影响），缺失值取 0.5"""
+    result = np.full(len(values), 0.5, dtype=np.float32)
+    valid = np.flatnonzero(~np.isnan(values))
+    if len(valid) > 1:
+        ranks = np.argsort(np.argsort(values[valid], kind="stable"), kind="stable")
+        result[valid] = ranks / (len(valid) - 1)
+    return result
+
+
+def _terms(text) -> List[str]:
+    return [t for t in _TERM_SPLIT_RE.split(str(text or "")) if t not in _EMPTY_TERMS]
+
+
+def _term_mask(table, terms: List[str]) -> np.ndarray:
+    """类型、推荐菜或评论关键词中包含任一词的餐厅"""
+    mask = np.zeros(len(table), dtype=bool)
+    if not terms:
+        return mask
+    codes, vocab = table.categories["type"]
+    mask |= np.array([any(t in v for t in terms) for v in vocab], dtype=bool)[codes]
+    for row_id, (dishes, keywords) in enumerate(zip(table.lists["dp_recommendation_dish"],
+                                                    table.lists["dp_comment_keywords"])):
+        if not mask[row_id]:
+            text = " ".join(dishes) + " " + " ".join(k for k, _ in keywords)
+            mask[row_id] = any(t in text for t in terms)
+    return mask
+
+
+def score_restaurants(table, preferences: Dict) -> np.ndarray:
+    """按用户偏好给整张餐厅表打分（向量化），返回每行的先验得分"""
+    numeric = table.numeric
+    n = len(table)
+    cost = np.where(np.isnan(numeric["dp_cost"]), numeric["cost"], numeric["dp_cost"])
+
+    price = (preferences or {}).get("priceRange") or {}
+    budget = np.full(n, 0.5, dtype=np.float32)
+    if price:
+        low, high = float(price.get("min", 0) or 0), float(price.get("max", 0) or 0)
+        known = ~np.isnan(cost)
+        budget[known] = 1.0
+        if high > 0:
+            over = known & (cost > high)
+            budget[over] = np.clip(1 - (cost[over] - high) / high, 0, 1)
+        under = known & (cost < low)
+        budget[under] = 0.8
+
+    ratings = (preferences or {}).get("ratings") or {}
+    quality = np.zeros(n, dtype=np.float32)
+    total = 0.0
+    for key, column in RATING_COLUMNS.items():
+        weight = float(ratings.get(key, 0) or 0)
+        if weight > 0:
+            quality += weight * _normalize(numeric[column])
+            total += weight
+    value_weight = float(ratings.get("valueForMoney", 0) or 0)
+    if value_weight > 0:
+        rating = np.where(np.isnan(numeric["dp_rating"]), numeric["rating"], numeric["dp_rating"])
+        quality += value_weight * _normalize(rating / np.maximum(cost, 1.0))
+        total += value_weight
+    quality = quality / total if total else _normalize(numeric["dp_rating"])
+
+    popularity = _normalize(numeric["dp_comment_num"])
+    score = BUDGET_WEIGHT * budget + QUALITY_WEIGHT * quality + POPULARITY_WEIGHT * popularity
+
+    extra = (preferences or {}).get("preferences") or {}
+    score = score + LIKE_BONUS * _term_mask(table, _terms(extra.get("likes")))
+    disliked = _term_mask(table, _terms(extra.get("dislikes")) + _terms(extra.get("allergies")))
+    score[disliked] *= DISLIKE_FACTOR
+    return score.astype(np.float32)
+
+
+class CandidateSet:
+    """某个用户画像在 (偏好版本, 索引版本) 下的候选餐厅，行号升序保存便于二分查找"""
+    __slots__ = ("user_id", "pref_version", "index_version", "row_ids", "scores", "built_at")
+
+    def __init__(self, user_id: str, pref_version: int, index_version: str,
+                 row_ids: np.ndarray, scores: np.ndarray):
+        order = np.argsort(row_ids)
+        self.user_id = user_id
+        self.pref_version = pref_version
+        self.index_version = index_version
+        self.row_ids = row_ids[order].astype(np.int32)
+        self.scores = scores[order].astype(np.float32)
+        self.built_at = time.time()
+
+    @classmethod
+    def build(cls, table, preferences: Dict, user_id: str = "", pref_version: int = 0,
+              index_version: str = "", size: int = CANDIDATE_SET_SIZE) -> "CandidateSet":
+        scores = score_restaurants(table, preferences)
+        top = np.argsort(-scores, kind="stable")[:size]
+        # 先验得分缩放到 [0, 1]
+        top_scores = scores[top]
+        span = top_scores.max() - top_scores.min() if len(top) else 0.0
+        prior = (top_scores - top_scores.min()) / span if span > 0 else np.ones(len(top), dtype=np.float32)
+        return cls(user_id, pref_version, index_version, top, prior)
+
+    def prior(self, row_id: Optional[int]) -> float:
+        """候选集中的先验得分，不在候选集中时为 0"""
+        if row_id is None:
+            return 0.0
+        i = int(np.searchsorted(self.row_ids, row_id))
+        return float(self.scores[i]) if i < len(self.row_ids) and self.row_ids[i] == row_id else 0.0
+
+    def rerank(self, ranked: List[Tuple[Optional[int], Any]], weight: float = PRIOR_WEIGHT) -> List[Any]:
+        """把检索名次与画像先验加权合并后重排"""
+        n = len(ranked)
+        scored = [((1 - weight) * (1 - i / n) + weight * self.prior(row_id), -i, doc)
+                  for i, (row_id, doc) in enumerate(ranked)]
+        scored.sort(key=lambda item: (item[0], item[1]), reverse=True)
+        return [doc for _, _, doc in scored]
+
+
+class CandidateCache:
+    """按用户缓存画像候选集，由后台线程增量维护。
+
+    只有用户偏好版本或索引版本变化时才重新计算；请求路径上只读缓存，
+    未命中或已过期时登记刷新并返回 None（本轮检索不使用先验）。
+    """
+
+    def __init__(self, load_preferences: Callable[[str], Any],
+                 max_users: int = CANDIDATE_CACHE_MAX_USERS, size: int = CANDIDATE_SET_SIZE):
+        self.load_preferences = load_preferences  # user_id -> PreferenceSnapshot
+        self.max_users = max_users
+        self.size = size
+        self._sets: "OrderedDict[str, CandidateSet]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._queue: "queue.Queue[str]" = queue.Queue()
+        self._pending = set()
+        self._table = None
+        self._index_version = ""
+        self.hits = 0
+        self.misses = 0
+        self.builds = 0
+        self.build_seconds = 0.0
+        self._worker = threading.Thread(target=self._run, daemon=True, name="candidate-refresh")
+        self._worker.start()
+
+    def set_table(self, table, index_version: str):
+        """索引切换后使用新的餐厅表，并重新计算所有已缓存用户的候选集"""
+        with self._lock:
+            self._table, self._index_version = table, index_version
+            users = list(self._sets)
+        for user_id in users:
+            self.refresh(user_id)
+
+    def refresh(self, user_id: str):
+        """登记后台刷新（同一用户排队中时不重复登记）"""
+        with self._lock:
+            if user_id in self._pending:
+                return
+            self._pending.add(user_id)
+        self._queue.put(user_id)
+
+    def get(self, user_id: str, pref_version: int) -> Optional[CandidateSet]:
+        with self._lock:
+            entry = self._sets.get(user_id)
+            fresh = (entry is not None and entry.pref_version == pref_version
+                     and entry.index_version == self._index_version)
+            if fresh:
+                self._sets.move_to_end(user_id)
+                self.hits += 1
+            else:
+                self.misses += 1
+        if not fresh:
+            self.refresh(user_id)
+        return entry if fresh else None
+
+    def _run(self):
+        while True:
+            user_id = self._queue.get()
+            with self._lock:
+                self._pending.discard(user_id)
+                table, index_version = self._table, self._index_version
+            if table is None:
+                continue
+            try:
+                start = time.perf_counter()
+                snapshot = self.load_preferences(user_id)
+                entry = CandidateSet.build(table, snapshot.preferences, user_id, snapshot.version,
+                                           index_version, self.size)
+                elapsed = time.perf_counter() - start
+            except Exception as e:
+                print(f"计算用户 {user_id} 的候选集时出错: {str(e)}")
+                continue
+            with self._lock:
+                self._sets[user_id] = entry
+                self._sets.move_to_end(user_id)
+                while len(self._sets) > self.max_users:
+                    self._sets.popitem(last=False)
+                self.builds += 1
+                self.build_seconds += elapsed
+
+    def metrics(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "users": len(self._sets),
+                "pending": len(self._pending),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / total if total else 0.0,
+                "builds": self.builds,
+                "build_ms_avg": self.build_seconds / self.builds * 1000 if self.builds else 0.0,
+            }
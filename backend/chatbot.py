@@ -2,61 +2,185 @@ import os
 import json
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, List, Optional, Any
+from typing import Dict, Iterator, List, Optional, Any, Tuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
 import getpass
+import shutil
 import time # Added for timing
+import threading
+from collections import OrderedDict
 import traceback # Added for detailed traceback
+from contextlib import contextmanager
 import openai # Added for openai.APITimeoutError
 import torch # Added for torch.cuda.is_available()
+import numpy as np
 
 from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_openai import ChatOpenAI
-from langchain_community.vectorstores import FAISS
 from langchain.prompts import (
     PromptTemplate,
     SystemMessagePromptTemplate,
     HumanMessagePromptTemplate,
     ChatPromptTemplate,
 )
+from langchain_core.messages import SystemMessage
 from langchain_core.output_parsers import StrOutputParser
 from langchain.schema.runnable import RunnablePassthrough, RunnableMap, RunnableLambda
-from langchain.memory import ConversationBufferMemory
+
+from backend.memory import RollingSummaryMemory
+from backend.restaurant_store import RestaurantTable
+from backend.facets import FacetIndex
+from backend.preference_store import DEFAULT_USER_ID, PreferenceSnapshot, PreferenceStore
+from backend.llm_metrics import LLMUsageTracker
+from backend.http_pool import SharedHTTPClients
+from backend.embedding_cache import CachedEmbedder, EMBEDDING_CACHE_SIZE_DEFAULT
+from backend.intent import IntentRouter, INTENT_DETAIL, INTENT_RECOMMEND, RESPONSE_TEMPLATES, format_restaurant_detail
+from backend.query_rewriter import QueryRewriter, RetrievalPlan, apply_plan, combine_vectors
+from backend.diversity import MMR_LAMBDA_DEFAULT, mmr_select
+from backend.retrieval_depth import RetrievalDepthStats, adaptive_k, query_scope
+from backend.candidates import CANDIDATE_CACHE_MAX_USERS, CandidateCache, CandidateSet
+from backend.deadline import (CHAT_DEADLINE_DEFAULT, LLM_CHUNK_TIMEOUT_DEFAULT, LLM_HEDGE_AFTER_DEFAULT,
+                              LLM_MIN_BUDGET, Deadline, DeadlineExceeded, DeadlineStats, format_fallback_answer,
+                              hedged_stream)
+from backend.index_manager import IndexManager, INDEX_ROOT, dataset_snapshot, load_vector_db, resolve_index_dir
+from backend.shards import DEFAULT_LOCATION, SHARD_CACHE_SIZE_DEFAULT, SHARD_IDLE_SECONDS_DEFAULT, ShardView
+from backend.admission import AdmissionController, ServerBusyError
+from backend.singleflight import SingleFlight, fingerprint, normalize_question
 
 # ========== 常量定义 ==========
 # 使用绝对路径
-FAISS_REVIEWS_PATH_COSINE = Path(__file__).parent / "faiss_index_cosine"
+FAISS_REVIEWS_PATH_COSINE = INDEX_ROOT
 FAISS_INDEX_NAME = "index"
-HISTORY_PATH = Path(__file__).parent / "data" / "chat_history.json"
-PREF_PATH = Path(__file__).parent / "data" / "user_preferences.json"
+RETRIEVAL_K = 20  # 固定检索深度（ADAPTIVE_K=0 时使用）
+# 先取 RETRIEVAL_FETCH_K 个候选，经分面/改写条件重排后用 MMR 选出 k 个差异较大的餐厅
+RETRIEVAL_FETCH_K = 40
+INDEX_WATCH_INTERVAL_DEFAULT = 10.0  # 秒，轮询新索引版本的间隔
+# LLM 准入控制：最大并发调用数、等待队列长度、排队超时（秒）
+LLM_MAX_CONCURRENCY_DEFAULT = 4
+LLM_QUEUE_SIZE_DEFAULT = 16
+LLM_QUEUE_TIMEOUT_DEFAULT = 30.0
+HISTORY_PATH = Path(__file__).parent / "data" / "chat_history.json"  # 旧版全局历史，首次启动时迁移为默认用户的历史
+HISTORY_DIR = Path(__file__).parent / "data" / "history"  # 每个用户一个 <用户>.json
+# 同时保留对话记忆的用户数上限，超出时淘汰最久未活跃的用户（历史文件不受影响）
+MEMORY_MAX_USERS = 1000
+# 对话记忆：保留最近 N 轮原文，更早轮次压缩为摘要，整体不超过 token 预算
+MEMORY_MAX_TURNS_DEFAULT = 3
+MEMORY_TOKEN_BUDGET_DEFAULT = 1500
+MEMORY_SUMMARY_TOKENS_DEFAULT = 300
+# 批量推荐：LLM 并发上限、相对在线请求的准入优先级（更低）、准入被拒时的重试次数
+BATCH_CONCURRENCY_DEFAULT = 4
+BATCH_MAX_CONCURRENCY = 16
+BATCH_PRIORITY = -1
+BATCH_BUSY_RETRIES = 3
 
 class Chatbot:
     _instance = None  # 单例模式实例
 
     def __init__(self):
         """初始化Chatbot"""
-        if not HISTORY_PATH.parent.exists():
-            HISTORY_PATH.parent.mkdir(parents=True)
-        if not HISTORY_PATH.exists():
-            with open(HISTORY_PATH, "w", encoding="utf-8") as f:
-                json.dump([], f, ensure_ascii=False)
-                
-        if not PREF_PATH.parent.exists():
-            PREF_PATH.parent.mkdir(parents=True)
-        if not PREF_PATH.exists():
-            with open(PREF_PATH, "w", encoding="utf-8") as f:
-                json.dump({}, f, ensure_ascii=False)
-        
+        HISTORY_DIR.mkdir(parents=True, exist_ok=True)
+        default_history = HISTORY_DIR / f"{DEFAULT_USER_ID}.json"
+        if HISTORY_PATH.exists() and not default_history.exists():
+            shutil.copyfile(HISTORY_PATH, default_history)
+            print(f"已将 {HISTORY_PATH} 迁移为默认用户的对话历史")
+
         print("正在初始化模型...")
-        self.llm, self.vector_db = self._init_models()
-        self.memory = ConversationBufferMemory(
-            return_messages=True,
-            output_key="answer",
-            input_key="question"
+        self.llm_usage = LLMUsageTracker()
+        self.http_clients = SharedHTTPClients.get_instance()
+        self.llm, self.index_manager = self._init_models()
+        self.embedder = CachedEmbedder(
+            self.index_manager.embeddings,
+            max_size=int(os.environ.get("EMBEDDING_CACHE_SIZE", EMBEDDING_CACHE_SIZE_DEFAULT)))
+        # 本地意图识别：寒暄、无关问题与餐厅详情不经过检索和 LLM（INTENT_ROUTER=0 关闭）
+        self.router = IntentRouter(self.embedder.embed_query) if os.environ.get("INTENT_ROUTER", "1") != "0" else None
+        if self.router is not None:
+            self.router.warm_up()
+        # 多轮追问的本地查询改写：按用户保存状态，指代消解 + 携带预算/品类等条件
+        self.rewriter = QueryRewriter()
+        # 检索多样性（MMR 的相关性权重，1.0 关闭），同品牌分店视为重复
+        self.diversity = float(os.environ.get("RETRIEVAL_DIVERSITY", MMR_LAMBDA_DEFAULT))
+        # 按相似度分布与问题类型自适应检索深度（ADAPTIVE_K=0 时固定为 RETRIEVAL_K）
+        self.adaptive_k = os.environ.get("ADAPTIVE_K", "1") != "0"
+        self.depth_stats = RetrievalDepthStats()
+        # 单次请求的延迟预算与首 token 对冲阈值（秒，LLM_HEDGE_AFTER=0 关闭对冲）
+        self.deadline_budget = float(os.environ.get("CHAT_DEADLINE", CHAT_DEADLINE_DEFAULT))
+        self.hedge_after = float(os.environ.get("LLM_HEDGE_AFTER", LLM_HEDGE_AFTER_DEFAULT))
+        # 开始输出后分片间的最长间隔（秒）；预算只约束到首 token 为止，正常生成中的回答不会被截断
+        self.chunk_timeout = float(os.environ.get("LLM_CHUNK_TIMEOUT", LLM_CHUNK_TIMEOUT_DEFAULT))
+        self.deadline_stats = DeadlineStats()
+        # 餐厅表与分面随索引版本加载，和向量库在同一次切换中生效
+        self.index_manager.add_loader("catalog", self._load_catalog)
+        # 餐厅详情、输入联想等接口通过 RestaurantTable.get_instance() 读到的也是已发布版本的餐厅表
+        RestaurantTable.bind(lambda: self.index_manager.resource("catalog")[0])
+        self._full_view: Optional[ShardView] = None
+        # 请求未带位置时按该坐标路由分片
+        self.default_location = os.environ.get("DEFAULT_LOCATION", DEFAULT_LOCATION)
+        self._state_lock = threading.Lock()
+        self.flights = SingleFlight()
+        # 按用户偏好版本缓存提示词变量，偏好保存时由变更通知精确失效
+        self.preferences = PreferenceStore.get_instance()
+        self._prompt_vars: Dict[str, tuple] = {}
+        # 每个用户独立的对话记忆（LRU，最多 MEMORY_MAX_USERS 个）
+        self._memories: "OrderedDict[str, RollingSummaryMemory]" = OrderedDict()
+        print(f"对话记忆: 按用户保存，最多 {MEMORY_MAX_USERS} 个用户")
+        self.preferences.subscribe(self._on_preference_change)
+        # 按 (偏好版本, 索引版本) 预计算的画像候选集，作为检索先验（CANDIDATE_PRIOR=0 关闭）
+        self.candidates = None
+        if os.environ.get("CANDIDATE_PRIOR", "1") != "0":
+            self.candidates = CandidateCache(self.preferences.get)
+            self.candidates.set_table(self.restaurants, self.index_manager.version)
+            for user_id in self.preferences.user_ids()[:CANDIDATE_CACHE_MAX_USERS]:
+                self.candidates.refresh(user_id)
+        self.prompt_chain = self._setup_chain()
+        self.admission = AdmissionController(
+            max_concurrent=int(os.environ.get("LLM_MAX_CONCURRENCY", LLM_MAX_CONCURRENCY_DEFAULT)),
+            max_queue=int(os.environ.get("LLM_QUEUE_SIZE", LLM_QUEUE_SIZE_DEFAULT)),
+            timeout=float(os.environ.get("LLM_QUEUE_TIMEOUT", LLM_QUEUE_TIMEOUT_DEFAULT))
         )
-        self.chain = self._setup_chain()
+        self.index_manager.on_swap(self._on_index_swap)
+        self.index_manager.start_watching(
+            float(os.environ.get("INDEX_WATCH_INTERVAL", INDEX_WATCH_INTERVAL_DEFAULT)))
         print("模型初始化完成")
 
+    @property
+    def restaurants(self) -> RestaurantTable:
+        """与当前索引版本对应的餐厅表"""
+        return self.index_manager.resource("catalog")[0]
+
+    @property
+    def facets(self) -> FacetIndex:
+        return self.index_manager.resource("catalog")[1]
+
+    @property
+    def vector_db(self):
+        """当前生效的完整向量库（分片模式下为 None）；索引热切换后自动指向新版本"""
+        return self.index_manager.vector_db
+
+    def _on_index_swap(self, version: str, vector_db):
+        """索引切换后同步刷新记忆中的餐厅名称与画像候选集（餐厅表已随索引一起切换）"""
+        known_names = sorted(self.restaurants.ids_by_name, key=len, reverse=True)
+        with self._state_lock:
+            for memory in self._memories.values():
+                memory.known_names = known_names
+        if self.candidates is not None:
+            self.candidates.set_table(self.restaurants, version)
+
+    def _on_preference_change(self, snapshot: PreferenceSnapshot):
+        """偏好更新后丢弃该用户旧版本的提示词变量，并在后台重新计算候选集"""
+        self._prompt_vars.pop(snapshot.user_id, None)
+        if self.candidates is not None:
+            self.candidates.refresh(snapshot.user_id)
+
+    @staticmethod
+    def _load_catalog(version: str, index_dir: Path) -> Tuple[RestaurantTable, FacetIndex]:
+        """加载索引版本对应的餐厅表与分面；旧版本索引没有分面文件时由餐厅表现场构建"""
+        table = RestaurantTable.load(dataset_snapshot(index_dir), version)
+        facets = FacetIndex.load(index_dir)
+        if facets is None:
+            facets = FacetIndex.from_table(table)
+        return table, facets
+
     def _init_models(self):
         """初始化LLM和向量数据库"""
         # 加载环境变量
@@ -83,9 +207,14 @@ class Chatbot:
                 openai_api_base=base_url, # 使用从 .env 读取的 base_url
                 model_name=model_name,    # 使用从 .env 读取的 model_name
                 temperature=0.7,
-                request_timeout=120,      # 保持较长超时，但流式模式通常能更快返回
-                max_retries=3,
-                streaming=True            # 启用流式处理
+                request_timeout=120,      # 上限；每次调用按请求剩余的延迟预算另行设置超时
+                max_retries=1,            # 超时由延迟预算兜底，不再多次重试叠加等待
+                streaming=True,           # 启用流式处理
+                stream_usage=True,        # 流式响应末尾返回 token 用量（含前缀缓存命中数）
+                callbacks=[self.llm_usage],
+                # 共用进程内的长连接池，避免每个链/会话各自建连和 TLS 握手
+                http_client=self.http_clients.sync_client,
+                http_async_client=self.http_clients.async_client
             )
             print(f"成功初始化LLM: model={model_name}, base_url={base_url}, streaming=True")
         except Exception as e:
@@ -107,13 +236,19 @@ class Chatbot:
                 }
             )
             
-            vector_db = FAISS.load_local(
-                folder_path=FAISS_REVIEWS_PATH_COSINE,
-                embeddings=embedding_model,
+            index_manager = IndexManager(
+                embedding_model,
+                root=FAISS_REVIEWS_PATH_COSINE,
                 index_name=FAISS_INDEX_NAME,
-                allow_dangerous_deserialization=True
+                mmap=os.environ.get("FAISS_MMAP", "1") != "0",
+                # 多城市数据按地理分片，只加载用户附近的分片（INDEX_SHARDED=0 始终使用完整索引）
+                sharded=os.environ.get("INDEX_SHARDED", "auto"),
+                shard_options={
+                    "max_loaded": int(os.environ.get("SHARD_CACHE_SIZE", SHARD_CACHE_SIZE_DEFAULT)),
+                    "idle_seconds": float(os.environ.get("SHARD_IDLE_SECONDS", SHARD_IDLE_SECONDS_DEFAULT)),
+                }
             )
-            return llm, vector_db
+            return llm, index_manager
             
         except Exception as e:
             print(f"初始化向量库时出错: {str(e)}")
@@ -126,35 +261,28 @@ class Chatbot:
             cls._instance = cls()
         return cls._instance
         
-    def chat(self, message: str) -> str:
-        """处理用户消息并返回回复"""
+    def chat(self, message: str, priority: int = 0, user_id: Optional[str] = None,
+             budget: Optional[float] = None, location: Optional[str] = None) -> str:
+        """处理用户消息并返回回复；LLM 繁忙时抛出 ServerBusyError"""
         print(f"\\n===== Chatbot.chat: Received message at {datetime.now()} =====\\nUser message: {message}")
         
         start_time = time.time() # Start timing before any processing
 
         try:
-            # 用户偏好现在在链中加载，这里准备链的输入
-            input_data = {
-                "question": message,
-            }
-            print(f"\\n===== Chatbot.chat: Input data for chain =====\\n{json.dumps(input_data, indent=2, ensure_ascii=False)}")
-            
             print(f"\\n===== Chatbot.chat: Invoking chain at {datetime.now()} =====")
             chain_start_time = time.time()
-            response = self.chain.invoke(input_data)
+            response = "".join(self.chat_stream(message, priority, user_id, budget, location))
             chain_end_time = time.time()
             print(f"\\n===== Chatbot.chat: Chain invoked successfully in {chain_end_time - chain_start_time:.2f} seconds at {datetime.now()} =====")
-            
-            # 键名必须与初始化 ConversationBufferMemory 时的 input_key 和 output_key 一致
-            self.memory.save_context({"question": message}, {"answer": response})
-            
-            # 保存对话历史
-            self._append_history(message, response)
-            
+
             response_snippet = response[:500] + '...' if len(response) > 500 else response
             print(f"\\n===== Chatbot.chat: Sending response snippet to frontend =====\\n{response_snippet}")
             return response
-            
+
+        except ServerBusyError as e:
+            print(f"\n===== Chatbot.chat: Rejected by admission control: {str(e)} =====")
+            raise
+
         except openai.APITimeoutError as e:
             current_time = time.time()
             duration = current_time - start_time
@@ -177,23 +305,256 @@ class Chatbot:
             traceback.print_exc()
             return f"处理您的请求时发生错误。错误详情: {str(e)}"
 
-    def _load_user_preference(self) -> Dict:
-        """加载用户偏好设置"""
-        if PREF_PATH.exists():
-            try:
-                with open(PREF_PATH, "r", encoding="utf-8") as f:
-                    return json.load(f)
-            except Exception as e:
-                print(f"加载用户偏好时出错: {str(e)}")
-        return {}
+    def chat_stream(self, message: str, priority: int = 0, user_id: Optional[str] = None,
+                    budget: Optional[float] = None, location: Optional[str] = None) -> Iterator[str]:
+        """流式生成回复；相同问题、偏好、索引版本与检索分片的并发请求共享同一次检索和 LLM 调用。
+
+        budget 为本次请求的延迟预算（秒），默认取 CHAT_DEADLINE；预算用完时返回由检索结果生成的降级回答。
+        location 为用户位置 "经度,纬度"，分片模式下只检索附近的分片，默认取 DEFAULT_LOCATION。
+        """
+        deadline = Deadline(min(budget, self.deadline_budget) if budget else self.deadline_budget)
+        user_id = self.preferences.normalize_user_id(user_id)
+        reply = self._route(message, user_id)
+        if reply is not None:
+            yield reply
+            return
+        view = self._view(location)
+        plan = self.rewriter.plan(message, view.table, user_id)
+        with self._state_lock:
+            history = self._memory(user_id).load_memory_variables({}).get("history", "")
+        key = self._flight_key(message, user_id, plan, view, history)
+        stream, is_leader = self.flights.stream(
+            key, lambda: self._generate(message, priority, user_id, plan, deadline, view, history))
+        if not is_leader:
+            print(f"\\n===== Chatbot.chat_stream: Coalesced into in-flight request {key} =====")
+        chunks = []
+        for chunk in stream:
+            chunks.append(chunk)
+            yield chunk
+        # 合并的请求各自写入自己的记忆、改写状态与历史
+        self._record_turn(user_id, message, "".join(chunks), plan)
+
+    def _memory(self, user_id: str) -> RollingSummaryMemory:
+        """取用户的对话记忆，不存在时创建（调用方持有 self._state_lock）"""
+        memory = self._memories.get(user_id)
+        if memory is None:
+            memory = self._memories[user_id] = create_memory(list(self.restaurants.ids_by_name), log=False)
+            while len(self._memories) > MEMORY_MAX_USERS:
+                self._memories.popitem(last=False)
+        else:
+            self._memories.move_to_end(user_id)
+        return memory
+
+    def _record_turn(self, user_id: str, message: str, response: str, plan: Optional[RetrievalPlan]):
+        """一轮对话结束后写入该用户的记忆、改写状态与历史"""
+        # 键名必须与初始化 RollingSummaryMemory 时的 input_key 和 output_key 一致
+        with self._state_lock:
+            self._memory(user_id).save_context({"question": message}, {"answer": response})
+            self.rewriter.observe(message, response, plan, self.restaurants, user_id)
+            self._append_history(user_id, message, response)
+
+    def _route(self, message: str, user_id: str = DEFAULT_USER_ID) -> Optional[str]:
+        """本地意图识别；可直接回答时返回回复文本，否则返回 None 交给检索 + LLM"""
+        if self.router is None:
+            return None
+        start = time.time()
+        table = self.restaurants
+        restaurant_id = table.find_in_text(message)
+        if restaurant_id is None:
+            restaurant_id = self.rewriter.resolve_reference(message, table, user_id)
+        intent = self.router.classify(message, restaurant_id)
+        if intent == INTENT_RECOMMEND:
+            return None
+        if intent == INTENT_DETAIL:
+            reply = format_restaurant_detail(table.row_dict(restaurant_id))
+        else:
+            reply = RESPONSE_TEMPLATES[intent]
+        with self._state_lock:
+            if intent == INTENT_DETAIL:
+                # 详情回复写入记忆，后续追问仍能引用这家餐厅
+                self._memory(user_id).save_context({"question": message}, {"answer": reply})
+                self.rewriter.observe(message, reply, None, table, user_id)
+            self._append_history(user_id, message, reply)
+        print(f"\\n===== Chatbot.chat_stream: Answered locally as '{intent}' in {(time.time() - start) * 1000:.1f} ms =====")
+        return reply
+
+    def _flight_key(self, message: str, user_id: str, plan: RetrievalPlan, view, history: str = "") -> str:
+        """按偏好与对话记忆的内容而非用户或版本号计算合并键：两者相同的不同用户共享同一次检索与 LLM 调用"""
+        return fingerprint([
+            normalize_question(message),
+            fingerprint(self.preferences.get(user_id).preferences),
+            fingerprint(history),
+            self.index_manager.version,
+            plan.key(),
+            view.key,
+        ])
+
+    def _generate(self, message: str, priority: int, user_id: str, plan: RetrievalPlan,
+                  deadline: Deadline, view, history: str = "") -> Iterator[str]:
+        """实际执行检索与 LLM 调用；每个合并后的请求只运行一次，记忆与历史由各请求自行写入"""
+        # 用户偏好在链中按 user_id 加载，这里准备链的输入
+        input_data = {
+            "question": message,
+            "user_id": user_id,
+            "plan": plan,
+        }
+        print(f"\\n===== Chatbot.chat: Input data for chain =====\\n{json.dumps(input_data, indent=2, ensure_ascii=False, default=repr)}")
+        docs = self._retrieve(message, plan, user_id, view, deadline)
+        yield from self._answer(message, docs, self._prompt_variables(user_id), history, priority, deadline)
+
+    def _answer(self, question: str, docs: List[Any], variables: Dict, history: str,
+                priority: int, deadline: Deadline) -> Iterator[str]:
+        """由检索结果生成回答：排队、检索与首 token 受延迟预算约束，开始输出后只受分片间隔约束。
+
+        返回值为降级发生的阶段（未降级时为 None）。
+        """
+        chunks = []
+        try:
+            with self._llm_slot(priority, deadline):
+                prompt = self.prompt_chain.invoke({
+                    "question": question,
+                    "context": docs,
+                    "history": history,
+                    "variables": variables,
+                })
+                # HTTP 读超时作用于每次读取而不是整个流，取剩余预算与分片间隔上限中的较大者
+                llm = self.llm.bind(timeout=max(deadline.remaining(), self.chunk_timeout)) | StrOutputParser()
+                for chunk in hedged_stream(lambda: llm.stream(prompt), deadline, self.hedge_after,
+                                           self.deadline_stats, self.admission, self.chunk_timeout):
+                    chunks.append(chunk)
+                    yield chunk
+        except (DeadlineExceeded, openai.APITimeoutError) as e:
+            stage = getattr(e, "stage", "llm")
+            if chunks:
+                self.deadline_stats.incr("truncated")
+                yield "\n\n（回答超时，以上内容可能不完整）"
+            else:
+                self.deadline_stats.incr("degraded")
+                yield self._fallback_answer(docs)
+            print(f"\n===== Chatbot.chat: Deadline exceeded at '{stage}' after {deadline.elapsed():.2f}s, degraded =====")
+            return stage
+        return None
+
+    @contextmanager
+    def _llm_slot(self, priority: int, deadline: Deadline):
+        """在预算内排队占用 LLM 名额：最多等到只剩 LLM_MIN_BUDGET，因预算不足等不到名额时按超时降级。
+
+        队列已满或排队超过准入超时（预算仍充足）时照常抛出 ServerBusyError。
+        """
+        wait = deadline.remaining() - LLM_MIN_BUDGET
+        if wait <= 0:
+            raise DeadlineExceeded("retrieval")
+        try:
+            self.admission.acquire(priority, min(self.admission.timeout, wait))
+        except ServerBusyError:
+            if deadline.remaining() > LLM_MIN_BUDGET:
+                raise
+            raise DeadlineExceeded("queue")
+        try:
+            yield
+        finally:
+            self.admission.release()
+
+    def chat_batch(self, items: List[Dict], concurrency: Optional[int] = None) -> Iterator[Dict]:
+        """批量推荐（离线预计算等场景），不写入对话记忆与历史。
+
+        items 中每项为 {"id", "question", "user_id" 或 "preferences", 可选 "location"}；所有问题一次性编码，
+        路由到相同分片的问题以矩阵形式做一次 FAISS 检索，LLM 调用以有限并发、较低优先级执行。
+        结果按完成顺序逐条产出，单条出错时在该条的 error 中返回。
+        """
+        concurrency = max(1, min(concurrency or BATCH_CONCURRENCY_DEFAULT, BATCH_MAX_CONCURRENCY))
+        valid = []
+        for index, item in enumerate(items):
+            question = str(item.get("question") or "").strip()
+            if question:
+                valid.append((index, question))
+            else:
+                yield {"index": index, "id": item.get("id"), "response": "", "restaurants": [],
+                       "restaurant_keys": [], "degraded": None, "error": "缺少 question", "took_ms": 0.0}
+        if not valid:
+            return
+        start = time.time()
+        vectors = self.embedder.embed_documents([question for _, question in valid])
+        # 按路由到的分片分组，每组做一次矩阵检索
+        groups: Dict[Tuple[str, ...], Tuple[Any, List[int]]] = {}
+        for i, (index, _) in enumerate(valid):
+            view = self._view(items[index].get("location"))
+            groups.setdefault(view.key, (view, []))[1].append(i)
+        views, candidates = [None] * len(valid), [None] * len(valid)
+        for view, members in groups.values():
+            for i, docs in zip(members, view.search(vectors[members], RETRIEVAL_FETCH_K)):
+                views[i], candidates[i] = view, docs
+        print(f"批量推荐: {len(valid)} 条问题（{len(groups)} 组分片），编码与检索耗时 "
+              f"{(time.time() - start) * 1000:.1f} ms，并发 {concurrency}")
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="chat-batch") as pool:
+            futures = {
+                pool.submit(self._batch_item, items[index], question, vector, docs, view): index
+                for (index, question), vector, docs, view in zip(valid, vectors, candidates, views)
+            }
+            for future in as_completed(futures):
+                yield {"index": futures[future], **future.result()}
+
+    def _batch_item(self, item: Dict, question: str, vector: np.ndarray, docs: List[Any], view) -> Dict:
+        start = time.time()
+        result = {"id": item.get("id"), "response": "", "restaurants": [], "restaurant_keys": [], "degraded": None, "error": None}
+        try:
+            if item.get("preferences") is not None:
+                variables = build_prompt_variables(item["preferences"])
+                prior = CandidateSet.build(view.table, item["preferences"], index_version=view.table.version)
+            else:
+                user_id = self.preferences.normalize_user_id(item.get("user_id"))
+                variables = self._prompt_variables(user_id)
+                prior = self._candidate_prior(user_id)
+            docs = self._rank(question, docs, vector, None, view, prior)
+            table = view.table
+            row_ids = [r for r in dict.fromkeys(table.id_for_document(doc) for doc in docs) if r is not None]
+            result["restaurants"] = [table.texts["name"][r] for r in row_ids]
+            # 稳定 key 可直接用于 GET /restaurants 查询详情
+            result["restaurant_keys"] = [table.keys[r] for r in row_ids]
+            for attempt in range(BATCH_BUSY_RETRIES + 1):
+                try:
+                    deadline = Deadline(self.deadline_budget)
+                    result["response"], result["degraded"] = _consume(
+                        self._answer(question, docs, variables, "", BATCH_PRIORITY, deadline))
+                    break
+                except ServerBusyError as e:
+                    if attempt == BATCH_BUSY_RETRIES:
+                        raise
+                    time.sleep(e.retry_after)
+        except Exception as e:
+            print(f"批量推荐第 {item.get('id')} 项出错: {str(e)}")
+            result["error"] = str(e)
+        result["took_ms"] = round((time.time() - start) * 1000, 1)
+        return result
+
+    def _fallback_answer(self, docs: List[Any]) -> str:
+        """降级回答：按检索排序列出餐厅表中的基本信息"""
+        table = self.restaurants
+        row_ids = [table.id_for_document(doc) for doc in docs]
+        return format_fallback_answer([table.row_dict(r) for r in dict.fromkeys(row_ids) if r is not None])
+
+    def _prompt_variables(self, user_id: str) -> Dict:
+        """由用户偏好生成的提示词变量，按 (用户, 偏好版本) 缓存"""
+        snapshot = self.preferences.get(user_id)
+        cached = self._prompt_vars.get(snapshot.user_id)
+        if cached is not None and cached[0] == snapshot.version:
+            return cached[1]
+        variables = build_prompt_variables(snapshot.preferences)
+        self._prompt_vars[snapshot.user_id] = (snapshot.version, variables)
+        return variables
 
-    def _append_history(self, user_msg: str, bot_msg: str):
+    @staticmethod
+    def _history_path(user_id: str) -> Path:
+        return HISTORY_DIR / f"{user_id}.json"
+
+    def _append_history(self, user_id: str, user_msg: str, bot_msg: str):
         """添加新的对话记录"""
+        path = self._history_path(user_id)
         try:
             # 读取现有历史
             history = []
-            if HISTORY_PATH.exists():
-                with open(HISTORY_PATH, "r", encoding="utf-8") as f:
+            if path.exists():
+                with open(path, "r", encoding="utf-8") as f:
                     history = json.load(f)
             
             # 添加新对话
@@ -204,33 +565,146 @@ class Chatbot:
             })
             
             # 保存历史
-            with open(HISTORY_PATH, "w", encoding="utf-8") as f:
+            with open(path, "w", encoding="utf-8") as f:
                 json.dump(history, f, ensure_ascii=False, indent=2)
                 
         except Exception as e:
             print(f"保存对话历史时出错: {str(e)}")
 
-    def get_history(self) -> List[Dict]:
-        """获取对话历史"""
+    def get_history(self, user_id: Optional[str] = None) -> List[Dict]:
+        """获取某个用户的对话历史（未指定时为默认用户）"""
+        path = self._history_path(self.preferences.normalize_user_id(user_id))
         try:
-            if HISTORY_PATH.exists():
-                with open(HISTORY_PATH, "r", encoding="utf-8") as f:
+            if path.exists():
+                with open(path, "r", encoding="utf-8") as f:
                     return json.load(f)
             return []
         except Exception as e:
             print(f"读取对话历史时出错: {str(e)}")
             return []
 
-    def clear_history(self):
-        """清空对话历史"""
+    def clear_history(self, user_id: Optional[str] = None):
+        """清空某个用户的对话历史、记忆与改写状态（未指定时为默认用户）"""
+        user_id = self.preferences.normalize_user_id(user_id)
         try:
-            with open(HISTORY_PATH, "w", encoding="utf-8") as f:
-                json.dump([], f, ensure_ascii=False)
-            self.memory.clear()
+            with self._state_lock:
+                self._history_path(user_id).unlink(missing_ok=True)
+                self._memories.pop(user_id, None)
+                self.rewriter.reset(user_id)
         except Exception as e:
             print(f"清空对话历史时出错: {str(e)}")
             raise
 
+    def _retrieve(self, question: str, plan: Optional[RetrievalPlan] = None,
+                  user_id: Optional[str] = None, view=None, deadline: Optional[Deadline] = None) -> List[Any]:
+        """检索相关餐厅；未指定检索视图时取当前版本的向量库，保证热切换对进行中的请求无影响。
+
+        deadline 为本次请求的延迟预算，预算不足时跳过可选的重排步骤。
+        """
+        view = view or self._view()
+        vector = self.embedder.embed_query(question)
+        if plan is not None and plan.carry_text:
+            # 追问时把上一轮的餐厅、品类、预算等上下文向量合并进查询向量（均命中嵌入缓存时无需重新编码）
+            vector = combine_vectors(vector, self.embedder.embed_query(plan.carry_text))
+            print(f"查询改写: {plan}")
+        docs = view.search(vector[None, :], RETRIEVAL_FETCH_K)[0]
+        return self._rank(question, docs, vector, plan, view, self._candidate_prior(user_id), deadline)
+
+    def _candidate_prior(self, user_id: Optional[str]) -> Optional[CandidateSet]:
+        """当前偏好版本与索引版本下已算好的候选集；未就绪时返回 None，不阻塞请求"""
+        if self.candidates is None or user_id is None:
+            return None
+        return self.candidates.get(user_id, self.preferences.get(user_id).version)
+
+    def _view(self, location: Optional[str] = None):
+        """当前索引版本的检索视图：分片模式下路由到用户位置附近的分片，否则为完整向量库。
+
+        向量库、分片、餐厅表与分面从同一次切换的快照中一次取出，视图的 table / facets 与索引版本一致。
+        """
+        _, _, vector_db, shards, resources = self.index_manager.snapshot()
+        table, facets = resources["catalog"]
+        if shards is not None:
+            return shards.view(location or self.default_location, table, facets)
+        view = self._full_view
+        if view is None or view.store is not vector_db or view.table is not table:
+            # 行号 -> 文档、文档 -> 向量位置的映射每个索引版本构建一次
+            view = self._full_view = ShardView(vector_db, table, facets=facets)
+        return view
+
+    def _rank(self, question: str, docs: List[Any], vector: np.ndarray,
+              plan: Optional[RetrievalPlan], view, prior: Optional[CandidateSet] = None,
+              deadline: Optional[Deadline] = None) -> List[Any]:
+        """在向量检索候选上依次做分面重排、画像先验、改写条件过滤、自适应深度与多样化。
+
+        餐厅表与分面取自检索视图，与候选文档来自同一索引版本；画像候选集版本不一致时不使用。
+
+        剩余预算已不足以调用 LLM 时只保留改写条件过滤，跳过其余重排，尽快进入降级回答。
+        """
+        table, facet_index = view.table, view.facets
+        docs_by_row = view.docs_by_row
+        if prior is not None and prior.index_version != table.version:
+            prior = None
+        scope = query_scope(question, plan)
+        if deadline is not None and deadline.remaining() < LLM_MIN_BUDGET:
+            self.deadline_stats.incr("retrieval_shortcut")
+            if plan is not None:
+                docs = apply_plan(docs, plan, table, docs_by_row.get)
+            docs = docs[:RETRIEVAL_K]
+            self.depth_stats.record(scope, docs)
+            print(f"检索阶段预算不足（剩余 {deadline.remaining():.2f}s），跳过重排")
+            return docs
+        k = self._retrieval_depth(docs, vector, scope, view)
+        facets = facet_index.match(question)
+        if facets:
+            # 问题命中评论关键词或推荐菜时，按分面得分加权重排，并补充向量检索漏掉的高分餐厅
+            ranked = [(table.id_for_document(doc), doc) for doc in docs]
+            docs = facet_index.rerank(ranked, facets, docs_by_row.get)
+            print(f"分面命中: 关键词={[facet_index.keywords[j] for j in facets.keywords]}, "
+                  f"推荐菜={[facet_index.dishes[d] for d in facets.dishes]}, "
+                  f"避开={[facet_index.keywords[j] for j in facets.avoid]}")
+        if prior is not None:
+            # 与用户画像候选集求交：候选集内的餐厅按先验得分前移
+            docs = prior.rerank([(table.id_for_document(doc), doc) for doc in docs])
+        if plan is not None:
+            docs = apply_plan(docs, plan, table, docs_by_row.get)
+        if deadline is not None and deadline.remaining() < LLM_MIN_BUDGET:
+            docs = docs[:k]
+        else:
+            docs = self._diversify(docs, k, vector, view, table)
+        tokens = self.depth_stats.record(scope, docs)
+        print(f"检索深度: scope={scope}, k={len(docs)}, 上下文约 {tokens} tokens")
+        return docs
+
+    def _retrieval_depth(self, docs: List[Any], vector: np.ndarray, scope: str, view) -> int:
+        """由候选与查询向量的余弦相似度分布决定检索深度（与索引的距离度量无关）"""
+        if not self.adaptive_k or not docs:
+            return RETRIEVAL_K
+        vectors = view.vectors(docs)
+        if vectors is None:
+            return RETRIEVAL_K
+        query = vector / (np.linalg.norm(vector) or 1.0)
+        return adaptive_k(np.sort(vectors @ query)[::-1], scope)
+
+    def _diversify(self, docs: List[Any], k: int, vector: np.ndarray, view, table) -> List[Any]:
+        """在已排序的候选上做 MMR，相似度取索引中存储的文档向量。
+
+        相关性为查询与文档的余弦相似度，与按名次映射到同一相似度区间的排序分各占一半，
+        使分面、画像与改写条件的重排仍然生效，且与文档间相似度处于同一量纲。
+        """
+        if self.diversity >= 1.0 or len(docs) <= 1:
+            return docs[:k]
+        vectors = view.vectors(docs)
+        if vectors is None:
+            return docs[:k]
+        cosine = vectors @ (vector / (np.linalg.norm(vector) or 1.0))
+        low, high = float(cosine.min()), float(cosine.max())
+        rank = 1.0 - np.arange(len(docs), dtype=np.float32) / len(docs)
+        relevance = 0.5 * cosine + 0.5 * (low + (high - low) * rank)
+        row_ids = [table.id_for_document(doc) for doc in docs]
+        groups = [table.brand_of(r) if r is not None else f"#{i}" for i, r in enumerate(row_ids)]
+        selected = mmr_select(relevance, vectors, k, self.diversity, groups)
+        return [docs[i] for i in selected]
+
     def _setup_chain(self):
         """设置对话链和记忆"""
 
@@ -249,29 +723,14 @@ class Chatbot:
             print("===== End Retrieved Context =====\\n")
             return docs
 
+        # 检索在调用链之前完成（超时降级时需要用到检索结果），这里只记录上下文
         reviews_retriever = (
-            RunnableLambda(lambda x: x["question"]) 
-            | self.vector_db.as_retriever(search_kwargs={'k': 20})
+            RunnableLambda(lambda x: x["context"])
             | RunnableLambda(log_retrieved_context) # Log the retrieved context
         )
         
-        # 准备prompt模板
-        chat_template = ChatPromptTemplate.from_messages([
-            SystemMessagePromptTemplate(
-                prompt=PromptTemplate(
-                    input_variables=["history", "context", "user_preference", "preference_scores", 
-                                   "preferred_cuisines", "disliked_cuisines", "budget_range", 
-                                   "special_requirements"],
-                    template=system_prompt_template
-                )
-            ),
-            HumanMessagePromptTemplate(
-                prompt=PromptTemplate(
-                    input_variables=["question"],
-                    template="{question}"
-                )
-            )
-        ])
+        # 准备prompt模板（固定指令在前，便于命中前缀缓存）
+        chat_template = build_chat_template()
 
         def log_data_for_llm(data: Any) -> Any:
             print("\\n===== Data to be sent to LLM =====")
@@ -301,21 +760,21 @@ class Chatbot:
 
         review_chain = (
             RunnableMap({
-                "history": RunnableLambda(lambda _: self.memory.load_memory_variables({}).get("history", [])), # Ensure history is a list
+                "history": RunnableLambda(lambda x: x["history"]),
                 "context": reviews_retriever,
                 "question": RunnableLambda(lambda x: x["question"]), # Pass question explicitly
-                "user_preference": RunnableLambda(lambda _: format_user_preference(self._load_user_preference())),
-                "preference_scores": RunnableLambda(lambda _: extract_preference_vars(self._load_user_preference())["preference_scores"]),
-                "preferred_cuisines": RunnableLambda(lambda _: extract_preference_vars(self._load_user_preference()).get("preferred_cuisines", [])),
-                "disliked_cuisines": RunnableLambda(lambda _: extract_preference_vars(self._load_user_preference()).get("disliked_cuisines", [])),
-                "budget_range": RunnableLambda(lambda _: extract_preference_vars(self._load_user_preference()).get("budget_range", "未设置")),
-                "special_requirements": RunnableLambda(lambda _: extract_preference_vars(self._load_user_preference()).get("special_requirements", "无"))            })
+                "user_preference": RunnableLambda(lambda x: x["variables"]["user_preference"]),
+                "preference_scores": RunnableLambda(lambda x: x["variables"]["preference_scores"]),
+                "preferred_cuisines": RunnableLambda(lambda x: x["variables"]["preferred_cuisines"]),
+                "disliked_cuisines": RunnableLambda(lambda x: x["variables"]["disliked_cuisines"]),
+                "budget_range": RunnableLambda(lambda x: x["variables"]["budget_range"]),
+                "special_requirements": RunnableLambda(lambda x: x["variables"]["special_requirements"])
+            })
             | chat_template
             | RunnableLambda(log_data_for_llm) # Log data before sending to LLM
-            | self.llm
-            | StrOutputParser()
         )
         
+        # 返回渲染好的提示词；LLM 调用在 _answer 中按延迟预算执行
         return review_chain
 
 # ========== 初始化模型和向量库 ==========
@@ -345,7 +804,9 @@ def init_models():
             temperature=0.7,
             request_timeout=120,  # 从 30 修改为 120
             max_retries=3,      # 最多重试3次
-            streaming=True      # 启用流式处理
+            streaming=True,     # 启用流式处理
+            http_client=SharedHTTPClients.get_instance().sync_client,
+            http_async_client=SharedHTTPClients.get_instance().async_client
         )
     except Exception as e:
         print(f"初始化LLM时出错: {str(e)}")
@@ -368,15 +829,26 @@ def init_models():
     except Exception as e:
         print(f"初始化嵌入模型时出错: {str(e)}")
         raise    # 加载向量库
-    vector_db = FAISS.load_local(
-        folder_path=FAISS_REVIEWS_PATH_COSINE,
-        embeddings=embedding_model,
-        index_name=FAISS_INDEX_NAME,
-        allow_dangerous_deserialization=True
-    )
+    _, index_dir = resolve_index_dir(FAISS_REVIEWS_PATH_COSINE)
+    vector_db = load_vector_db(index_dir, embedding_model, FAISS_INDEX_NAME)
     
     return llm, vector_db
 
+# ========== 对话记忆 ==========
+def create_memory(known_names: List[str], log: bool = True) -> RollingSummaryMemory:
+    """按环境变量配置创建有界对话记忆"""
+    memory = RollingSummaryMemory(
+        max_turns=int(os.environ.get("CHAT_MEMORY_MAX_TURNS", MEMORY_MAX_TURNS_DEFAULT)),
+        max_tokens=int(os.environ.get("CHAT_MEMORY_TOKEN_BUDGET", MEMORY_TOKEN_BUDGET_DEFAULT)),
+        summary_max_tokens=int(os.environ.get("CHAT_MEMORY_SUMMARY_TOKENS", MEMORY_SUMMARY_TOKENS_DEFAULT)),
+        known_names=known_names,
+        input_key="question",
+        output_key="answer",
+    )
+    if log:
+        print(f"对话记忆: 最近{memory.max_turns}轮原文, token预算={memory.max_tokens}")
+    return memory
+
 # ========== 用户偏好处理 ==========
 def collect_user_profile():
     print("请根据提示输入你的用餐偏好（1-5分，5分最重视）")
@@ -528,15 +1000,36 @@ def extract_preference_vars(user_pref):
         "dislikes": preferences.get("dislikes", "无"),
     }
 
+def build_prompt_variables(user_pref) -> Dict:
+    """由用户偏好生成提示词中的偏好相关变量"""
+    pref_vars = extract_preference_vars(user_pref)
+    return {
+        "user_preference": format_user_preference(user_pref),
+        "preference_scores": pref_vars["preference_scores"],
+        "preferred_cuisines": pref_vars.get("preferred_cuisines", []),
+        "disliked_cuisines": pref_vars.get("disliked_cuisines", []),
+        "budget_range": pref_vars.get("budget_range", "未设置"),
+        "special_requirements": pref_vars.get("special_requirements", "无"),
+    }
+
+def _consume(stream: Iterator[str]) -> Tuple[str, Any]:
+    """读完生成器，返回 (拼接后的文本, 生成器的返回值)"""
+    chunks = []
+    while True:
+        try:
+            chunks.append(next(stream))
+        except StopIteration as stop:
+            return "".join(chunks), stop.value
+
 # ========== 系统提示词定义 ==========
-system_prompt_template = """
+# 提示词按变化频率从低到高排列：不含变量的固定指令在最前，其后依次是用户偏好、对话历史、检索结果。
+# 所有请求共享同一段长前缀，可命中 DeepSeek 的上下文（前缀）缓存，降低首 token 延迟与费用。
+# 固定指令中不要插入任何变量，否则缓存前缀会在插入处断开。
+system_prompt_static = """
 # 你的角色
 你是"菜根探"——一名智能美食推荐助手。你的工作是根据用户的个性化偏好和实时需求，从数据库中推荐最优餐厅。
 # 1. 用户个人偏好
-用户的个人偏好如下（已由前端页面采集）：
-'''
-{user_preference}
-'''
+用户的个人偏好（已由前端页面采集）见本提示词末尾的"用户个人偏好"部分。
 - 偏好指标包括：环境、口味、服务、性价比、卫生、营养健康、排队时间、距离等。
 - 每项得分为0-5分，数值越高代表用户在挑选餐厅时对该项要求越高，指标越靠前说明越重要。
 - 请结合这些分值，为后续餐厅筛选与加权打分分配不同权重，优先满足得分高和排名靠前的指标项。
@@ -549,12 +1042,7 @@ system_prompt_template = """
     - 营养健康：追求健康、低油低盐、营养搭配  
     - 排队时间：关注是否需等位、出餐速度  
     - 距离：优先考虑距离近、交通便利的餐厅
-    请特别注意以下关键信息：
-    - 各维度评分(0-5分): {preference_scores}
-    - 偏好菜系: {preferred_cuisines}
-    - 不喜欢的菜系: {disliked_cuisines}
-    - 预算范围: {budget_range}
-    - 特殊要求: {special_requirements}
+    请特别注意其中的各维度评分、偏好菜系、不喜欢的菜系、预算范围与特殊要求。
 # 2. 推荐策略
 - 优先匹配用户评分高的维度(4-5分)
 - 确保推荐餐厅在用户预算范围内
@@ -603,29 +1091,35 @@ system_prompt_template = """
 - 如某项信息缺失，请如实说明"该项暂无数据"。
 - 非餐饮、无关问题请委婉回复"仅能为您提供美食/餐厅推荐服务"。
 - 推荐内容需结构化、条理清晰、易于用户理解和决策。
+"""
+
+# 随用户、对话轮次与问题变化的部分，放在固定指令之后
+system_prompt_dynamic_template = """
+# 用户个人偏好
+'''
+{user_preference}
+'''
+- 各维度评分(0-5分): {preference_scores}
+- 偏好菜系: {preferred_cuisines}
+- 不喜欢的菜系: {disliked_cuisines}
+- 预算范围: {budget_range}
+- 特殊要求: {special_requirements}
 # 当前对话历史
 {history}
 # 数据库内容
 {context}
 """
 
-# ========== LangChain工作流 ==========
-def setup_chain(llm, vector_db):
-    """设置对话链和记忆"""
-    memory = ConversationBufferMemory(
-        return_messages=True,
-        output_key="answer",
-        input_key="question"
-    )
-    
-    # 准备prompt模板
-    chat_template = ChatPromptTemplate.from_messages([
+def build_chat_template() -> ChatPromptTemplate:
+    """固定指令、动态部分与用户问题依次作为三条消息发送，保证请求之间的公共前缀最长"""
+    return ChatPromptTemplate.from_messages([
+        SystemMessage(content=system_prompt_static),
         SystemMessagePromptTemplate(
             prompt=PromptTemplate(
-                input_variables=["history", "context", "user_preference", "preference_scores", 
-                               "preferred_cuisines", "disliked_cuisines", "budget_range", 
-                               "special_requirements"],
-                template=system_prompt_template
+                input_variables=["history", "context", "user_preference", "preference_scores",
+                                 "preferred_cuisines", "disliked_cuisines", "budget_range",
+                                 "special_requirements"],
+                template=system_prompt_dynamic_template
             )
         ),
         HumanMessagePromptTemplate(
@@ -635,12 +1129,20 @@ def setup_chain(llm, vector_db):
             )
         )
     ])
+
+# ========== LangChain工作流 ==========
+def setup_chain(llm, vector_db):
+    """设置对话链和记忆"""
+    memory = create_memory(list(RestaurantTable.get_instance().ids_by_name))
+    
+    # 准备prompt模板
+    chat_template = build_chat_template()
     
-    reviews_retriever = RunnableLambda(lambda x: x["question"]) | vector_db.as_retriever(search_kwargs={'k': 20,})
+    reviews_retriever = RunnableLambda(lambda x: x["question"]) | vector_db.as_retriever(search_kwargs={'k': RETRIEVAL_K})
     
     review_chain = (
         RunnableMap({
-            "history": RunnablePassthrough(lambda _: memory.load_memory_variables({}).get("history", [])),
+            "history": RunnableLambda(lambda _: memory.load_memory_variables({}).get("history", "")),
             "context": reviews_retriever,
             "question": RunnablePassthrough(),
             "user_preference": RunnableLambda(lambda x: format_user_preference(user_preference)),
@@ -0,0 +1,155 @@
+import argparse
+import ast
+import csv
+import re
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow 为可选依赖，缺失时回退到 CSV
+    pa = None
+    pq = None
+
+# ========== 常量定义 ==========
+DATASET_CSV_PATH = Path(__file__).parent / "restaurant_all.csv"
+DATASET_PARQUET_PATH = Path(__file__).parent / "restaurant_all.parquet"
+
+FLOAT_FIELDS = ("dp_cost", "dp_rating", "dp_taste_rating", "dp_env_rating",
+                "dp_service_rating", "dp_comment_num", "cost", "rating")
+STRING_FIELDS = ("name", "address", "location", "type", "tel",
+                 "opentime_today", "opentime_week", "tag")
+# 解析后的列表/结构列
+LIST_FIELDS = ("dp_recommendation_dish", "dp_comment_keywords", "dp_top3_comments")
+
+_KEYWORD_SET_RE = re.compile(r'"([^"]+?):\s*(\d+)"')          # {"服务热情: 59", ...}
+_KEYWORD_DICT_RE = re.compile(r'"([^"]+?)"\s*:\s*(\d+)')      # {"服务热情": 59, ...}
+_COMMENT_RE = re.compile(r'\(\s*"(\d{4}-\d{2}-\d{2})"\s*,\s*"(.*?)"\s*\)', re.DOTALL)
+
+
+# ========== 字段解析 ==========
+def parse_dish_list(value: Optional[str]) -> List[str]:
+    """'巴蜀麻辣黑鱼花,渣渣土豆' -> ['巴蜀麻辣黑鱼花', '渣渣土豆']"""
+    if not value:
+        return []
+    return [d.strip() for d in re.split(r"[,，]", value) if d.strip()]
+
+
+def parse_comment_keywords(value: Optional[str]) -> List[Tuple[str, int]]:
+    """兼容 {"味道赞: 57"} 与 {"味道赞": 57} 两种写法，以及被截断的字符串"""
+    if not value:
+        return []
+    pairs = _KEYWORD_SET_RE.findall(value) or _KEYWORD_DICT_RE.findall(value)
+    return [(k.strip(), int(n)) for k, n in pairs]
+
+
+def parse_top_comments(value: Optional[str]) -> List[Tuple[str, str]]:
+    """'[("2025-05-23", "..."), ...]' -> [(日期, 评论), ...]"""
+    if not value:
+        return []
+    try:
+        parsed = ast.literal_eval(value)
+        return [(str(d), str(t)) for d, t in parsed]
+    except (ValueError, SyntaxError, TypeError):
+        return _COMMENT_RE.findall(value)
+
+
+def parse_float(value: Optional[str]) -> Optional[float]:
+    try:
+        return float(value) if value not in (None, "") else None
+    except ValueError:
+        return None
+
+
+def parse_row(row: Dict[str, str]) -> Dict:
+    """将 CSV 的一行转换为带类型的记录"""
+    record = {field: row.get(field, "") or "" for field in STRING_FIELDS}
+    for field in FLOAT_FIELDS:
+        record[field] = parse_float(row.get(field))
+    record["dp_recommendation_dish"] = parse_dish_list(row.get("dp_recommendation_dish"))
+    record["dp_comment_keywords"] = parse_comment_keywords(row.get("dp_comment_keywords"))
+    record["dp_top3_comments"] = parse_top_comments(row.get("dp_top3_comments"))
+    return record
+
+
+def read_csv_records(path: Path = DATASET_CSV_PATH) -> List[Dict]:
+    """读取 CSV 并去重（与 pandas drop_duplicates 一致），返回解析后的记录"""
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        seen, records = set(), []
+        for row in csv.DictReader(f):
+            key = tuple(row.items())
+            if key not in seen:
+                seen.add(key)
+                records.append(parse_row(row))
+        return records
+
+
+# ========== 列式存储 ==========
+def arrow_schema():
+    keyword = pa.struct([("keyword", pa.string()), ("count", pa.int32())])
+    comment = pa.struct([("date", pa.string()), ("text", pa.string())])
+    return pa.schema(
+        [(f, pa.string()) for f in STRING_FIELDS]
+        + [(f, pa.float32()) for f in FLOAT_FIELDS]
+        + [("dp_recommendation_dish", pa.list_(pa.string())),
+           ("dp_comment_keywords", pa.list_(keyword)),
+           ("dp_top3_comments", pa.list_(comment))]
+    )
+
+
+def build_parquet(csv_path: Path = DATASET_CSV_PATH, parquet_path: Path = DATASET_PARQUET_PATH) -> Path:
+    """把摄取得到的 CSV 转换为带类型的 Parquet 数据集"""
+    if pa is None:
+        raise RuntimeError("未安装 pyarrow，无法生成 Parquet 数据集")
+    records = read_csv_records(csv_path)
+    for r in records:
+        r["dp_comment_keywords"] = [{"keyword": k, "count": n} for k, n in r["dp_comment_keywords"]]
+        r["dp_top3_comments"] = [{"date": d, "text": t} for d, t in r["dp_top3_comments"]]
+    table = pa.Table.from_pylist(records, schema=arrow_schema())
+    tmp = Path(parquet_path).with_suffix(".parquet.tmp")
+    pq.write_table(table, tmp, compression="zstd")
+    tmp.replace(parquet_path)
+    print(f"已生成列式数据集: {parquet_path} ({len(records)} 条)")
+    return Path(parquet_path)
+
+
+def ensure_parquet(csv_path: Path = DATASET_CSV_PATH,
+                   parquet_path: Path = DATASET_PARQUET_PATH) -> Optional[Path]:
+    """CSV 比 Parquet 新（或 Parquet 不存在）时重新生成；无 pyarrow 时返回 None"""
+    if pa is None:
+        return None
+    csv_path, parquet_path = Path(csv_path), Path(parquet_path)
+    if not parquet_path.exists() or (csv_path.exists() and csv_path.stat().st_mtime > parquet_path.stat().st_mtime):
+        build_parquet(csv_path, parquet_path)
+    return parquet_path
+
+
+def read_parquet_table(path: Path = DATASET_PARQUET_PATH, columns: Optional[Sequence[str]] = None):
+    """以内存映射方式读取 Parquet，只加载需要的列"""
+    return pq.read_table(path, columns=list(columns) if columns else None, memory_map=True)
+
+
+def load_records(path: Optional[Path] = None, columns: Optional[Sequence[str]] = None) -> List[Dict]:
+    """加载解析后的记录：优先 Parquet，其次 CSV；两种来源返回的结构一致"""
+    path = Path(path) if path else (ensure_parquet() or DATASET_CSV_PATH)
+    if path.suffix == ".parquet" and pa is not None:
+        records = read_parquet_table(path, columns).to_pylist()
+        for r in records:
+            if "dp_comment_keywords" in r:
+                r["dp_comment_keywords"] = [(k["keyword"], k["count"]) for k in r["dp_comment_keywords"] or []]
+            if "dp_top3_comments" in r:
+                r["dp_top3_comments"] = [(c["date"], c["text"]) for c in r["dp_top3_comments"] or []]
+        return records
+    records = read_csv_records(path.with_suffix(".csv") if path.suffix == ".parquet" else path)
+    if columns:
+        records = [{c: r.get(c) for c in columns} for r in records]
+    return records
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="将餐厅 CSV 转换为列式 Parquet 数据集")
+    parser.add_argument("--csv", default=str(DATASET_CSV_PATH))
+    parser.add_argument("--output", default=str(DATASET_PARQUET_PATH))
+    args = parser.parse_args()
+    build_parquet(Path(args.csv), Path(args.output))
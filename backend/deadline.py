@@ -0,0 +1,181 @@
+import queue
+import threading
+import time
+from collections import Counter
+from typing import Callable, Dict, Iterator, List, Optional
+
+# ========== 常量定义 ==========
+# 单次对话请求的延迟预算（秒），覆盖排队、检索与 LLM 首 token；首 token 到达后不再限制总时长
+CHAT_DEADLINE_DEFAULT = 30.0
+# 检索结束后剩余预算低于该值时不再调用 LLM，直接返回降级回答
+LLM_MIN_BUDGET = 3.0
+# 首 token 超过该时间（秒）仍未返回时发起一次对冲请求，0 表示关闭
+LLM_HEDGE_AFTER_DEFAULT = 0.0
+# 开始输出后相邻两个分片的最长间隔（秒），超过时视为卡住并截断
+LLM_CHUNK_TIMEOUT_DEFAULT = 15.0
+# 降级回答列出的餐厅数
+FALLBACK_MAX_RESTAURANTS = 5
+
+_DONE = object()
+
+
+class DeadlineExceeded(Exception):
+    """请求的延迟预算已用完"""
+
+    def __init__(self, stage: str):
+        super().__init__(f"延迟预算在 {stage} 阶段用完")
+        self.stage = stage
+
+
+class Deadline:
+    """单次请求的延迟预算，在排队、检索与 LLM 调用之间传递"""
+    __slots__ = ("budget", "started", "expires_at")
+
+    def __init__(self, budget: float):
+        self.budget = budget
+        self.started = time.monotonic()
+        self.expires_at = self.started + budget
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+    def __repr__(self) -> str:
+        return f"Deadline(budget={self.budget}, remaining={self.remaining():.2f})"
+
+
+class DeadlineStats:
+    """降级与对冲请求的计数，供 /chat/metrics 展示"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = Counter()
+
+    def incr(self, name: str):
+        with self._lock:
+            self.counts[name] += 1
+
+    def metrics(self) -> Dict:
+        with self._lock:
+            return dict(self.counts)
+
+
+class _Attempt(threading.Thread):
+    """在后台线程中消费一次 LLM 流式调用，把分片放入共享队列；取消后在下一个分片处停止"""
+
+    def __init__(self, index: int, factory: Callable[[], Iterator[str]], out: "queue.Queue",
+                 on_exit: Optional[Callable[[], None]] = None):
+        super().__init__(daemon=True, name=f"llm-attempt-{index}")
+        self.index = index
+        self.factory = factory
+        self.out = out
+        self.on_exit = on_exit
+        self.cancelled = False
+
+    def run(self):
+        try:
+            for chunk in self.factory():
+                if self.cancelled:
+                    return
+                self.out.put((self.index, chunk))
+            self.out.put((self.index, _DONE))
+        except Exception as e:
+            self.out.put((self.index, e))
+        finally:
+            if self.on_exit is not None:
+                self.on_exit()
+
+
+def hedged_stream(factory: Callable[[], Iterator[str]], deadline: Deadline,
+                  hedge_after: float = LLM_HEDGE_AFTER_DEFAULT,
+                  stats: Optional[DeadlineStats] = None, admission=None,
+                  chunk_timeout: float = LLM_CHUNK_TIMEOUT_DEFAULT) -> Iterator[str]:
+    """流式读取 LLM 输出：首个分片须在预算内到达，之后每个分片须在 chunk_timeout 秒内到达。
+
+    首个分片超过 hedge_after 秒仍未到达时再发起一次相同的调用，先返回首个分片的一方胜出，
+    另一方被取消；首 token 前预算用完时抛出 DeadlineExceeded("llm")，
+    开始输出后卡住时抛出 DeadlineExceeded("stream")（已输出的部分保留在调用方）。
+    传入 admission 时对冲请求同样占用准入名额（直到其线程结束），没有空闲名额时不发起对冲。
+    """
+    out: "queue.Queue" = queue.Queue()
+    attempts = [_Attempt(0, factory, out)]
+    attempts[0].start()
+    hedge_at = time.monotonic() + hedge_after if hedge_after > 0 else None
+    winner: Optional[int] = None
+    failed = set()
+    try:
+        while True:
+            if winner is not None:
+                wait = chunk_timeout
+            else:
+                wait = deadline.remaining()
+                if hedge_at is not None and len(attempts) == 1:
+                    wait = min(wait, max(0.0, hedge_at - time.monotonic()))
+            try:
+                index, item = out.get(timeout=wait)
+            except queue.Empty:
+                if winner is not None:
+                    raise DeadlineExceeded("stream")
+                if deadline.expired():
+                    raise DeadlineExceeded("llm")
+                # 首 token 迟迟未到：有空闲名额时发起对冲请求
+                if admission is not None and not admission.try_acquire():
+                    hedge_at = None
+                    if stats:
+                        stats.incr("hedge_skipped_busy")
+                    continue
+                attempts.append(_Attempt(1, factory, out, admission.release if admission is not None else None))
+                attempts[1].start()
+                if stats:
+                    stats.incr("hedged")
+                print(f"LLM 首 token 超过 {hedge_after:.1f}s，已发起对冲请求")
+                continue
+            if winner is not None and index != winner:
+                continue
+            if isinstance(item, Exception):
+                failed.add(index)
+                if winner is None and len(failed) < len(attempts):
+                    continue  # 另一路仍在进行
+                raise item
+            if winner is None:
+                winner = index
+                for attempt in attempts:
+                    if attempt.index != winner:
+                        attempt.cancelled = True
+                if winner == 1 and stats:
+                    stats.incr("hedge_won")
+            if item is _DONE:
+                return
+            yield item
+    finally:
+        for attempt in attempts:
+            attempt.cancelled = True
+
+
+def format_fallback_answer(rows: List[Dict]) -> str:
+    """由检索并排序后的餐厅生成降级回答，不依赖 LLM"""
+    if not rows:
+        return "抱歉，当前请求处理超时，请稍后再试或尝试简化您的问题。"
+    lines = ["抱歉，生成详细推荐耗时过长，先根据检索结果为你列出最相关的几家餐厅：", ""]
+    for i, row in enumerate(rows[:FALLBACK_MAX_RESTAURANTS], 1):
+        cost = row.get("dp_cost") if row.get("dp_cost") is not None else row.get("cost")
+        rating = row.get("dp_rating") if row.get("dp_rating") is not None else row.get("rating")
+        details = [(row.get("type") or "").split(";")[-1]]
+        if cost:
+            details.append(f"人均 {round(cost)} 元")
+        if rating:
+            details.append(f"评分 {rating}")
+        lines.append(f"{i}. **{row['name']}** — {' · '.join(d for d in details if d)}")
+        if row.get("address"):
+            lines.append(f"   地址: {row['address']}")
+        dishes = row.get("dp_recommendation_dish") or []
+        if dishes:
+            lines.append(f"   推荐菜: {'、'.join(dishes[:3])}")
+    lines.append("")
+    lines.append("如需更详细的对比和理由，可以稍后再问一次。")
+    return "\n".join(lines)
@@ -0,0 +1,46 @@
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+# ========== 常量定义 ==========
+# MMR 的相关性权重：1.0 等价于不做多样化，越小越偏向差异大的结果
+MMR_LAMBDA_DEFAULT = 0.7
+
+
+def mmr_select(relevance: np.ndarray, vectors: np.ndarray, k: int,
+               lambda_mult: float = MMR_LAMBDA_DEFAULT,
+               groups: Optional[Sequence] = None) -> List[int]:
+    """最大边际相关性（MMR）选择，返回被选中候选的下标（按选中顺序）。
+
+    relevance 为各候选与问题的相关性，vectors 为已归一化的文档向量（余弦相似度即点积）；
+    groups 相同的候选（如同一品牌的不同分店）视为完全重复。
+    """
+    n = len(relevance)
+    if n == 0 or k <= 0:
+        return []
+    if lambda_mult >= 1.0 or n <= 1:
+        return [int(i) for i in np.argsort(-relevance, kind="stable")[:k]]
+    similarity = vectors @ vectors.T
+    if groups is not None:
+        keys = np.array([hash(g) for g in groups])
+        similarity = np.maximum(similarity, (keys[:, None] == keys[None, :]).astype(similarity.dtype))
+
+    selected = [int(np.argmax(relevance))]
+    max_sim = similarity[selected[0]].copy()
+    remaining = np.ones(n, dtype=bool)
+    remaining[selected[0]] = False
+    while len(selected) < min(k, n):
+        score = lambda_mult * relevance - (1 - lambda_mult) * max_sim
+        score[~remaining] = -np.inf
+        best = int(np.argmax(score))
+        selected.append(best)
+        remaining[best] = False
+        max_sim = np.maximum(max_sim, similarity[best])
+    return selected
+
+
+def reconstruct_vectors(index, positions: Sequence[int]) -> np.ndarray:
+    """从 FAISS 索引中取出已存储的文档向量（mmap 的 Flat 索引按需读取，不复制整个索引）并归一化"""
+    vectors = np.stack([index.reconstruct(int(p)) for p in positions]).astype(np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1.0, norms)
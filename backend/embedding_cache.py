@@ -0,0 +1,62 @@
+import threading
+from collections import OrderedDict
+from typing import List
+
+import numpy as np
+
+# ========== 常量定义 ==========
+EMBEDDING_CACHE_SIZE_DEFAULT = 1024
+
+
+class CachedEmbedder:
+    """查询向量的 LRU 缓存：意图识别、查询改写与检索在同一请求内复用同一次编码"""
+
+    def __init__(self, embeddings, max_size: int = EMBEDDING_CACHE_SIZE_DEFAULT):
+        self.embeddings = embeddings
+        self.max_size = max(1, max_size)
+        self._cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def embed_query(self, text: str) -> np.ndarray:
+        with self._lock:
+            vector = self._cache.get(text)
+            if vector is not None:
+                self._cache.move_to_end(text)
+                self.hits += 1
+                return vector
+        vector = np.asarray(self.embeddings.embed_query(text), dtype=np.float32)
+        with self._lock:
+            self.misses += 1
+            self._cache[text] = vector
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+        return vector
+
+    def embed_documents(self, texts: List[str]) -> np.ndarray:
+        """批量编码，只对未命中缓存的文本调用模型"""
+        found = {}
+        with self._lock:
+            for text in texts:
+                vector = self._cache.get(text)
+                if vector is not None:
+                    found[text] = vector
+        missing = [t for t in dict.fromkeys(texts) if t not in found]
+        if missing:
+            vectors = np.asarray(self.embeddings.embed_documents(missing), dtype=np.float32)
+            found.update(zip(missing, vectors))
+        with self._lock:
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+            for text in missing:
+                self._cache[text] = found[text]
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+        return np.stack([found[t] for t in texts]) if texts else np.zeros((0, 0), dtype=np.float32)
+
+    def metrics(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {"size": len(self._cache), "hits": self.hits, "misses": self.misses,
+                    "hit_ratio": self.hits / total if total else 0.0}
@@ -0,0 +1,194 @@
+import re
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# ========== 常量定义 ==========
+FACETS_FILE = "facets.npz"
+# 菜名少于该长度时不做子串匹配，避免"小菜""饭"之类的短词误命中
+MIN_DISH_MATCH_LEN = 2
+# 没有实际意义的推荐菜条目
+IGNORED_DISHES = {"停业", "小菜"}
+# 检索重排时，分面得分相对向量检索名次的权重
+FACET_BOOST_WEIGHT = 1.0
+# 向量检索结果之外，按分面得分补充的候选数上限
+FACET_EXTRA_CANDIDATES = 5
+# 差评类评论关键词：问题提到时表示要避开，相应次数多的餐厅被降权而不是提升
+NEGATIVE_KEYWORDS = {
+    "上菜慢", "空间小", "分量少", "价格高", "环境一般", "排队时间长",
+    "服务差", "服务一般", "态度差", "不卫生", "环境差", "味道一般", "性价比低",
+}
+# 避开的分面相对命中分面的降权系数
+FACET_PENALTY_WEIGHT = 1.0
+# 关键词前出现这些否定词时（如"不要约会圣地那种"）同样视为要避开
+_NEGATION_RE = re.compile(r"(不要|不想|不喜欢|别|避开|避免|讨厌|怕|受不了|拒绝|除了)[^，,。！？!?\s]{0,2}$")
+
+
+class FacetMatch:
+    """一次问题解析得到的分面：要提升的评论关键词列号、推荐菜编号，以及要避开的评论关键词列号"""
+    __slots__ = ("keywords", "dishes", "avoid")
+
+    def __init__(self, keywords: List[int], dishes: List[int], avoid: Optional[List[int]] = None):
+        self.keywords = keywords
+        self.dishes = dishes
+        self.avoid = avoid or []
+
+    def __bool__(self) -> bool:
+        return bool(self.keywords or self.dishes or self.avoid)
+
+
+class FacetIndex:
+    """索引构建时从评论关键词与推荐菜中提取的结构化分面。
+
+    keyword_counts[i, j] 为第 i 家餐厅评论关键词 keywords[j] 的出现次数；
+    推荐菜以 CSR 形式保存倒排表：dish_ids[dish_indptr[d]:dish_indptr[d + 1]] 为推荐菜 dishes[d] 的餐厅行号。
+    行号与 RestaurantTable 一致。
+    """
+
+    def __init__(self, keywords: List[str], keyword_counts: np.ndarray,
+                 dishes: List[str], dish_indptr: np.ndarray, dish_ids: np.ndarray):
+        self.keywords = keywords
+        self.keyword_counts = keyword_counts
+        self.dishes = dishes
+        self.dish_indptr = dish_indptr
+        self.dish_ids = dish_ids
+        self.keyword_index = {k: j for j, k in enumerate(keywords)}
+        # 每个关键词按全表最大次数归一化，使"味道赞(57)"与"可带宠物(6)"的得分可比
+        max_counts = keyword_counts.max(axis=0) if keyword_counts.size else np.zeros(len(keywords))
+        self._keyword_scale = 1.0 / np.maximum(max_counts, 1).astype(np.float32)
+        self._keyword_stems = self._unique_stems(keywords)
+
+    # ---------- 构建 ----------
+    @classmethod
+    def from_lists(cls, comment_keywords: Sequence[Sequence[Tuple[str, int]]],
+                   recommendation_dishes: Sequence[Sequence[str]]) -> "FacetIndex":
+        """由已解析的 dp_comment_keywords / dp_recommendation_dish 两列构建"""
+        keywords: List[str] = []
+        keyword_index: Dict[str, int] = {}
+        for row in comment_keywords:
+            for k, _ in row:
+                if k not in keyword_index:
+                    keyword_index[k] = len(keywords)
+                    keywords.append(k)
+        counts = np.zeros((len(comment_keywords), len(keywords)), dtype=np.int32)
+        for i, row in enumerate(comment_keywords):
+            for k, n in row:
+                counts[i, keyword_index[k]] = max(counts[i, keyword_index[k]], n)
+
+        postings: Dict[str, List[int]] = defaultdict(list)
+        for i, row in enumerate(recommendation_dishes):
+            for dish in dict.fromkeys(row):
+                if dish not in IGNORED_DISHES:
+                    postings[dish].append(i)
+        dishes = sorted(postings)
+        indptr = np.zeros(len(dishes) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([len(postings[d]) for d in dishes])
+        ids = np.array([i for d in dishes for i in postings[d]], dtype=np.int32)
+        return cls(keywords, counts, dishes, indptr, ids)
+
+    @classmethod
+    def from_table(cls, table) -> "FacetIndex":
+        """由 RestaurantTable 构建（索引目录中没有分面文件时使用）"""
+        return cls.from_lists(table.lists["dp_comment_keywords"], table.lists["dp_recommendation_dish"])
+
+    def save(self, folder: Path) -> Path:
+        path = Path(folder) / FACETS_FILE
+        np.savez_compressed(
+            path,
+            keywords=np.array(self.keywords, dtype=str),
+            keyword_counts=self.keyword_counts,
+            dishes=np.array(self.dishes, dtype=str),
+            dish_indptr=self.dish_indptr,
+            dish_ids=self.dish_ids,
+        )
+        return path
+
+    @classmethod
+    def load(cls, folder: Path) -> Optional["FacetIndex"]:
+        """读取索引目录中的分面文件；不存在时返回 None"""
+        path = Path(folder) / FACETS_FILE
+        if not path.exists():
+            return None
+        with np.load(path, allow_pickle=False) as data:
+            return cls(data["keywords"].tolist(), data["keyword_counts"],
+                       data["dishes"].tolist(), data["dish_indptr"], data["dish_ids"])
+
+    # ---------- 查询 ----------
+    @staticmethod
+    def _unique_stems(keywords: List[str]) -> Dict[str, int]:
+        """关键词的前两个字作为词干（如"约会圣地" -> "约会"），只保留唯一对应一个关键词的词干，
+        "上菜快""上菜慢"这类褒贬相反的关键词共享词干，因此不会被词干匹配到"""
+        owners: Dict[str, List[int]] = defaultdict(list)
+        for j, k in enumerate(keywords):
+            if len(k) > 2:
+                owners[k[:2]].append(j)
+        return {stem: js[0] for stem, js in owners.items() if len(js) == 1}
+
+    def match(self, question: str) -> FacetMatch:
+        """从问题中识别分面：完整出现的关键词、唯一的关键词词干，以及出现在问题中的推荐菜。
+
+        差评类关键词（NEGATIVE_KEYWORDS）或前面带否定词的关键词归入 avoid。
+        """
+        found: Dict[int, int] = {}  # 关键词列号 -> 在问题中的位置
+        for k, j in self.keyword_index.items():
+            if k in question:
+                found[j] = question.index(k)
+        for stem, j in self._keyword_stems.items():
+            if stem in question and j not in found:
+                found[j] = question.index(stem)
+        keywords, avoid = [], []
+        for j, pos in sorted(found.items()):
+            negative = self.keywords[j] in NEGATIVE_KEYWORDS or _NEGATION_RE.search(question[:pos])
+            (avoid if negative else keywords).append(j)
+        dishes = [d for d, dish in enumerate(self.dishes)
+                  if len(dish) >= MIN_DISH_MATCH_LEN and dish in question]
+        return FacetMatch(keywords, dishes, avoid)
+
+    def dish_restaurants(self, dish_id: int) -> np.ndarray:
+        return self.dish_ids[self.dish_indptr[dish_id]:self.dish_indptr[dish_id + 1]]
+
+    def _keyword_score(self, cols: List[int]) -> np.ndarray:
+        cols = np.asarray(cols)
+        return (self.keyword_counts[:, cols] * self._keyword_scale[cols]).sum(axis=1)
+
+    def scores(self, facets: FacetMatch) -> np.ndarray:
+        """每家餐厅的分面得分：命中关键词的归一化次数之和 + 命中推荐菜的个数 - 避开关键词的归一化次数"""
+        n = self.keyword_counts.shape[0]
+        score = np.zeros(n, dtype=np.float32)
+        if facets.keywords:
+            score += self._keyword_score(facets.keywords)
+        if facets.avoid:
+            score -= FACET_PENALTY_WEIGHT * self._keyword_score(facets.avoid)
+        for d in facets.dishes:
+            score[self.dish_restaurants(d)] += 1.0
+        return score
+
+    def rerank(self, ranked: List[Tuple[Optional[int], Any]], facets: FacetMatch,
+               lookup: Callable[[int], Any], extra: int = FACET_EXTRA_CANDIDATES) -> List[Any]:
+        """按"向量检索名次 + 分面得分"重排，并补充向量检索未召回但分面得分最高的餐厅。
+
+        ranked 为向量检索结果的 (行号, 文档) 列表，行号无法确定时为 None；
+        lookup 根据行号取文档，用于补充候选，返回 None 的行号会被跳过。
+        """
+        score = self.scores(facets)
+        seen = {row_id for row_id, _ in ranked if row_id is not None}
+        items = list(ranked)
+        for row_id in np.argsort(-score, kind="stable"):
+            if len(items) >= len(ranked) + extra or score[row_id] <= 0:
+                break
+            if int(row_id) in seen:
+                continue
+            doc = lookup(int(row_id))
+            if doc is not None:
+                items.append((int(row_id), doc))
+
+        total = len(items)
+
+        def key(entry):
+            pos, (row_id, _) = entry
+            facet_score = float(score[row_id]) if row_id is not None else 0.0
+            return -((1.0 - pos / total) + FACET_BOOST_WEIGHT * facet_score)
+
+        return [doc for _, (_, doc) in sorted(enumerate(items), key=key)]
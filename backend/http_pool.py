@@ -0,0 +1,116 @@
+import os
+import threading
+import weakref
+from collections import Counter
+from typing import Dict, Optional
+
+import httpx
+
+try:
+    import h2  # noqa: F401  httpx 的 HTTP/2 支持依赖 h2
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# ========== 常量定义 ==========
+# 所有 LLM 调用共用的连接池上限（每个 worker 进程一份）
+LLM_POOL_MAX_CONNECTIONS_DEFAULT = 20
+LLM_POOL_MAX_KEEPALIVE_DEFAULT = 10
+LLM_POOL_KEEPALIVE_EXPIRY_DEFAULT = 60.0  # 秒，空闲连接保持时间
+
+
+class SharedHTTPClients:
+    """进程内所有 ChatOpenAI 实例共用的 httpx 同步/异步客户端。
+
+    连接保持长连接并复用，TLS 握手只在建立新连接时发生；安装了 h2 时启用 HTTP/2，
+    单个连接上即可并发多路请求。
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, max_connections: int = LLM_POOL_MAX_CONNECTIONS_DEFAULT,
+                 max_keepalive: int = LLM_POOL_MAX_KEEPALIVE_DEFAULT,
+                 keepalive_expiry: float = LLM_POOL_KEEPALIVE_EXPIRY_DEFAULT,
+                 http2: bool = HTTP2_AVAILABLE):
+        self.http2 = http2 and HTTP2_AVAILABLE
+        limits = httpx.Limits(max_connections=max_connections,
+                              max_keepalive_connections=max_keepalive,
+                              keepalive_expiry=keepalive_expiry)
+        self.limits = limits
+        self._lock = threading.Lock()
+        self._seen = weakref.WeakSet()  # 出现过的连接对象，用于统计新建连接数
+        self.requests = 0
+        self.connections_opened = 0
+        self.http_versions = Counter()
+        # 超时由 ChatOpenAI 的 request_timeout 按请求传入
+        self.sync_client = httpx.Client(http2=self.http2, limits=limits,
+                                        event_hooks={"response": [self._on_response]})
+        self.async_client = httpx.AsyncClient(http2=self.http2, limits=limits,
+                                              event_hooks={"response": [self._on_async_response]})
+
+    @classmethod
+    def get_instance(cls) -> "SharedHTTPClients":
+        """按环境变量创建进程内唯一的连接池"""
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = cls(
+                        max_connections=int(os.environ.get("LLM_POOL_MAX_CONNECTIONS", LLM_POOL_MAX_CONNECTIONS_DEFAULT)),
+                        max_keepalive=int(os.environ.get("LLM_POOL_MAX_KEEPALIVE", LLM_POOL_MAX_KEEPALIVE_DEFAULT)),
+                        keepalive_expiry=float(os.environ.get("LLM_POOL_KEEPALIVE_EXPIRY",
+                                                              LLM_POOL_KEEPALIVE_EXPIRY_DEFAULT)),
+                        http2=os.environ.get("LLM_HTTP2", "1") != "0",
+                    )
+                    print(f"LLM 连接池已创建: max_connections={cls._instance.limits.max_connections}, "
+                          f"keepalive={cls._instance.limits.max_keepalive_connections}, http2={cls._instance.http2}")
+        return cls._instance
+
+    @staticmethod
+    def _pool(client):
+        """httpx 客户端底层的 httpcore 连接池（不同 httpx 版本下取不到时返回 None）"""
+        return getattr(getattr(client, "_transport", None), "_pool", None)
+
+    def _track(self, client, response: httpx.Response):
+        pool = self._pool(client)
+        with self._lock:
+            self.requests += 1
+            self.http_versions[response.http_version] += 1
+            for connection in getattr(pool, "connections", ()):
+                if connection not in self._seen:
+                    self._seen.add(connection)
+                    self.connections_opened += 1
+
+    def _on_response(self, response: httpx.Response):
+        self._track(self.sync_client, response)
+
+    async def _on_async_response(self, response: httpx.Response):
+        self._track(self.async_client, response)
+
+    def _pool_stats(self, client) -> Optional[Dict]:
+        pool = self._pool(client)
+        if pool is None:
+            return None
+        connections = list(pool.connections)
+        idle = sum(1 for c in connections if c.is_idle())
+        return {
+            "connections": len(connections),
+            "idle": idle,
+            "active": len(connections) - idle,
+            "queued_requests": sum(1 for r in getattr(pool, "_requests", ()) if r.is_queued()),
+        }
+
+    def metrics(self) -> Dict:
+        with self._lock:
+            requests, opened = self.requests, self.connections_opened
+            versions = dict(self.http_versions)
+        return {
+            "http2": self.http2,
+            "max_connections": self.limits.max_connections,
+            "max_keepalive_connections": self.limits.max_keepalive_connections,
+            "requests": requests,
+            "connections_opened": opened,
+            "reuse_ratio": 1 - opened / requests if requests else 0.0,
+            "http_versions": versions,
+            "sync_pool": self._pool_stats(self.sync_client),
+            "async_pool": self._pool_stats(self.async_client),
+        }
@@ -0,0 +1,222 @@
+import os
+import pickle
+import shutil
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import faiss
+from langchain_community.vectorstores import FAISS
+
+if TYPE_CHECKING:
+    from backend.shards import ShardSet
+
+# ========== 常量定义 ==========
+# 目录布局：
+#   faiss_index_cosine/CURRENT            当前版本号（单行文本，原子替换）
+#   faiss_index_cosine/versions/<版本号>/  index.faiss、index.pkl 及构建所用的数据快照
+# 没有 CURRENT 文件时兼容旧布局：index.faiss 直接位于 faiss_index_cosine/ 下
+INDEX_ROOT = Path(__file__).parent / "faiss_index_cosine"
+FAISS_INDEX_NAME = "index"
+CURRENT_FILE = "CURRENT"
+VERSIONS_DIR = "versions"
+# 构建时使用的数据快照，按优先级排列
+DATASET_SNAPSHOTS = ("restaurant_all.parquet", "restaurant_all.csv")
+LEGACY_VERSION = "legacy"
+
+
+def resolve_index_dir(root: Path = INDEX_ROOT) -> Tuple[str, Path]:
+    """返回当前生效的 (版本号, 索引目录)"""
+    current = root / CURRENT_FILE
+    if current.exists():
+        version = current.read_text(encoding="utf-8").strip()
+        if version and (root / VERSIONS_DIR / version).is_dir():
+            return version, root / VERSIONS_DIR / version
+    return LEGACY_VERSION, root
+
+
+def dataset_snapshot(index_dir: Path) -> Optional[Path]:
+    """索引版本目录中构建时使用的数据快照（旧布局下不存在）"""
+    for name in DATASET_SNAPSHOTS:
+        snapshot = Path(index_dir) / name
+        if snapshot.exists():
+            return snapshot
+    return None
+
+
+def publish_index_version(build: Callable[[Path], None],
+                          root: Path = INDEX_ROOT,
+                          dataset_paths: Iterable[Path] = (),
+                          keep_versions: int = 3) -> str:
+    """在临时目录中构建新版本，完成后原子切换 CURRENT 指针。
+
+    build 接收目标目录并在其中写入索引文件；正在服务的进程会在下次轮询时热切换到新版本。
+    """
+    version = datetime.now().strftime("%Y%m%d%H%M%S")
+    versions_dir = root / VERSIONS_DIR
+    versions_dir.mkdir(parents=True, exist_ok=True)
+    tmp_dir = versions_dir / f".{version}.tmp"
+    final_dir = versions_dir / version
+    if tmp_dir.exists():
+        shutil.rmtree(tmp_dir)
+    tmp_dir.mkdir()
+
+    build(tmp_dir)
+    for dataset_path in dataset_paths:
+        if Path(dataset_path).exists():
+            shutil.copy2(dataset_path, tmp_dir / Path(dataset_path).name)
+    os.replace(tmp_dir, final_dir)
+
+    pointer_tmp = root / f".{CURRENT_FILE}.tmp"
+    pointer_tmp.write_text(version, encoding="utf-8")
+    os.replace(pointer_tmp, root / CURRENT_FILE)
+
+    # 清理旧版本（已 mmap 的进程在 Linux 上仍可继续读取被删除的文件）
+    old_versions = sorted(p for p in versions_dir.iterdir() if p.is_dir() and not p.name.startswith("."))
+    for old in old_versions[:-keep_versions]:
+        shutil.rmtree(old, ignore_errors=True)
+    return version
+
+
+def read_faiss_index(path: Path, mmap: bool = True):
+    """读取 FAISS 索引；mmap 模式下多个 worker 共享同一份页缓存"""
+    if mmap:
+        flags = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+        try:
+            return faiss.read_index(str(path), flags)
+        except Exception as e:
+            print(f"mmap 方式读取索引失败，改为完整加载: {str(e)}")
+    return faiss.read_index(str(path))
+
+
+def load_vector_db(index_dir: Path, embeddings, index_name: str = FAISS_INDEX_NAME,
+                   mmap: bool = True) -> FAISS:
+    """与 FAISS.load_local 等价，但索引文件以只读 mmap 方式打开"""
+    index = read_faiss_index(index_dir / f"{index_name}.faiss", mmap=mmap)
+    with open(index_dir / f"{index_name}.pkl", "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    return FAISS(embeddings, index, docstore, index_to_docstore_id)
+
+
+class IndexManager:
+    """持有当前生效的向量库，并在检测到新版本时后台加载、原子切换。
+
+    请求开始时取一次 vector_db（分片模式下为 shards）引用即可：切换只替换引用，进行中的请求继续使用旧版本。
+    依赖索引版本的数据（餐厅表、分面等）通过 add_loader 注册，新版本的这些数据全部加载完后才与向量库一起切换。
+    sharded 为 "auto" 时索引版本包含多个分片才启用分片模式，"1" 只要有分片清单就启用，"0" 始终加载完整索引；
+    分片模式下不加载完整索引，各分片按需加载。
+    """
+
+    def __init__(self, embeddings, root: Path = INDEX_ROOT, index_name: str = FAISS_INDEX_NAME,
+                 mmap: bool = True, sharded: str = "auto", shard_options: Optional[Dict] = None):
+        self.embeddings = embeddings
+        self.root = Path(root)
+        self.index_name = index_name
+        self.mmap = mmap
+        self.sharded = sharded
+        self.shard_options = shard_options or {}
+        self._listeners: List[Callable[[str, Optional[FAISS]], None]] = []
+        self._loaders: Dict[str, Callable[[str, Path], Any]] = {}
+        self._watch_thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        version, index_dir = resolve_index_dir(self.root)
+        self._current = (*self._open(version, index_dir), {})
+        mode = f"shards={len(self.shards.shards)}（按需加载）" if self.shards else "full"
+        print(f"向量库已加载: version={version}, dir={index_dir}, mmap={mmap}, {mode}")
+
+    def _open(self, version: str, index_dir: Path) -> Tuple[str, Path, Optional[FAISS], Optional["ShardSet"]]:
+        shards = None
+        if self.sharded != "0":
+            from backend.shards import ShardSet  # shards 依赖本模块，延迟导入避免循环引用
+            shards = ShardSet.open(index_dir, self._load_shard, **self.shard_options)
+            # 自动模式下只有一个网格分片（unknown 分片不计）时不值得分片，直接加载完整向量库
+            if shards is not None and self.sharded == "auto" and len(shards.geographic) <= 1:
+                shards = None
+        vector_db = None if shards else load_vector_db(index_dir, self.embeddings, self.index_name, self.mmap)
+        return version, index_dir, vector_db, shards
+
+    def _load_shard(self, shard_dir: Path) -> FAISS:
+        return load_vector_db(shard_dir, self.embeddings, self.index_name, self.mmap)
+
+    @property
+    def version(self) -> str:
+        return self._current[0]
+
+    @property
+    def vector_db(self) -> Optional[FAISS]:
+        """完整索引；分片模式下为 None"""
+        return self._current[2]
+
+    @property
+    def shards(self) -> Optional["ShardSet"]:
+        """分片模式下的分片集合，否则为 None"""
+        return self._current[3]
+
+    @property
+    def index_dir(self) -> Path:
+        return self._current[1]
+
+    @property
+    def dataset_path(self) -> Optional[Path]:
+        """当前版本构建时使用的数据快照（旧布局下不存在）"""
+        return dataset_snapshot(self._current[1])
+
+    def add_loader(self, name: str, loader: Callable[[str, Path], Any]):
+        """注册随索引版本加载的数据：loader(版本号, 索引目录) 的结果通过 resource(name) 读取"""
+        self._loaders[name] = loader
+        version, index_dir = self._current[0], self._current[1]
+        self._current = (*self._current[:4], {**self._current[4], name: loader(version, index_dir)})
+
+    def snapshot(self) -> Tuple[str, Path, Optional[FAISS], Optional["ShardSet"], Dict[str, Any]]:
+        """一次读取当前生效的 (版本号, 索引目录, 向量库, 分片, 随版本加载的数据)，各项来自同一次切换"""
+        return self._current
+
+    def resource(self, name: str) -> Any:
+        """当前版本下由 add_loader 加载的数据，与 version、vector_db 来自同一次切换"""
+        return self._current[4].get(name)
+
+    def on_swap(self, listener: Callable[[str, Optional[FAISS]], None]):
+        """注册版本切换回调，用于让依赖索引版本的缓存失效"""
+        self._listeners.append(listener)
+
+    def reload_if_changed(self) -> bool:
+        version, index_dir = resolve_index_dir(self.root)
+        if version == self.version:
+            return False
+        print(f"检测到新的索引版本 {version}，开始后台加载...")
+        start = time.time()
+        opened = self._open(version, index_dir)
+        # 先加载完新版本的全部数据，再一次性替换，避免请求读到新索引配旧餐厅表
+        resources = {name: loader(version, index_dir) for name, loader in self._loaders.items()}
+        self._current = (*opened, resources)
+        vector_db = self.vector_db
+        print(f"索引已切换到 {version}，耗时 {time.time() - start:.2f} 秒")
+        for listener in self._listeners:
+            try:
+                listener(version, vector_db)
+            except Exception as e:
+                print(f"索引切换回调出错: {str(e)}")
+        return True
+
+    def start_watching(self, interval: float = 10.0):
+        """启动后台线程轮询 CURRENT 指针"""
+        if self._watch_thread is not None:
+            return
+
+        def watch():
+            while not self._stop.wait(interval):
+                try:
+                    self.reload_if_changed()
+                except Exception as e:
+                    print(f"加载新索引版本失败，继续使用 {self.version}: {str(e)}")
+                if self.shards is not None:
+                    # 没有请求时也要卸载空闲分片
+                    self.shards.evict()
+
+        self._watch_thread = threading.Thread(target=watch, name="index-watcher", daemon=True)
+        self._watch_thread.start()
+
+    def stop_watching(self):
+        self._stop.set()
@@ -1,28 +1,36 @@
 import os
 os.environ["HF_HUB_DISABLE_SYMLINKS_WARNING"] = "1"
 
-import pandas as pd
+from langchain_core.documents import Document
 from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_community.document_loaders import DataFrameLoader
 from langchain_community.vectorstores import FAISS
 import numpy as np
 import time
+from pathlib import Path
+
+from backend.index_manager import publish_index_version
+from backend.facets import FacetIndex
+from backend.shards import SHARD_CELL_DEG_DEFAULT, write_shards
+from backend.dataset import DATASET_CSV_PATH, DATASET_PARQUET_PATH, ensure_parquet, load_records
 
 # ========== 数据加载与处理 ==========
-DATASET_PATH = os.path.join(os.path.dirname(__file__), "restaurant_all.csv")
+DATASET_PATH = str(DATASET_CSV_PATH)
 FAISS_REVIEWS_PATH_COSINE = os.path.join(os.path.dirname(__file__), "faiss_index_cosine")
 FAISS_INDEX_NAME = "index"
 FAISS_DISTANCE_STRATEGY_COSINE = "COSINE_DISTANCE"
 
 def get_documents(content_func=lambda row: row['name'] + '\n' + row['tag'],
                   metadata_fields=[]):
-    """加载并处理餐厅数据，生成文档对象"""
-    dataset_df = pd.read_csv(DATASET_PATH)
-    dataset_df.drop_duplicates(inplace=True)
-    dataset_df['page_content'] = dataset_df.apply(content_func, axis=1)
-    metadata_fields = list(set(metadata_fields + ['page_content']))
-    loader = DataFrameLoader(dataset_df[metadata_fields], page_content_column='page_content')
-    return loader.load()
+    """加载并处理餐厅数据，生成文档对象（优先读取列式数据集，列表字段已解析）"""
+    records = load_records()
+    documents = []
+    for row in records:
+        metadata = {field: row.get(field) for field in metadata_fields}
+        documents.append(Document(page_content=content_func(row), metadata=metadata))
+    return documents
+
+def _present(value) -> bool:
+    return value not in (None, "") and value == value  # 排除 None、空串与 NaN
 
 def content_func(row) -> str:
     """生成每家店铺的完整信息字符串"""
@@ -34,26 +42,24 @@ def content_func(row) -> str:
         "dp_rating", "dp_taste_rating", "dp_env_rating",
         "dp_service_rating", "dp_comment_num"
     ]
-    comment_fields = [
-        "dp_recommendation_dish", "dp_comment_keywords",
-        "dp_top3_comments"
-    ]
     info_parts = []
     for field in content_fields:
-        if pd.notna(row[field]):
+        if _present(row.get(field)):
             info_parts.append(f"{field}={row[field]}")
     rating_info = []
     for field in rating_fields:
-        if pd.notna(row[field]):
+        if _present(row.get(field)):
             rating_info.append(f"{field}={row[field]}")
     if rating_info:
         info_parts.append("评分信息:\n" + "\n".join(rating_info))
-    if pd.notna(row.get("dp_recommendation_dish")):
-        info_parts.append(f"推荐菜: {row['dp_recommendation_dish']}")
-    if pd.notna(row.get("dp_comment_keywords")):
-        info_parts.append(f"评论关键词: {row['dp_comment_keywords']}")
-    if pd.notna(row.get("dp_top3_comments")):
-        info_parts.append("精选评论:\n" + row['dp_top3_comments'].replace("|", "\n"))
+    if row.get("dp_recommendation_dish"):
+        info_parts.append(f"推荐菜: {','.join(row['dp_recommendation_dish'])}")
+    if row.get("dp_comment_keywords"):
+        keywords = "、".join(f"{k}({n})" for k, n in row["dp_comment_keywords"])
+        info_parts.append(f"评论关键词: {keywords}")
+    if row.get("dp_top3_comments"):
+        comments = "\n".join(f"[{d}] {t}" for d, t in row["dp_top3_comments"])
+        info_parts.append("精选评论:\n" + comments)
     return '\n'.join(info_parts)
 
 def get_vector_database(documents, embedding_model, distance_strategy):
@@ -76,6 +82,9 @@ def init_vectordb():
         }
     )
     
+    # 摄取得到的 CSV 比列式数据集新时先重新生成（未安装 pyarrow 时直接读取 CSV）
+    ensure_parquet()
+
     # 加载文档数据
     metadata_fields = [
         "location", "opentime_week",
@@ -96,9 +105,29 @@ def init_vectordb():
         print(f"处理进度: {min((batch+1)*100, doclen)}/{doclen}")
         time.sleep(1)  # 可适当缩短等待时间
 
-    # 保存向量库
-    vector_db.save_local(folder_path=FAISS_REVIEWS_PATH_COSINE, index_name=FAISS_INDEX_NAME)
-    print(f"向量数据库已保存到: {FAISS_REVIEWS_PATH_COSINE}")
+    # 评论关键词与推荐菜提取为结构化分面，与向量库保存在同一版本目录，行号与数据快照一致
+    records = load_records(columns=["dp_comment_keywords", "dp_recommendation_dish"])
+    facets = FacetIndex.from_lists([r["dp_comment_keywords"] for r in records],
+                                   [r["dp_recommendation_dish"] for r in records])
+    print(f"分面: {len(facets.keywords)} 个评论关键词, {len(facets.dishes)} 道推荐菜")
+
+    def build(folder):
+        vector_db.save_local(folder_path=str(folder), index_name=FAISS_INDEX_NAME)
+        facets.save(folder)
+        # 按经纬度网格另存分片索引（复用已编码的向量），多城市数据时服务端只加载用户附近的分片
+        if os.environ.get("INDEX_SHARDS", "1") != "0":
+            shards = write_shards(vector_db, folder,
+                                  float(os.environ.get("INDEX_SHARD_CELL_DEG", SHARD_CELL_DEG_DEFAULT)))
+            print(f"分片: {len(shards)} 个, " + ", ".join(f"{s.shard_id}({s.count})" for s in shards))
+
+    # 以新版本保存向量库，并原子切换 CURRENT 指针；运行中的服务会自动热加载
+    version = publish_index_version(
+        build,
+        root=Path(FAISS_REVIEWS_PATH_COSINE),
+        dataset_paths=[DATASET_PARQUET_PATH, DATASET_CSV_PATH],
+        keep_versions=int(os.environ.get("INDEX_KEEP_VERSIONS", "3"))
+    )
+    print(f"向量数据库已保存到: {FAISS_REVIEWS_PATH_COSINE} (version={version})")
 
 if __name__ == "__main__":
     init_vectordb()
@@ -0,0 +1,155 @@
+import re
+import threading
+from collections import Counter
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+# ========== 常量定义 ==========
+INTENT_RECOMMEND = "recommend"   # 默认：走检索 + LLM
+INTENT_GREETING = "greeting"
+INTENT_THANKS = "thanks"
+INTENT_OFF_TOPIC = "off_topic"
+INTENT_DETAIL = "detail"
+
+# 最近质心分类的标注样例（bge-small-zh 编码后取均值作为质心）
+INTENT_EXAMPLES = {
+    INTENT_GREETING: ["你好", "您好", "嗨", "在吗", "哈喽", "早上好", "晚上好", "你是谁", "你能做什么"],
+    INTENT_THANKS: ["谢谢", "谢谢你", "多谢", "感谢推荐", "好的谢谢", "辛苦了", "太棒了谢谢"],
+    INTENT_OFF_TOPIC: ["今天天气怎么样", "帮我写一段代码", "股票会涨吗", "讲个笑话", "帮我翻译这句话",
+                       "数学题怎么做", "推荐一部电影", "推荐一本书", "最近有什么新闻", "怎么学英语",
+                       "附近有书店吗", "附近哪里有超市", "最近的地铁站在哪"],
+    INTENT_RECOMMEND: ["推荐一家好吃的餐厅", "附近有什么便宜的川菜", "想吃火锅", "预算50元吃什么",
+                       "适合约会的餐厅", "南大附近有什么好吃的", "中午吃什么", "有没有不用排队的店",
+                         "帮我推荐几家", "人均100元左右的店"],
+}
+# 最近质心需领先第二名的余弦相似度，低于该值时回退为推荐
+INTENT_MARGIN = 0.05
+# 问题含"推荐""店""元"等泛用字词时，质心需领先该幅度才判为非推荐意图
+INTENT_STRONG_MARGIN = 0.1
+# 寒暄类意图只对短句生效
+SHORT_MESSAGE_LEN = 12
+
+_GREETING_RE = re.compile(r"^(你好|您好|嗨|哈喽|hi|hello|hey|在吗|在不在|早上好|中午好|下午好|晚上好)[呀啊哦~～!！。.,，\s]*$", re.I)
+_THANKS_RE = re.compile(r"^(好的|好|嗯|ok|okay)?[,，\s]*(谢谢|多谢|感谢|谢啦|thx|thanks|thank you)(你|您|啦|了)?[呀啊~～!！。.\s]*$", re.I)
+_DETAIL_RE = re.compile(r"详细|详情|具体|介绍|电话|地址|在哪|营业时间|几点|开门|关门|人均|推荐菜|招牌|评价|评分|怎么样")
+# 询问详情时又要求其他候选的，仍交给检索 + LLM
+_ALTERNATIVE_RE = re.compile(r"还有|别的|其他|其它|类似|相似|换一|附近|对比|比较|哪家")
+# 出现这些词时一定与餐饮有关，不会被判为无关问题；"推荐""店""元"等泛用字词不在此列，交给质心分类
+_FOOD_RE = re.compile(r"吃|喝|餐|菜|饭|面条|面馆|拉面|米线|米粉|火锅|烧烤|烤肉|小吃|甜品|奶茶|咖啡|早茶|人均|口味|好吃|难吃|辣|外卖|夜宵|宵夜|聚餐|饿")
+# 明确与餐饮无关的话题词；问题中没有餐饮词时直接判为无关问题，不依赖质心分类
+_OFF_TOPIC_RE = re.compile(r"电影|电视剧|综艺|动漫|小说|书店|本书|看书|读书|歌曲|听歌|音乐|游戏|股票|基金|天气|航班|机票|"
+                           r"火车票|高铁|代码|编程|翻译|作业|考试|新闻|理发|药店|医院|超市|快递|加油站|地铁站|公交|租房|打车")
+# 常见于餐饮提问但不足以单独判定的字词
+_WEAK_FOOD_RE = re.compile(r"推荐|店|馆|家|元|块|预算|排队|约会|几个人")
+
+RESPONSE_TEMPLATES = {
+    INTENT_GREETING: "你好！我是\"菜根探\"，可以根据你的口味、预算和位置推荐附近的餐厅。"
+                     "告诉我这次想吃什么、大概预算和几个人，我来帮你挑选～",
+    INTENT_THANKS: "不客气！还想吃点别的，或者需要补充预算、口味、出发地等条件，随时告诉我。",
+    INTENT_OFF_TOPIC: "仅能为您提供美食/餐厅推荐服务。可以告诉我你想吃的菜系、预算或用餐场景，我来为你推荐餐厅。",
+}
+
+
+def format_restaurant_detail(row: Dict) -> str:
+    """由餐厅表中的一行生成详情回复，缺失的字段说明"该项暂无数据\""""
+    def show(value, suffix=""):
+        return f"{value}{suffix}" if value not in (None, "", []) else "该项暂无数据"
+
+    cost = row.get("dp_cost") if row.get("dp_cost") is not None else row.get("cost")
+    rating = row.get("dp_rating") if row.get("dp_rating") is not None else row.get("rating")
+    lines = [
+        f"**{row['name']}**",
+        f"- 地址: {show(row.get('address'))}",
+        f"- 类型: {show((row.get('type') or '').split(';')[-1])}",
+        f"- 电话: {show(row.get('tel'))}",
+        f"- 人均: {show(cost and round(cost), '元')}",
+        f"- 评分: {show(rating)}",
+        f"- 今日营业: {show(row.get('opentime_today'))}",
+        f"- 每周营业: {show(row.get('opentime_week'))}",
+        f"- 推荐菜: {show('、'.join(row.get('dp_recommendation_dish') or []))}",
+    ]
+    keywords = row.get("dp_comment_keywords") or []
+    if keywords:
+        lines.append("- 评论关键词: " + "、".join(f"{k['keyword']}({k['count']})" for k in keywords[:8]))
+    comments = row.get("dp_top3_comments") or []
+    if comments:
+        lines.append(f"- 精选评论: [{comments[0]['date']}] {comments[0]['text'][:120]}")
+    return "\n".join(lines)
+
+
+class IntentRouter:
+    """在检索与 LLM 之前做本地意图识别：关键词规则优先（餐饮词 > 无关话题词），其次为嵌入向量的最近质心分类。
+
+    寒暄、致谢与无关问题直接返回模板，询问某家餐厅详情时从餐厅表中生成回复，
+    其余问题（默认）交给检索 + LLM。
+    """
+
+    def __init__(self, embed: Optional[Callable[[str], np.ndarray]] = None,
+                 examples: Dict[str, List[str]] = INTENT_EXAMPLES, margin: float = INTENT_MARGIN):
+        self.embed = embed
+        self.examples = examples
+        self.margin = margin
+        self._labels: List[str] = []
+        self._centroids: Optional[np.ndarray] = None
+        self._lock = threading.Lock()
+        self.counts = Counter()
+
+    def _ensure_centroids(self):
+        if self._centroids is not None or self.embed is None:
+            return
+        with self._lock:
+            if self._centroids is not None:
+                return
+            labels, centroids = [], []
+            for label, texts in self.examples.items():
+                vectors = np.stack([self.embed(t) for t in texts])
+                centroid = vectors.mean(axis=0)
+                centroids.append(centroid / (np.linalg.norm(centroid) or 1.0))
+                labels.append(label)
+            self._labels = labels
+            self._centroids = np.stack(centroids)
+
+    def warm_up(self):
+        """预先编码标注样例并计算质心（服务启动时调用，避免首个用户请求承担编码开销）"""
+        self._ensure_centroids()
+
+    def nearest_centroid(self, message: str, margin: Optional[float] = None) -> Optional[str]:
+        """返回领先幅度超过 margin（默认 self.margin）的最近质心标签，否则 None"""
+        self._ensure_centroids()
+        if self._centroids is None:
+            return None
+        vector = self.embed(message)
+        sims = self._centroids @ (vector / (np.linalg.norm(vector) or 1.0))
+        order = np.argsort(-sims)
+        if sims[order[0]] - sims[order[1]] < (self.margin if margin is None else margin):
+            return None
+        return self._labels[order[0]]
+
+    def classify(self, message: str, restaurant_id: Optional[int] = None) -> str:
+        """restaurant_id 为问题中提到的餐厅行号（由调用方从餐厅表中解析）"""
+        text = message.strip()
+        if _GREETING_RE.match(text):
+            intent = INTENT_GREETING
+        elif _THANKS_RE.match(text):
+            intent = INTENT_THANKS
+        elif restaurant_id is not None and _DETAIL_RE.search(text) and not _ALTERNATIVE_RE.search(text):
+            intent = INTENT_DETAIL
+        elif _FOOD_RE.search(text) or restaurant_id is not None:
+            intent = INTENT_RECOMMEND
+        elif _OFF_TOPIC_RE.search(text):
+            intent = INTENT_OFF_TOPIC
+        else:
+            margin = INTENT_STRONG_MARGIN if _WEAK_FOOD_RE.search(text) else None
+            intent = self.nearest_centroid(text, margin) or INTENT_RECOMMEND
+            if intent in (INTENT_GREETING, INTENT_THANKS) and len(text) > SHORT_MESSAGE_LEN:
+                intent = INTENT_RECOMMEND
+        self.counts[intent] += 1
+        return intent
+
+    def metrics(self) -> Dict:
+        total = sum(self.counts.values())
+        return {
+            "routed": dict(self.counts),
+            "skipped_llm_ratio": (total - self.counts[INTENT_RECOMMEND]) / total if total else 0.0,
+        }
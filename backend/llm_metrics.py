@@ -0,0 +1,110 @@
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+
+from backend.metrics import percentile
+
+# ========== 常量定义 ==========
+# 保留最近 N 次调用的首 token 延迟用于计算分位数
+TTFT_WINDOW = 500
+# 缓存命中 token 占输入比例不低于该值的调用计为"命中前缀缓存"
+CACHE_HIT_CALL_RATIO = 0.5
+
+
+def extract_usage(response: LLMResult) -> Dict[str, int]:
+    """从一次调用的结果中取 token 用量。
+
+    流式调用读取消息上的 usage_metadata（DeepSeek 的 prompt_tokens_details.cached_tokens
+    映射为 input_token_details.cache_read）；非流式调用还可从 llm_output 中读到
+    DeepSeek 原始的 prompt_cache_hit_tokens / prompt_cache_miss_tokens。
+    """
+    usage = {"prompt_tokens": 0, "completion_tokens": 0, "cache_hit_tokens": 0}
+    for generations in response.generations:
+        for generation in generations:
+            metadata = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if metadata:
+                usage["prompt_tokens"] += metadata.get("input_tokens", 0)
+                usage["completion_tokens"] += metadata.get("output_tokens", 0)
+                usage["cache_hit_tokens"] += (metadata.get("input_token_details") or {}).get("cache_read", 0) or 0
+    raw = (response.llm_output or {}).get("token_usage") or {}
+    if raw:
+        usage["prompt_tokens"] = usage["prompt_tokens"] or raw.get("prompt_tokens", 0)
+        usage["completion_tokens"] = usage["completion_tokens"] or raw.get("completion_tokens", 0)
+        if "prompt_cache_hit_tokens" in raw:
+            usage["cache_hit_tokens"] = raw["prompt_cache_hit_tokens"]
+    return usage
+
+
+class LLMUsageTracker(BaseCallbackHandler):
+    """统计 LLM 调用的 token 用量、前缀缓存命中与首 token 延迟（TTFT），供 /chat/metrics 展示"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._started: Dict[UUID, float] = {}
+        self._first_token: Dict[UUID, float] = {}
+        self._ttft_hit = deque(maxlen=TTFT_WINDOW)
+        self._ttft_miss = deque(maxlen=TTFT_WINDOW)
+        self.calls = 0
+        self.errors = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cache_hit_tokens = 0
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: List[List[Any]], *,
+                            run_id: UUID, **kwargs: Any) -> None:
+        with self._lock:
+            self._started[run_id] = time.perf_counter()
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], *,
+                     run_id: UUID, **kwargs: Any) -> None:
+        with self._lock:
+            self._started[run_id] = time.perf_counter()
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any) -> None:
+        if run_id in self._first_token or not token:
+            return
+        with self._lock:
+            self._first_token.setdefault(run_id, time.perf_counter())
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        usage = extract_usage(response)
+        with self._lock:
+            started = self._started.pop(run_id, None)
+            first = self._first_token.pop(run_id, None)
+            self.calls += 1
+            self.prompt_tokens += usage["prompt_tokens"]
+            self.completion_tokens += usage["completion_tokens"]
+            self.cache_hit_tokens += usage["cache_hit_tokens"]
+            if started is not None and first is not None:
+                hit = usage["prompt_tokens"] and usage["cache_hit_tokens"] / usage["prompt_tokens"] >= CACHE_HIT_CALL_RATIO
+                (self._ttft_hit if hit else self._ttft_miss).append(first - started)
+        print(f"LLM 用量: 输入 {usage['prompt_tokens']} tokens（缓存命中 {usage['cache_hit_tokens']}），"
+              f"输出 {usage['completion_tokens']} tokens")
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        with self._lock:
+            self._started.pop(run_id, None)
+            self._first_token.pop(run_id, None)
+            self.errors += 1
+
+    def metrics(self) -> Dict:
+        with self._lock:
+            ttft_hit, ttft_miss = list(self._ttft_hit), list(self._ttft_miss)
+            return {
+                "calls": self.calls,
+                "errors": self.errors,
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+                "cache_hit_tokens": self.cache_hit_tokens,
+                "cache_miss_tokens": self.prompt_tokens - self.cache_hit_tokens,
+                "cache_hit_ratio": self.cache_hit_tokens / self.prompt_tokens if self.prompt_tokens else 0.0,
+                "ttft_seconds_p50": percentile(ttft_hit + ttft_miss, 0.5),
+                "ttft_seconds_p95": percentile(ttft_hit + ttft_miss, 0.95),
+                "ttft_seconds_p50_cache_hit": percentile(ttft_hit, 0.5),
+                "ttft_seconds_p50_cache_miss": percentile(ttft_miss, 0.5),
+            }
@@ -1,26 +1,43 @@
+import os
 import uvicorn
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from api.preferences import router as preferences_router
-from api.chat import router as chat_router
 
-app = FastAPI()
+# 多进程模式：每个 worker 以 "main:app" 独立导入本模块，
+# 各自加载模型，并以只读 mmap 方式共享同一份 FAISS 索引文件
+WORKERS = int(os.environ.get("BACKEND_WORKERS", "1"))
 
-# 添加 CORS 中间件
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["http://localhost:3000"],  # 前端地址
-    allow_credentials=True,
-    allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-    allow_headers=["Content-Type", "Authorization", "Accept"],
-    expose_headers=["Content-Length"],
-    max_age=3600
-)
+def create_app() -> FastAPI:
+    # 路由模块在导入时会初始化 Chatbot，放在函数内以免主进程重复加载模型
+    from api.preferences import router as preferences_router
+    from api.chat import router as chat_router
+    from api.search import router as search_router
+    from api.restaurants import router as restaurants_router
 
-# 包含路由
-app.include_router(preferences_router)
-app.include_router(chat_router)
+    app = FastAPI()
+
+    # 添加 CORS 中间件
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["http://localhost:3000"],  # 前端地址
+        allow_credentials=True,
+        allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
+        allow_headers=["Content-Type", "Authorization", "Accept", "If-None-Match", "If-Modified-Since", "X-User-Id"],
+        expose_headers=["Content-Length", "ETag", "Last-Modified"],
+        max_age=3600
+    )
+
+    # 包含路由
+    app.include_router(preferences_router)
+    app.include_router(chat_router)
+    app.include_router(search_router)
+    app.include_router(restaurants_router)
+    return app
+
+if __name__ != "__main__":
+    # 由 uvicorn / gunicorn 以 "main:app" 导入时构建应用
+    app = create_app()
 
 if __name__ == "__main__":
-    print("Starting FastAPI server at http://localhost:8000")
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    print(f"Starting FastAPI server at http://localhost:8000 (workers={WORKERS})")
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, workers=WORKERS)
@@ -0,0 +1,159 @@
+import re
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+# ========== token 估算 ==========
+# DeepSeek 官方给出的粗略换算：1 个中文字符约 0.6 token，1 个英文字符约 0.3 token
+CJK_TOKEN_RATIO = 0.6
+OTHER_TOKEN_RATIO = 0.3
+_CJK_RE = re.compile(r"[\u3400-\u9fff\uf900-\ufaff]")
+
+# 推荐回答中常见的餐厅名写法：**名称**、### 1. 名称、表格首列
+_BOLD_RE = re.compile(r"\*\*([^*\n]{2,40})\*\*")
+_HEADING_RE = re.compile(r"^#{1,6}\s*(?:\d+[.、)]\s*)?(.{2,40}?)\s*$", re.MULTILINE)
+# 摘要中"已推荐"一行最多保留的餐厅数（保留最近推荐的），该行不随摘要行一起裁剪
+RECOMMENDED_MAX_NAMES = 20
+
+
+def estimate_tokens(text: str) -> int:
+    """按字符类型粗略估算文本的 token 数"""
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    return int(cjk * CJK_TOKEN_RATIO + (len(text) - cjk) * OTHER_TOKEN_RATIO) + 1
+
+
+def extract_restaurant_names(answer: str, known_names: Iterable[str] = ()) -> List[str]:
+    """从一轮回答中提取已推荐的餐厅名称（按出现顺序去重）"""
+    found = []
+    for name in known_names:
+        pos = answer.find(name)
+        if pos >= 0:
+            found.append((pos, name))
+    if found:
+        found.sort()
+        # 去掉被更长名称包含的短名称，如 "石锅房" 与 "石锅房(汉口路店)"
+        names = [n for _, n in found]
+        return [n for n in names if not any(n != m and n in m for m in names)]
+
+    candidates = _BOLD_RE.findall(answer) + _HEADING_RE.findall(answer)
+    names = []
+    for c in candidates:
+        c = c.strip(" :：")
+        if c and c not in names and not c.endswith(("：", ":")):
+            names.append(c)
+    return names
+
+
+class RollingSummaryMemory:
+    """有界对话记忆：保留最近 N 轮原文，更早的轮次压缩为问题摘要与一行"已推荐餐厅"。
+
+    摘要超出 summary_max_tokens 时只丢弃最早的问题行，已推荐的餐厅名称始终保留。
+
+    接口与 ConversationBufferMemory 保持一致（save_context / load_memory_variables / clear），
+    渲染后的历史总量不超过 max_tokens。
+    """
+
+    def __init__(self,
+                 max_turns: int = 3,
+                 max_tokens: int = 1500,
+                 summary_max_tokens: int = 300,
+                 known_names: Iterable[str] = (),
+                 input_key: str = "question",
+                 output_key: str = "answer",
+                 memory_key: str = "history",
+                 return_messages: bool = False):
+        self.max_turns = max(1, max_turns)
+        self.max_tokens = max_tokens
+        self.summary_max_tokens = summary_max_tokens
+        self.known_names = sorted(set(known_names), key=len, reverse=True)
+        self.input_key = input_key
+        self.output_key = output_key
+        self.memory_key = memory_key
+        self.return_messages = return_messages
+        self.turns: List[Tuple[str, str]] = []
+        self.summary_lines: List[str] = []
+        self.recommended: List[str] = []
+
+    # ---------- 写入 ----------
+    def save_context(self, inputs: Dict, outputs: Dict):
+        """记录一轮对话，并按轮数与 token 预算压缩旧轮次"""
+        self.turns.append((str(inputs.get(self.input_key, "")),
+                           str(outputs.get(self.output_key, ""))))
+        while len(self.turns) > self.max_turns:
+            self._compress_oldest()
+        while len(self.turns) > 1 and self._verbatim_tokens() + self._summary_tokens() > self.max_tokens:
+            self._compress_oldest()
+
+    def _compress_oldest(self):
+        question, answer = self.turns.pop(0)
+        for name in extract_restaurant_names(answer, self.known_names):
+            if name in self.recommended:
+                self.recommended.remove(name)
+            self.recommended.append(name)
+        del self.recommended[:-RECOMMENDED_MAX_NAMES]
+        q = question if len(question) <= 40 else question[:40] + "…"
+        self.summary_lines.append(f"- 用户问: {q}")
+        while self.summary_lines and self._summary_tokens() > self.summary_max_tokens:
+            self.summary_lines.pop(0)
+
+    def clear(self):
+        self.turns.clear()
+        self.summary_lines.clear()
+        self.recommended.clear()
+
+    # ---------- 读取 ----------
+    def _summary_text(self) -> str:
+        lines = list(self.summary_lines)
+        if self.recommended:
+            lines.append(f"- 已推荐: {'、'.join(self.recommended)}")
+        if not lines:
+            return ""
+        return "较早对话摘要:\n" + "\n".join(lines)
+
+    def _summary_tokens(self) -> int:
+        return estimate_tokens(self._summary_text())
+
+    def _verbatim_tokens(self) -> int:
+        return sum(estimate_tokens(q) + estimate_tokens(a) for q, a in self.turns)
+
+    def _fitted_turns(self) -> List[Tuple[str, str]]:
+        """最近一轮回答过长时截断，保证整体不超出预算"""
+        budget = self.max_tokens - self._summary_tokens()
+        fitted = []
+        for question, answer in reversed(self.turns):
+            cost = estimate_tokens(question) + estimate_tokens(answer)
+            if cost > budget:
+                keep = max(0, int((budget - estimate_tokens(question)) / CJK_TOKEN_RATIO))
+                if keep <= 0:
+                    break
+                answer = answer[:keep] + "…"
+                cost = budget
+            fitted.append((question, answer))
+            budget -= cost
+        return list(reversed(fitted))
+
+    def load_memory_variables(self, inputs: Optional[Dict] = None) -> Dict:
+        turns = self._fitted_turns()
+        summary = self._summary_text()
+        if self.return_messages:
+            messages = [HumanMessage(content=summary)] if summary else []
+            for question, answer in turns:
+                messages.extend([HumanMessage(content=question), AIMessage(content=answer)])
+            return {self.memory_key: messages}
+
+        parts = [summary] if summary else []
+        for question, answer in turns:
+            parts.append(f"用户: {question}\n助手: {answer}")
+        return {self.memory_key: "\n\n".join(parts)}
+
+    def stats(self) -> Dict:
+        turns = self._fitted_turns()
+        return {
+            "verbatim_turns": len(turns),
+            "summarized_turns": len(self.summary_lines),
+            "recommended": len(self.recommended),
+            "estimated_tokens": self._summary_tokens()
+                                + sum(estimate_tokens(q) + estimate_tokens(a) for q, a in turns),
+        }
@@ -0,0 +1,7 @@
+from typing import Sequence
+
+
+def percentile(values: Sequence[float], q: float) -> float:
+    """取最近窗口内数据的 q 分位数（最近秩法），无数据时返回 0"""
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] if values else 0.0
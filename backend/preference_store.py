@@ -0,0 +1,192 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# ========== 常量定义 ==========
+DATA_DIR = Path(__file__).parent / "data"
+PREFERENCES_DIR = DATA_DIR / "preferences"
+# 旧版全局偏好文件，首次读取默认用户时迁移
+LEGACY_PREF_PATH = DATA_DIR / "user_preferences.json"
+DEFAULT_USER_ID = "default"
+
+_SAFE_USER_ID = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+class PreferenceSnapshot:
+    """某个用户在某一版本的偏好（只读）"""
+    __slots__ = ("user_id", "version", "preferences", "updated_at")
+
+    def __init__(self, user_id: str, version: int, preferences: Dict, updated_at: float):
+        self.user_id = user_id
+        self.version = version
+        self.preferences = preferences
+        self.updated_at = updated_at
+
+    def to_dict(self) -> Dict:
+        return {"user_id": self.user_id, "version": self.version,
+                "preferences": self.preferences, "updated_at": self.updated_at}
+
+
+class PreferenceStore:
+    """按用户保存偏好：每个用户一个 JSON 文件，写入时先写临时文件再原子重命名。
+
+    每次保存版本号加一，并在进程内通知订阅者（如 Chatbot 的提示词变量缓存），
+    下游缓存以 (user_id, version) 为键精确失效，不再轮询磁盘。
+    多 worker 部署时，读取会比较文件修改时间，发现其他进程写入后重新加载；
+    保存时持有跨进程的文件锁完成"读取-加一-写入"，不同 worker 不会写出相同的版本号。
+    """
+
+    _instance = None  # 单例模式实例
+    _instance_lock = threading.Lock()
+
+    def __init__(self, root: Path = PREFERENCES_DIR, legacy_path: Optional[Path] = LEGACY_PREF_PATH):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.legacy_path = Path(legacy_path) if legacy_path else None
+        self._cache: Dict[str, Tuple[int, PreferenceSnapshot]] = {}  # user_id -> (文件 mtime_ns, 快照)
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+        self._listeners: List[Callable[[PreferenceSnapshot], None]] = []
+
+    @classmethod
+    def get_instance(cls) -> "PreferenceStore":
+        """获取进程内共享的偏好存储"""
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = cls()
+        return cls._instance
+
+    # ---------- 内部工具 ----------
+    @staticmethod
+    def normalize_user_id(user_id: Optional[str]) -> str:
+        """空值归为默认用户；非安全字符的 id 以哈希作为文件名"""
+        user_id = (user_id or "").strip() or DEFAULT_USER_ID
+        if _SAFE_USER_ID.match(user_id):
+            return user_id
+        return "u_" + hashlib.sha1(user_id.encode("utf-8")).hexdigest()[:24]
+
+    def _path(self, user_id: str) -> Path:
+        return self.root / f"{user_id}.json"
+
+    def _lock(self, user_id: str) -> threading.Lock:
+        with self._locks_guard:
+            return self._locks.setdefault(user_id, threading.Lock())
+
+    @contextmanager
+    def _file_lock(self, user_id: str) -> Iterator[None]:
+        """跨进程互斥：锁住用户对应的 .lock 文件"""
+        with open(self.root / f".{user_id}.lock", "a+b") as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+                else:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def _read(self, user_id: str) -> Tuple[int, PreferenceSnapshot]:
+        path = self._path(user_id)
+        try:
+            mtime = path.stat().st_mtime_ns
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return mtime, PreferenceSnapshot(user_id, int(data.get("version", 0)),
+                                             data.get("preferences") or {}, data.get("updated_at", 0.0))
+        except FileNotFoundError:
+            if user_id == DEFAULT_USER_ID and self._migrate_legacy():
+                return self._read(user_id)
+            return -1, PreferenceSnapshot(user_id, 0, {}, 0.0)
+        except (OSError, ValueError) as e:
+            print(f"读取用户 {user_id} 的偏好时出错: {str(e)}")
+            return -1, PreferenceSnapshot(user_id, 0, {}, 0.0)
+
+    def _write(self, snapshot: PreferenceSnapshot):
+        path = self._path(snapshot.user_id)
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"version": snapshot.version, "updated_at": snapshot.updated_at,
+                       "preferences": snapshot.preferences}, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    def _migrate_legacy(self) -> bool:
+        """把旧版全局 user_preferences.json 迁移为默认用户的第 1 版"""
+        if self.legacy_path is None or not self.legacy_path.exists():
+            return False
+        try:
+            with open(self.legacy_path, "r", encoding="utf-8") as f:
+                legacy = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if not legacy:
+            return False
+        self._write(PreferenceSnapshot(DEFAULT_USER_ID, 1, legacy, time.time()))
+        print(f"已将 {self.legacy_path} 迁移为默认用户偏好")
+        return True
+
+    # ---------- 读写 ----------
+    def get(self, user_id: Optional[str] = None) -> PreferenceSnapshot:
+        """读取用户偏好；缓存命中时只需一次 stat"""
+        user_id = self.normalize_user_id(user_id)
+        cached = self._cache.get(user_id)
+        if cached is not None:
+            try:
+                mtime = self._path(user_id).stat().st_mtime_ns
+            except FileNotFoundError:
+                mtime = -1
+            if mtime == cached[0]:
+                return cached[1]
+        with self._lock(user_id):
+            entry = self._read(user_id)
+            self._cache[user_id] = entry
+        if cached is not None and entry[1].version != cached[1].version:
+            self._notify(entry[1])  # 其他 worker 写入的新版本
+        return entry[1]
+
+    def save(self, user_id: Optional[str], preferences: Dict) -> PreferenceSnapshot:
+        """保存偏好：版本号单调递增（跨 worker 进程），写入完成后通知订阅者"""
+        user_id = self.normalize_user_id(user_id)
+        with self._lock(user_id), self._file_lock(user_id):
+            _, current = self._read(user_id)
+            snapshot = PreferenceSnapshot(user_id, current.version + 1, preferences, time.time())
+            self._write(snapshot)
+            self._cache[user_id] = (self._path(user_id).stat().st_mtime_ns, snapshot)
+        self._notify(snapshot)
+        return snapshot
+
+    def user_ids(self) -> List[str]:
+        """已保存偏好的用户，按最近修改时间倒序"""
+        paths = sorted(self.root.glob("*.json"), key=lambda p: p.stat().st_mtime, reverse=True)
+        return [p.stem for p in paths]
+
+    # ---------- 变更通知 ----------
+    def subscribe(self, listener: Callable[[PreferenceSnapshot], None]):
+        """注册偏好变更回调，参数为新版本的快照"""
+        self._listeners.append(listener)
+
+    def _notify(self, snapshot: PreferenceSnapshot):
+        for listener in self._listeners:
+            try:
+                listener(snapshot)
+            except Exception as e:
+                print(f"偏好变更回调出错: {str(e)}")
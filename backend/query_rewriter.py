@@ -0,0 +1,252 @@
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, List, Optional
+
+import numpy as np
+
+from backend.memory import extract_restaurant_names
+
+# ========== 常量定义 ==========
+# 携带的上下文向量与当前问题向量的合并权重
+CARRY_WEIGHT = 0.5
+# "附近"的范围（米）与补充的附近候选数上限
+NEAR_RADIUS_M = 1000.0
+NEAR_EXTRA_CANDIDATES = 10
+# "便宜点"在没有参照价格时相对于当前预算的折扣
+CHEAPER_RATIO = 0.8
+# 结构化过滤后至少保留的文档数，不足时用被过滤掉的文档补齐
+MIN_PLAN_RESULTS = 5
+# 保留对话状态的用户数上限，超出时淘汰最久未活跃的用户
+REWRITER_MAX_USERS = 1000
+# 未指定用户时使用的对话状态键
+DEFAULT_STATE_KEY = ""
+# 常见菜系/品类，与餐厅表 type 字段的末级分类一起作为可识别的品类词
+CUISINE_TERMS = ("川菜", "湘菜", "粤菜", "东北菜", "西北菜", "江浙菜", "淮扬菜", "本帮菜", "清真",
+                 "火锅", "烧烤", "烤肉", "日料", "日本料理", "韩国料理", "韩餐", "西餐", "快餐", "小吃",
+                 "面馆", "米线", "麻辣烫", "海鲜", "甜品", "咖啡", "茶饮", "自助", "素食", "早餐")
+
+_CHINESE_DIGITS = {"一": 1, "二": 2, "两": 2, "三": 3, "四": 4, "五": 5, "六": 6, "七": 7, "八": 8, "九": 9, "十": 10}
+_ORDINAL_RE = re.compile(r"第\s*([一二两三四五六七八九十\d]{1,2})\s*(?:家|个|间|条)")
+_LAST_RE = re.compile(r"最后一(?:家|个)")
+_THIS_RE = re.compile(r"(?:这|那|上一|刚才那|刚刚那)(?:家|个|间)")
+_BUDGET_RE = re.compile(r"(?:预算|人均|不超过|低于|少于|控制在)\s*(\d{1,4})|(\d{1,4})\s*(?:元|块)\s*(?:以内|以下|之内|左右)?")
+_CHEAPER_RE = re.compile(r"便宜|实惠|省钱|低一点|少一点|划算")
+_NEAR_RE = re.compile(r"附近|旁边|周边|周围|隔壁|不远|近一点|离.{0,6}近")
+_MORE_RE = re.compile(r"还有|别的|其他|其它|换一|另外")
+# 显式的追问/延续提示：以"那""再""换"等开头，或以"呢"结尾（"火锅呢"）
+_FOLLOWUP_RE = re.compile(r"^(那|那么|还有|再|换|那家|这家|它|他们)|呢\s*[?？]?$")
+_TYPE_PAREN_RE = re.compile(r"[(（]([^()（）]*)[)）]")
+
+
+class ConversationState:
+    """单个用户的多轮状态：上一轮推荐的餐厅与生效的预算、品类"""
+    __slots__ = ("last_recommended", "focus", "cuisine", "max_cost")
+
+    def __init__(self):
+        self.last_recommended: List[str] = []
+        self.focus: Optional[str] = None  # 最近一轮单独讨论的餐厅
+        self.cuisine: Optional[str] = None
+        self.max_cost: Optional[float] = None
+
+
+class RetrievalPlan:
+    """一轮检索的计划：携带的上下文文本与结构化过滤条件（餐厅以名称保存，跨索引版本有效）"""
+    __slots__ = ("carry_text", "cuisine", "max_cost", "anchor", "near", "exclude")
+
+    def __init__(self, carry_text: str = "", cuisine: Optional[str] = None, max_cost: Optional[float] = None,
+                 anchor: Optional[str] = None, near: bool = False, exclude: tuple = ()):
+        self.carry_text = carry_text
+        self.cuisine = cuisine
+        self.max_cost = max_cost
+        self.anchor = anchor
+        self.near = near
+        self.exclude = exclude
+
+    def key(self) -> List:
+        """参与请求合并键的部分"""
+        return [self.carry_text, self.max_cost, self.anchor, self.near, list(self.exclude)]
+
+    def __repr__(self) -> str:
+        return (f"RetrievalPlan(carry={self.carry_text!r}, max_cost={self.max_cost}, "
+                f"anchor={self.anchor!r}, near={self.near}, exclude={len(self.exclude)})")
+
+
+def _parse_ordinal(text: str) -> Optional[int]:
+    """'第二家' -> 1（从 0 开始）；'最后一家' -> -1"""
+    if _LAST_RE.search(text):
+        return -1
+    match = _ORDINAL_RE.search(text)
+    if not match:
+        return None
+    token = match.group(1)
+    if token.isdigit():
+        return int(token) - 1
+    if token.startswith("十"):
+        return 10 + _CHINESE_DIGITS.get(token[1:], 0) - 1
+    return _CHINESE_DIGITS.get(token[0], 1) - 1
+
+
+def _parse_budget(text: str) -> Optional[float]:
+    for match in _BUDGET_RE.finditer(text):
+        value = float(match.group(1) or match.group(2))
+        if value >= 10:  # 排除"2个人""3公里"之类的小数字
+            return value
+    return None
+
+
+def _row_cost(table, row_id: int) -> Optional[float]:
+    cost = table.value(row_id, "dp_cost")
+    return cost if cost is not None else table.value(row_id, "cost")
+
+
+class QueryRewriter:
+    """多轮对话的本地查询改写，不额外调用 LLM。
+
+    按用户记录上一轮推荐的餐厅与生效的预算、品类；只有出现指代或"还有""那…呢"等延续提示时才视为追问，
+    解析"第二家""那家"等指代，把携带的上下文编码后与当前问题向量加权合并，
+    并生成预算、附近、排除已推荐等结构化过滤条件。
+    """
+
+    def __init__(self, max_users: int = REWRITER_MAX_USERS):
+        self._lock = threading.Lock()
+        self._states: "OrderedDict[str, ConversationState]" = OrderedDict()
+        self.max_users = max_users
+        self._cuisine_terms = None
+
+    def _state(self, user_id: Optional[str]) -> ConversationState:
+        """取用户的对话状态（调用方持有 self._lock）"""
+        key = user_id or DEFAULT_STATE_KEY
+        state = self._states.get(key)
+        if state is None:
+            state = self._states[key] = ConversationState()
+            while len(self._states) > self.max_users:
+                self._states.popitem(last=False)
+        else:
+            self._states.move_to_end(key)
+        return state
+
+    def reset(self, user_id: Optional[str] = None):
+        """清空某个用户的对话状态；不指定用户时清空全部"""
+        with self._lock:
+            if user_id is None:
+                self._states.clear()
+            else:
+                self._states.pop(user_id, None)
+
+    # ---------- 解析 ----------
+    def _cuisine_vocab(self, table) -> List[str]:
+        """品类词：常见菜系 + 餐厅表中 type 的末级分类及括号内别名，按长度降序"""
+        if self._cuisine_terms is None or self._cuisine_terms[0] is not table:
+            codes, vocab = table.categories["type"]
+            terms = set(CUISINE_TERMS)
+            for value in vocab:
+                last = value.split(";")[-1]
+                terms.update(t for t in [_TYPE_PAREN_RE.sub("", last)] + _TYPE_PAREN_RE.findall(last)
+                             if len(t) >= 2 and "餐厅" not in t and "相关" not in t)
+            self._cuisine_terms = (table, sorted(terms, key=len, reverse=True))
+        return self._cuisine_terms[1]
+
+    def resolve_reference(self, message: str, table, user_id: Optional[str] = None) -> Optional[int]:
+        """把"第二家""那家"等指代解析为餐厅表行号"""
+        with self._lock:
+            state = self._state(user_id)
+            recommended, focus = list(state.last_recommended), state.focus
+        ordinal = _parse_ordinal(message)
+        name = None
+        if ordinal is not None and recommended and -len(recommended) <= ordinal < len(recommended):
+            name = recommended[ordinal]
+        elif _THIS_RE.search(message):
+            name = focus or (recommended[0] if len(recommended) == 1 else None)
+        return table.ids_by_name.get(name) if name else None
+
+    def plan(self, message: str, table, user_id: Optional[str] = None) -> RetrievalPlan:
+        """结合该用户上一轮的状态生成本轮检索计划"""
+        anchor_id = table.find_in_text(message)
+        if anchor_id is None:
+            anchor_id = self.resolve_reference(message, table, user_id)
+        anchor = table.texts["name"][anchor_id] if anchor_id is not None else None
+
+        cuisine = next((t for t in self._cuisine_vocab(table) if t in message), None)
+        budget = _parse_budget(message)
+        followup = bool(anchor_id is not None or _FOLLOWUP_RE.search(message.strip())
+                        or _MORE_RE.search(message) or _CHEAPER_RE.search(message))
+        with self._lock:
+            state = self._state(user_id)
+            if followup:
+                cuisine = cuisine or state.cuisine
+                budget = budget or state.max_cost
+            recommended = list(state.last_recommended)
+
+        if _CHEAPER_RE.search(message):
+            reference = _row_cost(table, anchor_id) if anchor_id is not None else None
+            if reference is not None:
+                budget = min(budget, reference) if budget else reference
+            elif budget:
+                budget = budget * CHEAPER_RATIO
+        near = anchor_id is not None and bool(_NEAR_RE.search(message))
+        exclude = tuple(recommended) if _MORE_RE.search(message) else ()
+        if anchor is not None and (near or exclude):
+            exclude = tuple(dict.fromkeys(exclude + (anchor,)))
+
+        carry = []
+        if followup and cuisine and cuisine not in message:
+            carry.append(cuisine)
+        if anchor is not None and anchor not in message:
+            carry.append(anchor)
+            carry.append(table.value(anchor_id, "address"))
+        if followup and budget and not _BUDGET_RE.search(message):
+            carry.append(f"人均{budget:.0f}元以内")
+        return RetrievalPlan(" ".join(c for c in carry if c), cuisine, budget, anchor, near, exclude)
+
+    def observe(self, message: str, answer: str, plan: Optional[RetrievalPlan], table,
+                user_id: Optional[str] = None):
+        """一轮回答结束后更新该用户的对话状态"""
+        names = [n for n in extract_restaurant_names(answer, table.ids_by_name) if n in table.ids_by_name]
+        with self._lock:
+            state = self._state(user_id)
+            if names:
+                state.last_recommended = names
+            state.focus = names[0] if len(names) == 1 else (plan.anchor if plan else None)
+            if plan is not None:
+                state.cuisine = plan.cuisine
+                state.max_cost = plan.max_cost
+
+
+def combine_vectors(question_vector: np.ndarray, carry_vector: Optional[np.ndarray],
+                    weight: float = CARRY_WEIGHT) -> np.ndarray:
+    """当前问题向量与携带上下文向量加权求和后归一化（两者都来自嵌入缓存）"""
+    if carry_vector is None:
+        return question_vector
+    vector = question_vector + weight * carry_vector
+    return vector / (np.linalg.norm(vector) or 1.0)
+
+
+def apply_plan(docs: List[Any], plan: RetrievalPlan, table,
+               lookup: Callable[[int], Any], min_results: int = MIN_PLAN_RESULTS) -> List[Any]:
+    """在向量检索结果上执行结构化条件：补充并按距离排序附近餐厅、排除已推荐、按预算过滤"""
+    ranked = [(table.id_for_document(doc), doc) for doc in docs]
+    anchor_id = table.ids_by_name.get(plan.anchor) if plan.anchor else None
+
+    if plan.near and anchor_id is not None:
+        distance = table.distances_from(table.numeric["lng"][anchor_id], table.numeric["lat"][anchor_id])
+        seen = {row_id for row_id, _ in ranked}
+        nearby = [int(i) for i in np.argsort(distance) if distance[i] <= NEAR_RADIUS_M and int(i) not in seen]
+        for row_id in nearby[:NEAR_EXTRA_CANDIDATES]:
+            doc = lookup(row_id)
+            if doc is not None:
+                ranked.append((row_id, doc))
+        ranked.sort(key=lambda item: distance[item[0]] if item[0] is not None and not np.isnan(distance[item[0]])
+                    else float("inf"))
+
+    if plan.exclude:
+        excluded = {table.ids_by_name.get(name) for name in plan.exclude}
+        ranked = [item for item in ranked if item[0] not in excluded] or ranked
+
+    if plan.max_cost is not None:
+        allowed = set(table.filter_ids(max_cost=plan.max_cost).tolist())
+        kept = [item for item in ranked if item[0] in allowed]
+        if len(kept) < min_results:
+            kept += [item for item in ranked if item[0] not in allowed][:min_results - len(kept)]
+        ranked = kept
+    return [doc for _, doc in ranked]
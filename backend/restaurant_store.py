@@ -0,0 +1,324 @@
+import hashlib
+import re
+import sys
+import threading
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from backend.dataset import ensure_parquet, load_records, pa, read_parquet_table
+from backend.index_manager import LEGACY_VERSION, dataset_snapshot, resolve_index_dir
+
+# ========== 常量定义 ==========
+
+# 数值列：缺失值记为 NaN
+NUMERIC_FIELDS = (
+    "dp_cost", "dp_rating", "dp_taste_rating", "dp_env_rating",
+    "dp_service_rating", "dp_comment_num", "cost", "rating",
+)
+# 类别列：整型编码 + 驻留字符串词表
+CATEGORY_FIELDS = ("type", "tag")
+# 其余文本列按行保存
+TEXT_FIELDS = ("name", "address", "tel", "opentime_today", "opentime_week")
+# 已解析的列表列：推荐菜 [名称]、评论关键词 [(关键词, 次数)]、精选评论 [(日期, 内容)]
+LIST_FIELDS = ("dp_recommendation_dish", "dp_comment_keywords", "dp_top3_comments")
+EARTH_RADIUS_M = 6371000.0
+# 从数据集中读取的列
+LOAD_COLUMNS = NUMERIC_FIELDS + CATEGORY_FIELDS + TEXT_FIELDS + LIST_FIELDS + ("location",)
+
+
+_BRANCH_RE = re.compile(r"[(（][^()（）]*[)）]")
+
+
+def haversine(lng1, lat1, lng2, lat2):
+    """两点（或数组逐元素）间的球面距离（米），任一坐标为 NaN 时结果为 NaN"""
+    lng1, lat1, lng2, lat2 = np.radians(lng1), np.radians(lat1), np.radians(lng2), np.radians(lat2)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+
+
+def restaurant_key(name: str, place: str = "") -> str:
+    """餐厅的稳定 id：由店名与位置（坐标，缺失时为地址）哈希得到，
+    索引重建、行号变化后仍指向同一家餐厅，同名的连锁分店也各有不同的 key"""
+    return hashlib.sha1(f"{name}|{place}".encode("utf-8")).hexdigest()[:12]
+
+
+def _place(lng: float, lat: float, address: str) -> str:
+    """参与 key 计算的位置：坐标保留 6 位小数（与高德返回的精度一致），缺失时用地址"""
+    if np.isnan(lng) or np.isnan(lat):
+        return address or ""
+    return f"{lng:.6f},{lat:.6f}"
+
+
+def _to_float(value) -> float:
+    return np.nan if value is None else value
+
+
+def _parse_location(value: str) -> Tuple[float, float]:
+    try:
+        lng, lat = value.split(",")
+        return float(lng), float(lat)
+    except (AttributeError, ValueError):
+        return np.nan, np.nan
+
+
+class RestaurantRecord:
+    """某一行餐厅数据的只读视图，字段按需从表中的列读取，不复制数据"""
+    __slots__ = ("_table", "id")
+
+    def __init__(self, table: "RestaurantTable", row_id: int):
+        self._table = table
+        self.id = row_id
+
+    def __getattr__(self, field: str):
+        if field.startswith("_"):
+            raise AttributeError(field)
+        return self._table.value(self.id, field)
+
+    def __repr__(self) -> str:
+        return f"RestaurantRecord(id={self.id}, name={self.name!r})"
+
+    def to_dict(self) -> Dict:
+        return self._table.row_dict(self.id)
+
+
+class RestaurantTable:
+    """列式存储的餐厅表：数值列为 NumPy 数组，type/tag 为编码后的驻留字符串"""
+
+    _instance = None  # 单例模式实例（未绑定索引管理器时使用）
+    _provider: Optional[Callable[[], "RestaurantTable"]] = None
+    _lock = threading.Lock()
+
+    def __init__(self,
+                 numeric: Dict[str, np.ndarray],
+                 categories: Dict[str, Tuple[np.ndarray, List[str]]],
+                 texts: Dict[str, List[str]],
+                 lists: Dict[str, List[list]]):
+        self.numeric = numeric
+        self.categories = categories
+        self.texts = texts
+        self.lists = lists
+        # 同名餐厅（连锁分店、不同城市的同名店）按名称只能取到第一行，按 key 仍可分别取到
+        self.ids_by_name: Dict[str, int] = {}
+        self.duplicate_names = set()
+        for i, name in enumerate(texts["name"]):
+            if self.ids_by_name.setdefault(name, i) != i:
+                self.duplicate_names.add(name)
+        self.keys = [restaurant_key(name, _place(lng, lat, address)) for name, lng, lat, address
+                     in zip(texts["name"], numeric["lng"], numeric["lat"], texts["address"])]
+        self.ids_by_key: Dict[str, int] = {}
+        duplicate_keys = 0
+        for i, key in enumerate(self.keys):
+            if self.ids_by_key.setdefault(key, i) != i:
+                duplicate_keys += 1
+        if self.duplicate_names or duplicate_keys:
+            print(f"餐厅表中有 {len(self.duplicate_names)} 个重名店名（按名称只取第一家）、"
+                  f"{duplicate_keys} 行店名与位置都重复（按 key 只取第一行）")
+        # 数据所属的索引版本与数据文件修改时间，供 HTTP 缓存校验使用
+        self.version = LEGACY_VERSION
+        self.modified_at = 0.0
+        self._aliases: Optional[List[Tuple[str, int]]] = None  # 名称/简称 -> 行号，按长度降序
+
+    # ---------- 构建 ----------
+    @classmethod
+    def from_records(cls, records: List[Dict]) -> "RestaurantTable":
+        """由 backend.dataset 解析后的记录构建（数值为 float/None，列表列已解析）"""
+        numeric = {
+            field: np.array([_to_float(r.get(field)) for r in records], dtype=np.float32)
+            for field in NUMERIC_FIELDS
+        }
+        return cls._build(numeric, records)
+
+    @classmethod
+    def from_arrow(cls, table) -> "RestaurantTable":
+        """由 Parquet 读出的 Arrow 表构建：数值列直接转换为 NumPy（缺失值为 NaN），不经过逐行字典"""
+        numeric = {
+            field: table.column(field).to_numpy(zero_copy_only=False).astype(np.float32, copy=False)
+            for field in NUMERIC_FIELDS
+        }
+        rest = [f for f in table.column_names if f not in NUMERIC_FIELDS]
+        columns = {f: table.column(f).to_pylist() for f in rest}
+        for field in ("dp_comment_keywords", "dp_top3_comments"):
+            columns[field] = [[tuple(item.values()) for item in value or []] for value in columns[field]]
+        records = [dict(zip(rest, values)) for values in zip(*(columns[f] for f in rest))]
+        return cls._build(numeric, records)
+
+    @classmethod
+    def _build(cls, numeric: Dict[str, np.ndarray], records: List[Dict]) -> "RestaurantTable":
+        coords = np.array([_parse_location(r.get("location", "")) for r in records],
+                          dtype=np.float64).reshape(-1, 2)
+        numeric["lng"] = np.ascontiguousarray(coords[:, 0])
+        numeric["lat"] = np.ascontiguousarray(coords[:, 1])
+
+        categories = {}
+        for field in CATEGORY_FIELDS:
+            vocab: List[str] = []
+            index: Dict[str, int] = {}
+            codes = np.empty(len(records), dtype=np.int32)
+            for i, r in enumerate(records):
+                value = sys.intern(r.get(field, "") or "")
+                if value not in index:
+                    index[value] = len(vocab)
+                    vocab.append(value)
+                codes[i] = index[value]
+            categories[field] = (codes, vocab)
+
+        texts = {field: [r.get(field, "") or "" for r in records] for field in TEXT_FIELDS}
+        lists = {field: [r.get(field) or [] for r in records] for field in LIST_FIELDS}
+        return cls(numeric, categories, texts, lists)
+
+    @classmethod
+    def load(cls, path: Optional[Path] = None, version: Optional[str] = None) -> "RestaurantTable":
+        """从数据集（Parquet 优先，只读取所需列）构建餐厅表。
+
+        未指定 path 时使用当前索引版本的数据快照，与 faiss_index_cosine 中的文档一一对应。
+        只构建不发布：共享实例由 get_instance 提供（索引热切换时随索引一起发布，见 bind）。
+        """
+        if path is None:
+            current_version, index_dir = resolve_index_dir()
+            path = dataset_snapshot(index_dir)
+            version = version or (current_version if path is not None else None)
+        path = Path(path) if path else ensure_parquet()
+        if path is not None and path.suffix == ".parquet" and pa is not None:
+            table = cls.from_arrow(read_parquet_table(path, LOAD_COLUMNS))
+        else:
+            table = cls.from_records(load_records(path, columns=LOAD_COLUMNS))
+        table.version = version or LEGACY_VERSION
+        source = path if path is not None and path.exists() else None
+        table.modified_at = source.stat().st_mtime if source else 0.0
+        usage = table.memory_usage()
+        print(f"餐厅表已加载: {len(table)} 家, version={table.version}, 约 {usage['per_restaurant_bytes']:.0f} 字节/家")
+        return table
+
+    @classmethod
+    def bind(cls, provider: Callable[[], "RestaurantTable"]):
+        """让 get_instance 返回 provider() 的结果（如 IndexManager 当前发布的餐厅表），
+        共享实例因此只在索引切换提交时随索引一起变化"""
+        cls._provider = provider
+
+    @classmethod
+    def get_instance(cls) -> "RestaurantTable":
+        """获取进程内共享的餐厅表；未绑定索引管理器时首次调用加载当前索引版本的数据"""
+        if cls._provider is not None:
+            return cls._provider()
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    cls._instance = cls.load()
+        return cls._instance
+
+    # ---------- 访问 ----------
+    def __len__(self) -> int:
+        return len(self.texts["name"])
+
+    def __getitem__(self, row_id: int) -> RestaurantRecord:
+        if not 0 <= row_id < len(self):
+            raise IndexError(row_id)
+        return RestaurantRecord(self, row_id)
+
+    def value(self, row_id: int, field: str):
+        if field in self.numeric:
+            value = self.numeric[field][row_id]
+            # float32 列转为 Python float 时去掉 3.9000000953674316 这类尾差
+            return None if np.isnan(value) else round(float(value), 6)
+        if field in self.categories:
+            codes, vocab = self.categories[field]
+            return vocab[codes[row_id]]
+        if field in self.texts:
+            return self.texts[field][row_id]
+        if field in self.lists:
+            return self.lists[field][row_id]
+        raise AttributeError(field)
+
+    def row_dict(self, row_id: int) -> Dict:
+        fields = list(self.texts) + list(self.categories) + list(self.numeric)
+        row = {"id": row_id, "key": self.keys[row_id],
+               **{field: self.value(row_id, field) for field in fields}}
+        row["dp_recommendation_dish"] = list(self.lists["dp_recommendation_dish"][row_id])
+        row["dp_comment_keywords"] = [{"keyword": k, "count": n}
+                                      for k, n in self.lists["dp_comment_keywords"][row_id]]
+        row["dp_top3_comments"] = [{"date": d, "text": t}
+                                   for d, t in self.lists["dp_top3_comments"][row_id]]
+        return row
+
+    def lookup(self, name: str) -> Optional[RestaurantRecord]:
+        row_id = self.ids_by_name.get(name)
+        return None if row_id is None else RestaurantRecord(self, row_id)
+
+    def brand_of(self, row_id: int) -> str:
+        """去掉分店名后的品牌名：'巴蜀鱼花(南大店)' -> '巴蜀鱼花'"""
+        name = self.texts["name"][row_id]
+        return _BRANCH_RE.sub("", name).strip() or name
+
+    def find_in_text(self, text: str) -> Optional[int]:
+        """在一句话中找出提到的餐厅（取最长匹配）；不带分店名的简称只在唯一时生效"""
+        if self._aliases is None:
+            aliases: Dict[str, List[int]] = {}
+            for name, row_id in self.ids_by_name.items():
+                aliases.setdefault(name, []).append(row_id)
+                base = _BRANCH_RE.sub("", name).strip()
+                if len(base) >= 2 and base != name:
+                    aliases.setdefault(base, []).append(row_id)
+            self._aliases = sorted(((a, ids[0]) for a, ids in aliases.items() if len(set(ids)) == 1),
+                                   key=lambda item: len(item[0]), reverse=True)
+        for alias, row_id in self._aliases:
+            if alias in text:
+                return row_id
+        return None
+
+    def id_for_document(self, doc) -> Optional[int]:
+        """根据向量库文档（page_content 首行为 name=...）找到对应行号"""
+        first_line = doc.page_content.split("\n", 1)[0]
+        if not first_line.startswith("name="):
+            return None
+        name = first_line[len("name="):].strip()
+        if name in self.duplicate_names:
+            # 重名餐厅按文档中的坐标（或地址）定位到具体的那一行
+            lng, lat = _parse_location((doc.metadata or {}).get("location", ""))
+            row_id = self.ids_by_key.get(restaurant_key(name, _place(lng, lat, (doc.metadata or {}).get("address", ""))))
+            if row_id is not None:
+                return row_id
+        return self.ids_by_name.get(name)
+
+    # ---------- 过滤 ----------
+    def filter_ids(self,
+                   max_cost: Optional[float] = None,
+                   min_rating: Optional[float] = None,
+                   type_contains: Optional[str] = None) -> np.ndarray:
+        """按人均与评分等条件向量化筛选，返回满足条件的行号；缺失值视为不满足"""
+        mask = np.ones(len(self), dtype=bool)
+        if max_cost is not None:
+            cost = np.where(np.isnan(self.numeric["dp_cost"]), self.numeric["cost"], self.numeric["dp_cost"])
+            mask &= cost <= max_cost
+        if min_rating is not None:
+            rating = np.where(np.isnan(self.numeric["dp_rating"]), self.numeric["rating"], self.numeric["dp_rating"])
+            mask &= rating >= min_rating
+        if type_contains:
+            codes, vocab = self.categories["type"]
+            matched = np.array([type_contains in v for v in vocab], dtype=bool)
+            mask &= matched[codes]
+        return np.flatnonzero(mask)
+
+    def distances_from(self, lng: float, lat: float) -> np.ndarray:
+        """所有餐厅到给定坐标的球面距离（米），坐标缺失的为 NaN"""
+        return haversine(lng, lat, self.numeric["lng"], self.numeric["lat"])
+
+    def memory_usage(self) -> Dict:
+        """估算表占用的内存（数值列 + 编码列 + 字符串）"""
+        numeric_bytes = sum(col.nbytes for col in self.numeric.values())
+        category_bytes = sum(codes.nbytes + sum(sys.getsizeof(v) for v in vocab)
+                             for codes, vocab in self.categories.values())
+        text_bytes = sum(sys.getsizeof(col) + sum(sys.getsizeof(v) for v in col)
+                         for col in self.texts.values())
+        text_bytes += sum(sys.getsizeof(col) + sum(sys.getsizeof(v) + sum(sys.getsizeof(x) for x in v) for v in col)
+                          for col in self.lists.values())
+        total = numeric_bytes + category_bytes + text_bytes
+        return {
+            "restaurants": len(self),
+            "numeric_bytes": numeric_bytes,
+            "category_bytes": category_bytes,
+            "text_bytes": text_bytes,
+            "total_bytes": total,
+            "per_restaurant_bytes": total / max(1, len(self)),
+        }
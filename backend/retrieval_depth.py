@@ -0,0 +1,98 @@
+import re
+import threading
+from collections import Counter, deque
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from backend.memory import estimate_tokens
+from backend.metrics import percentile
+
+# ========== 常量定义 ==========
+SCOPE_SPECIFIC = "specific"  # 问的是某一家餐厅
+SCOPE_DEFAULT = "default"
+SCOPE_BROAD = "broad"        # "推荐几家""还有别的吗"等开放式问题
+# 各类问题的检索文档数上下限 (min_k, max_k)
+SCOPE_BOUNDS = {
+    SCOPE_SPECIFIC: (3, 5),
+    SCOPE_DEFAULT: (5, 20),
+    SCOPE_BROAD: (10, 20),
+}
+# 相邻候选的相似度落差超过候选相似度跨度的该比例时在落差处截断
+SCORE_GAP_RATIO = 0.25
+# 只保留相似度不低于 top - ratio * 跨度 的候选
+SCORE_CUTOFF_RATIO = 0.6
+# 保留最近 N 次检索的文档数与上下文 token 数用于计算分位数
+DEPTH_WINDOW = 500
+
+_BROAD_RE = re.compile(r"几家|几个|多推荐|多来|有哪些|有什么|都有|列举|更多|还有|别的|其他|其它|随便|推荐一些|推荐点")
+
+
+def query_scope(question: str, plan=None) -> str:
+    """按问题与改写计划判断检索范围：点名某家餐厅、开放式推荐或默认"""
+    if plan is not None and (plan.near or plan.exclude):
+        return SCOPE_BROAD
+    if _BROAD_RE.search(question):
+        return SCOPE_BROAD
+    if plan is not None and plan.anchor:
+        return SCOPE_SPECIFIC
+    return SCOPE_DEFAULT
+
+
+def adaptive_k(similarities: Sequence[float], scope: str = SCOPE_DEFAULT,
+               bounds: Dict[str, Tuple[int, int]] = SCOPE_BOUNDS) -> int:
+    """由向量检索候选的相似度分布（降序）决定放入上下文的文档数。
+
+    先按相对阈值截掉明显不相关的尾部，再在最大落差处截断（落差足够大时），
+    结果限制在该类问题的上下限内。
+    """
+    min_k, max_k = bounds[scope]
+    scores = np.asarray(similarities, dtype=np.float32)
+    if len(scores) <= min_k:
+        return len(scores)
+    spread = float(scores[0] - scores[-1])
+    if spread <= 0:
+        return max_k
+    k = int(np.sum(scores >= scores[0] - SCORE_CUTOFF_RATIO * spread))
+    gaps = scores[:-1] - scores[1:]
+    lo, hi = min_k - 1, min(k, max_k) - 1  # 截断位置 i 表示保留前 i + 1 个
+    if hi > lo:
+        cut = lo + int(np.argmax(gaps[lo:hi]))
+        if gaps[cut] >= SCORE_GAP_RATIO * spread:
+            k = cut + 1
+    return max(min_k, min(k, max_k))
+
+
+class RetrievalDepthStats:
+    """每次检索放入上下文的文档数与估算 token 数，供 /chat/metrics 展示"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._docs = deque(maxlen=DEPTH_WINDOW)
+        self._tokens = deque(maxlen=DEPTH_WINDOW)
+        self.scopes = Counter()
+        self.requests = 0
+
+    def record(self, scope: str, docs: List) -> int:
+        """记录一次检索，返回上下文的估算 token 数"""
+        tokens = estimate_tokens("\n".join(getattr(doc, "page_content", "") for doc in docs))
+        with self._lock:
+            self.requests += 1
+            self.scopes[scope] += 1
+            self._docs.append(len(docs))
+            self._tokens.append(tokens)
+        return tokens
+
+    def metrics(self) -> Dict:
+        with self._lock:
+            docs, tokens = list(self._docs), list(self._tokens)
+            return {
+                "requests": self.requests,
+                "scopes": dict(self.scopes),
+                "docs_avg": sum(docs) / len(docs) if docs else 0.0,
+                "docs_p50": percentile(docs, 0.5),
+                "docs_p95": percentile(docs, 0.95),
+                "context_tokens_avg": sum(tokens) / len(tokens) if tokens else 0.0,
+                "context_tokens_p50": percentile(tokens, 0.5),
+                "context_tokens_p95": percentile(tokens, 0.95),
+            }
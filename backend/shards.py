@@ -0,0 +1,325 @@
+import heapq
+import json
+import math
+import threading
+import time
+from collections import ChainMap, Counter, OrderedDict
+from itertools import chain
+from operator import itemgetter
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+import faiss
+import numpy as np
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+
+from backend.diversity import reconstruct_vectors
+from backend.index_manager import FAISS_INDEX_NAME
+from backend.restaurant_store import haversine
+
+# ========== 常量定义 ==========
+# 目录布局：<索引版本目录>/shards/shards.json 为分片清单，<索引版本目录>/shards/<分片>/ 下为各分片的 index.faiss、index.pkl
+SHARDS_DIR = "shards"
+SHARD_MANIFEST = "shards.json"
+# 数据中没有城市/行政区字段，按经纬度网格分片；0.5° 约 50 km，大致覆盖一个城市的主城区
+SHARD_CELL_DEG_DEFAULT = 0.5
+UNKNOWN_SHARD = "unknown"  # 坐标缺失的餐厅，无法按位置路由，每次检索都包含
+# 同时常驻内存的分片数上限（LRU），以及空闲多久（秒）后卸载
+SHARD_CACHE_SIZE_DEFAULT = 4
+SHARD_IDLE_SECONDS_DEFAULT = 900.0
+# 路由：除最近的分片外，还检索餐厅范围距用户不超过该距离（米）的相邻分片（网格线可能穿过城市），合计最多 SHARD_ROUTE_MAX 个
+SHARD_ROUTE_RADIUS_M = 20000.0
+SHARD_ROUTE_MAX = 4
+# 请求未带位置时使用的坐标（与数据采集脚本的默认中心点一致）
+DEFAULT_LOCATION = "118.779711,32.054377"
+
+
+def parse_location(value) -> Optional[Tuple[float, float]]:
+    """解析 "经度,纬度"，无效时返回 None"""
+    try:
+        lng, lat = (float(v) for v in str(value).split(","))
+    except (TypeError, ValueError):
+        return None
+    if math.isnan(lng) or math.isnan(lat):
+        return None
+    return lng, lat
+
+
+def shard_key(location, cell_deg: float = SHARD_CELL_DEG_DEFAULT) -> str:
+    """餐厅所属的网格分片"""
+    point = parse_location(location)
+    if point is None:
+        return UNKNOWN_SHARD
+    lng, lat = point
+    return f"{math.floor(lng / cell_deg)}_{math.floor(lat / cell_deg)}"
+
+
+class ShardInfo:
+    """清单中的一个分片：餐厅数与坐标外包框 (min_lng, min_lat, max_lng, max_lat)"""
+    __slots__ = ("shard_id", "count", "bbox")
+
+    def __init__(self, shard_id: str, count: int, bbox: Optional[Sequence[float]]):
+        self.shard_id = shard_id
+        self.count = count
+        self.bbox = tuple(bbox) if bbox else None
+
+    def distance_to(self, lng: float, lat: float) -> float:
+        """点到外包框的球面距离（米），点在框内时为 0；没有坐标的分片为无穷远"""
+        if self.bbox is None:
+            return math.inf
+        min_lng, min_lat, max_lng, max_lat = self.bbox
+        return float(haversine(lng, lat, min(max(lng, min_lng), max_lng), min(max(lat, min_lat), max_lat)))
+
+    def to_dict(self) -> Dict:
+        return {"id": self.shard_id, "count": self.count, "bbox": list(self.bbox) if self.bbox else None}
+
+
+def write_shards(store: FAISS, folder: Path, cell_deg: float = SHARD_CELL_DEG_DEFAULT) -> List[ShardInfo]:
+    """把完整向量库按网格拆分为多个 FAISS 向量库（直接复用已存储的向量，不重新编码），并写入分片清单"""
+    groups: Dict[str, List[int]] = {}
+    points: Dict[str, List[Tuple[float, float]]] = {}
+    for position, doc_id in sorted(store.index_to_docstore_id.items()):
+        doc = store.docstore.search(doc_id)
+        if isinstance(doc, str):  # 文档缺失时 docstore 返回错误信息
+            continue
+        location = doc.metadata.get("location")
+        key = shard_key(location, cell_deg)
+        groups.setdefault(key, []).append(position)
+        point = parse_location(location)
+        if point is not None:
+            points.setdefault(key, []).append(point)
+
+    shards_dir = Path(folder) / SHARDS_DIR
+    shards = []
+    for key, positions in sorted(groups.items()):
+        vectors = np.stack([store.index.reconstruct(int(p)) for p in positions]).astype(np.float32)
+        index = faiss.IndexFlat(vectors.shape[1], store.index.metric_type)
+        index.add(vectors)
+        index_to_docstore_id = {i: store.index_to_docstore_id[p] for i, p in enumerate(positions)}
+        docstore = InMemoryDocstore({doc_id: store.docstore.search(doc_id)
+                                     for doc_id in index_to_docstore_id.values()})
+        shard = FAISS(store.embedding_function, index, docstore, index_to_docstore_id)
+        shard.save_local(folder_path=str(shards_dir / key), index_name=FAISS_INDEX_NAME)
+        coords = np.array(points.get(key, []), dtype=np.float64).reshape(-1, 2)
+        bbox = [float(v) for v in (*coords.min(axis=0), *coords.max(axis=0))] if len(coords) else None
+        shards.append(ShardInfo(key, len(positions), bbox))
+
+    manifest = {"cell_deg": cell_deg, "shards": [info.to_dict() for info in shards]}
+    (shards_dir / SHARD_MANIFEST).write_text(json.dumps(manifest, ensure_ascii=False, indent=2), encoding="utf-8")
+    return shards
+
+
+def read_manifest(index_dir: Path) -> Optional[Dict]:
+    """索引版本目录中的分片清单（未分片构建时不存在）"""
+    path = Path(index_dir) / SHARDS_DIR / SHARD_MANIFEST
+    if not path.exists():
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+class ShardView:
+    """单个 FAISS 向量库上的检索视图：矩阵检索、餐厅行号 -> 文档、文档 -> 存储向量。
+
+    table 与 facets 为与该向量库同一索引版本的餐厅表和分面，重排时只使用视图上的这两项。
+    """
+
+    def __init__(self, store: FAISS, table, key: Tuple[str, ...] = ("*",), facets=None):
+        self.store = store
+        self.table = table
+        self.facets = facets
+        self.key = key
+        self.docs_by_row: Dict[int, Any] = {}
+        self._positions: Dict[int, int] = {}  # id(文档) -> FAISS 向量位置
+        for position, doc_id in store.index_to_docstore_id.items():
+            doc = store.docstore.search(doc_id)
+            if isinstance(doc, str):
+                continue
+            self._positions[id(doc)] = position
+            row_id = table.id_for_document(doc)
+            if row_id is not None:
+                self.docs_by_row.setdefault(row_id, doc)
+        # L2/余弦索引距离越小越相似，内积索引越大越相似；统一为越大越相似的得分便于跨分片归并
+        self._sign = 1.0 if store.index.metric_type == faiss.METRIC_INNER_PRODUCT else -1.0
+
+    def scored_search(self, vectors: np.ndarray, k: int) -> List[List[Tuple[float, Any]]]:
+        distances, positions = self.store.index.search(np.ascontiguousarray(vectors, dtype=np.float32), k)
+        results = []
+        for row_distances, row_positions in zip(distances, positions):
+            hits = []
+            for distance, position in zip(row_distances, row_positions):
+                if position < 0:  # 候选不足 k 个时 FAISS 以 -1 补齐
+                    continue
+                doc = self.store.docstore.search(self.store.index_to_docstore_id[int(position)])
+                if not isinstance(doc, str):
+                    hits.append((self._sign * float(distance), doc))
+            results.append(hits)
+        return results
+
+    def search(self, vectors: np.ndarray, k: int) -> List[List[Any]]:
+        """对一批查询向量做一次矩阵检索，返回每个查询按相似度排序的候选文档"""
+        return [[doc for _, doc in hits] for hits in self.scored_search(vectors, k)]
+
+    def owns(self, doc) -> bool:
+        return id(doc) in self._positions
+
+    def vectors(self, docs: List[Any]) -> Optional[np.ndarray]:
+        """文档在索引中存储的向量（归一化）；有文档不属于本视图时返回 None"""
+        positions = [self._positions.get(id(doc)) for doc in docs]
+        if not positions or any(p is None for p in positions):
+            return None
+        return reconstruct_vectors(self.store.index, positions)
+
+
+class MultiShardView:
+    """多个分片视图的合并：各分片分别检索，按得分归并出前 k 个"""
+
+    def __init__(self, views: List[ShardView]):
+        self.views = views
+        self.table = views[0].table
+        self.facets = views[0].facets
+        self.key = tuple(k for view in views for k in view.key)
+        self.docs_by_row = ChainMap(*[view.docs_by_row for view in views])
+
+    def scored_search(self, vectors: np.ndarray, k: int) -> List[List[Tuple[float, Any]]]:
+        per_view = [view.scored_search(vectors, k) for view in self.views]
+        return [heapq.nlargest(k, chain(*hits), key=itemgetter(0)) for hits in zip(*per_view)]
+
+    def search(self, vectors: np.ndarray, k: int) -> List[List[Any]]:
+        return [[doc for _, doc in hits] for hits in self.scored_search(vectors, k)]
+
+    def vectors(self, docs: List[Any]) -> Optional[np.ndarray]:
+        rows = []
+        for doc in docs:
+            view = next((v for v in self.views if v.owns(doc)), None)
+            if view is None:
+                return None
+            rows.append(view.vectors([doc])[0])
+        return np.stack(rows) if rows else None
+
+
+class _LoadedShard:
+    __slots__ = ("store", "view", "last_used")
+
+    def __init__(self, store: FAISS):
+        self.store = store
+        self.view: Optional[ShardView] = None
+        self.last_used = time.monotonic()
+
+
+class ShardSet:
+    """某个索引版本的全部分片：按用户位置路由，分片首次被路由到时才加载，按 LRU 与空闲时间卸载。
+
+    卸载只是丢弃引用：进行中的请求持有的视图不受影响，mmap 的索引文件在最后一个引用释放后解除映射。
+    """
+
+    def __init__(self, shards_dir: Path, manifest: Dict, loader: Callable[[Path], FAISS],
+                 max_loaded: int = SHARD_CACHE_SIZE_DEFAULT,
+                 idle_seconds: float = SHARD_IDLE_SECONDS_DEFAULT,
+                 route_radius: float = SHARD_ROUTE_RADIUS_M):
+        self.dir = Path(shards_dir)
+        self.cell_deg = manifest.get("cell_deg", SHARD_CELL_DEG_DEFAULT)
+        self.shards = {s["id"]: ShardInfo(s["id"], s["count"], s.get("bbox")) for s in manifest["shards"]}
+        # 可按位置路由的网格分片（不含坐标缺失的 unknown 分片）
+        self.geographic = [shard_id for shard_id in self.shards if shard_id != UNKNOWN_SHARD]
+        self.loader = loader  # 分片目录 -> FAISS 向量库
+        self.max_loaded = max(1, max_loaded)
+        self.idle_seconds = idle_seconds
+        self.route_radius = route_radius
+        self._loaded: "OrderedDict[str, _LoadedShard]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self.routes = 0
+        self.routed = Counter()
+        self.hits = 0
+        self.loads = 0
+        self.load_seconds = 0.0
+        self.evictions = Counter()
+
+    @classmethod
+    def open(cls, index_dir: Path, loader: Callable[[Path], FAISS], **options) -> Optional["ShardSet"]:
+        """读取索引版本目录中的分片清单，没有分片时返回 None"""
+        manifest = read_manifest(index_dir)
+        if not manifest or not manifest.get("shards"):
+            return None
+        return cls(Path(index_dir) / SHARDS_DIR, manifest, loader, **options)
+
+    def route(self, lng: float, lat: float) -> List[str]:
+        """用户位置所在（或最近）的分片，加上边界在 route_radius 以内的相邻分片；unknown 分片总是包含在内"""
+        ranked = sorted((self.shards[shard_id].distance_to(lng, lat), shard_id) for shard_id in self.geographic)
+        nearby = [shard_id for distance, shard_id in ranked[:SHARD_ROUTE_MAX] if distance <= self.route_radius]
+        if ranked and not nearby:
+            nearby = [ranked[0][1]]
+        if UNKNOWN_SHARD in self.shards:
+            nearby.append(UNKNOWN_SHARD)
+        return nearby
+
+    def view(self, location, table, facets=None) -> Union[ShardView, MultiShardView]:
+        """按位置路由并返回检索视图；位置无效时使用 DEFAULT_LOCATION"""
+        lng, lat = parse_location(location) or parse_location(DEFAULT_LOCATION)
+        shard_ids = self.route(lng, lat)
+        views = [self._acquire(shard_id, table, facets) for shard_id in shard_ids]
+        with self._lock:
+            self.routes += 1
+            self.routed.update(shard_ids)
+        self.evict(keep=shard_ids)
+        return views[0] if len(views) == 1 else MultiShardView(views)
+
+    def _acquire(self, shard_id: str, table, facets=None) -> ShardView:
+        with self._lock:
+            entry = self._loaded.get(shard_id)
+            if entry is not None:
+                self._loaded.move_to_end(shard_id)
+                self.hits += 1
+        if entry is None:
+            with self._load_lock:
+                with self._lock:
+                    entry = self._loaded.get(shard_id)
+                if entry is None:
+                    start = time.perf_counter()
+                    entry = _LoadedShard(self.loader(self.dir / shard_id))
+                    elapsed = time.perf_counter() - start
+                    with self._lock:
+                        self._loaded[shard_id] = entry
+                        self.loads += 1
+                        self.load_seconds += elapsed
+                    print(f"分片 {shard_id} 已加载: {self.shards[shard_id].count} 家, 耗时 {elapsed * 1000:.1f} ms")
+        entry.last_used = time.monotonic()
+        view = entry.view
+        if view is None or view.table is not table or view.facets is not facets:
+            # 行号映射依赖餐厅表，餐厅表切换后重建视图
+            view = entry.view = ShardView(entry.store, table, (shard_id,), facets)
+        return view
+
+    def evict(self, keep: Sequence[str] = ()):
+        """卸载超出 max_loaded 的最久未用分片以及空闲超过 idle_seconds 的分片"""
+        now = time.monotonic()
+        with self._lock:
+            for shard_id in list(self._loaded):  # 从最久未用的开始
+                if shard_id in keep:
+                    continue
+                if len(self._loaded) > self.max_loaded:
+                    reason = "lru"
+                elif now - self._loaded[shard_id].last_used > self.idle_seconds:
+                    reason = "idle"
+                else:
+                    continue
+                del self._loaded[shard_id]
+                self.evictions[reason] += 1
+                print(f"分片 {shard_id} 已卸载 ({reason})")
+
+    def metrics(self) -> Dict:
+        with self._lock:
+            return {
+                "shards": len(self.shards),
+                "loaded": list(self._loaded),
+                "max_loaded": self.max_loaded,
+                "routes": self.routes,
+                "shards_per_route_avg": sum(self.routed.values()) / self.routes if self.routes else 0.0,
+                "routed": dict(self.routed.most_common(10)),
+                "hits": self.hits,
+                "loads": self.loads,
+                "load_ms_avg": self.load_seconds / self.loads * 1000 if self.loads else 0.0,
+                "evictions": dict(self.evictions),
+            }
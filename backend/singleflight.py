@@ -0,0 +1,101 @@
+import hashlib
+import json
+import re
+import threading
+from typing import Callable, Dict, Iterable, Iterator, Tuple
+
+_PUNCT_RE = re.compile(r"[\s，。！？、,.!?~～]+")
+
+
+def normalize_question(question: str) -> str:
+    """归一化问题文本：去掉空白与标点、统一大小写，用于判断是否为相同请求"""
+    return _PUNCT_RE.sub("", question).lower()
+
+
+def fingerprint(data) -> str:
+    """对任意可 JSON 序列化的数据生成短指纹"""
+    payload = json.dumps(data, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:16]
+
+
+class _Flight:
+    """一次进行中的计算：生产者线程写入分片，所有订阅者从头回放同一序列"""
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.subscribers = 0
+        self.cond = threading.Condition()
+
+    def publish(self, chunk: str):
+        with self.cond:
+            self.chunks.append(chunk)
+            self.cond.notify_all()
+
+    def finish(self, error: BaseException = None):
+        with self.cond:
+            self.done = True
+            self.error = error
+            self.cond.notify_all()
+
+    def subscribe(self) -> Iterator[str]:
+        index = 0
+        while True:
+            with self.cond:
+                while index >= len(self.chunks) and not self.done:
+                    self.cond.wait()
+                pending = self.chunks[index:]
+                index = len(self.chunks)
+                done, error = self.done, self.error
+            yield from pending
+            if done and index >= len(self.chunks):
+                if error is not None:
+                    raise error
+                return
+
+
+class SingleFlight:
+    """相同 key 的并发请求只执行一次，流式结果广播给所有订阅者"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights: Dict[str, _Flight] = {}
+        self._started = 0
+        self._coalesced = 0
+
+    def stream(self, key: str, producer: Callable[[], Iterable[str]]) -> Tuple[Iterator[str], bool]:
+        """返回 (分片迭代器, 是否为发起者)；已有相同 key 在执行时直接订阅其输出"""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight.subscribers += 1
+                self._coalesced += 1
+                return flight.subscribe(), False
+            flight = _Flight()
+            flight.subscribers = 1
+            self._flights[key] = flight
+            self._started += 1
+
+        def run():
+            error = None
+            try:
+                for chunk in producer():
+                    flight.publish(chunk)
+            except BaseException as e:
+                error = e
+            finally:
+                with self._lock:
+                    self._flights.pop(key, None)
+                flight.finish(error)
+
+        threading.Thread(target=run, name=f"singleflight-{key[:8]}", daemon=True).start()
+        return flight.subscribe(), True
+
+    def metrics(self) -> Dict:
+        with self._lock:
+            return {
+                "in_flight": len(self._flights),
+                "started": self._started,
+                "coalesced": self._coalesced,
+            }
@@ -0,0 +1,125 @@
+import re
+import time
+import unicodedata
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Dict, List, Optional, Set
+
+try:
+    from pypinyin import Style, lazy_pinyin
+except ImportError:  # pypinyin 为可选依赖，缺失时只支持汉字前缀补全
+    lazy_pinyin = None
+    Style = None
+
+# ========== 常量定义 ==========
+# 补全类型及排序优先级（数值越小越靠前）
+KIND_PRIORITY = {"name": 0, "dish": 1, "type": 2, "tag": 3}
+SUGGEST_LIMIT_DEFAULT = 10
+SUGGEST_LIMIT_MAX = 50
+# 类型字段中过于宽泛、不作为补全项的层级
+GENERIC_TYPES = {"餐饮服务", "中餐厅", "外国餐厅", "餐饮相关场所", "餐饮相关", "快餐厅", "休闲餐饮场所"}
+IGNORED_TERMS = {"停业", "小菜"}
+
+_SPLIT_RE = re.compile(r"[,，;；/]")
+_BRANCH_RE = re.compile(r"[(（][^()（）]*[)）]")
+
+
+def normalize_key(text: str) -> str:
+    return unicodedata.normalize("NFKC", text or "").lower().replace(" ", "")
+
+
+def pinyin_keys(text: str) -> List[str]:
+    """全拼与首字母，如 "酸菜鱼" -> ["suancaiyu", "scy"]；未安装 pypinyin 时为空"""
+    if lazy_pinyin is None:
+        return []
+    syllables = [s for s in lazy_pinyin(text, errors="ignore") if s]
+    if not syllables:
+        return []
+    initials = lazy_pinyin(text, style=Style.FIRST_LETTER, errors="ignore")
+    return ["".join(syllables).lower(), "".join(initials).lower()]
+
+
+class SuggestIndex:
+    """餐厅名称、推荐菜、类型、标签的前缀补全索引。
+
+    所有检索键（原文、全拼、首字母）排序后存放在一个数组中，前缀查询用二分定位区间，
+    不依赖嵌入模型。
+    """
+
+    def __init__(self, terms: Dict[tuple, Set[int]]):
+        # terms: (kind, 显示文本) -> 餐厅行号集合
+        self.entries = [(kind, text, sorted(ids)) for (kind, text), ids in terms.items()]
+        pairs = []
+        for i, (kind, text, _) in enumerate(self.entries):
+            keys = {normalize_key(text)}
+            if kind == "name":
+                keys.add(normalize_key(_BRANCH_RE.sub("", text)))  # 不带分店名也能补全
+            keys.update(pinyin_keys(text))
+            pairs.extend((key, i) for key in keys if key)
+        pairs.sort()
+        self.keys = [key for key, _ in pairs]
+        self.entry_ids = [i for _, i in pairs]
+
+    @classmethod
+    def from_table(cls, table) -> "SuggestIndex":
+        terms: Dict[tuple, Set[int]] = defaultdict(set)
+        type_codes, type_vocab = table.categories["type"]
+        tag_codes, tag_vocab = table.categories["tag"]
+        for row_id, name in enumerate(table.texts["name"]):
+            if name:
+                terms[("name", name)].add(row_id)
+            for dish in table.lists["dp_recommendation_dish"][row_id]:
+                terms[("dish", dish)].add(row_id)
+            for value in _SPLIT_RE.split(type_vocab[type_codes[row_id]]):
+                if value and value not in GENERIC_TYPES:
+                    terms[("type", value)].add(row_id)
+            for value in _SPLIT_RE.split(tag_vocab[tag_codes[row_id]]):
+                terms[("tag", value.strip())].add(row_id)
+        for key in [k for k in terms if not k[1] or k[1] in IGNORED_TERMS]:
+            del terms[key]
+        return cls(terms)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def suggest(self, prefix: str, limit: int = SUGGEST_LIMIT_DEFAULT,
+                kinds: Optional[Set[str]] = None) -> List[Dict]:
+        """返回以 prefix 开头的补全项：餐厅名称优先，其余按关联餐厅数、类型优先级、文本长度排序"""
+        key = normalize_key(prefix)
+        if not key:
+            return []
+        start = bisect_left(self.keys, key)
+        matched = set()
+        for pos in range(start, len(self.keys)):
+            if not self.keys[pos].startswith(key):
+                break
+            matched.add(self.entry_ids[pos])
+        entries = [self.entries[i] for i in matched
+                   if kinds is None or self.entries[i][0] in kinds]
+        entries.sort(key=lambda e: (e[0] != "name", -len(e[2]), KIND_PRIORITY[e[0]], len(e[1]), e[1]))
+        results, seen = [], set()
+        for kind, text, ids in entries:
+            if text in seen:  # 同一文本既是推荐菜又是标签时只返回一次
+                continue
+            seen.add(text)
+            results.append({"text": text, "kind": kind, "restaurant_ids": ids[:SUGGEST_LIMIT_DEFAULT],
+                            "count": len(ids)})
+            if len(results) >= limit:
+                break
+        return results
+
+
+_index_state = (None, None)  # (构建所用的餐厅表, SuggestIndex)
+
+
+def get_suggest_index(table) -> SuggestIndex:
+    """按餐厅表缓存补全索引；索引热切换后餐厅表被替换，下次请求时重建"""
+    global _index_state
+    built_from, index = _index_state
+    if built_from is not table:
+        start = time.perf_counter()
+        index = SuggestIndex.from_table(table)
+        _index_state = (table, index)
+        print(f"补全索引已构建: {len(index)} 项, {len(index.keys)} 个检索键, "
+              f"耗时 {(time.perf_counter() - start) * 1000:.1f} 毫秒, 拼音={'开' if lazy_pinyin else '关'}")
+    return index
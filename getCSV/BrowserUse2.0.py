@@ -1,37 +1,109 @@
 import os
 import csv
+import json
 import random 
+import argparse
+from pathlib import Path
 from dotenv import load_dotenv
 from langchain_openai import ChatOpenAI
 from browser_use import Agent, Browser
 from browser_use import BrowserConfig
+from browser_use.browser.context import BrowserContextConfig
 import asyncio
 
-def save_to_csv(data, filename="restaurant_data.csv"):
-    """保存数据到CSV文件"""
-    headers = ["店铺名称", "地址", "评分", "评论"]
-    with open(filename, 'a', newline='', encoding='utf-8') as f:
-        writer = csv.DictWriter(f, fieldnames=headers)
-        if os.path.getsize(filename) == 0:
-            writer.writeheader()
-        writer.writerow(data)
-
-async def search_restaurant(browser, llm, keyword):
-    """搜索单个餐厅信息"""
+# ========== 常量定义 ==========
+DATASET_PATH = Path(__file__).parent.parent / "backend" / "restaurant_all.csv"
+OUTPUT_PATH = "restaurant_data.csv"
+CHECKPOINT_PATH = "enrich_checkpoint.txt"
+COOKIES_FILE = "dianping_cookies.json"  # 登录后保存的 cookie，供所有标签页共享
+START_URL = os.getenv("DIANPING_START_URL", "https://www.dianping.com/")  # 可指向本地 HTML 测试页
+CSV_HEADERS = ["店铺名称", "地址", "评分", "评论"]
+
+class BatchCSVWriter:
+    """缓冲结果并批量写入CSV；每次落盘后再记录断点，保证重跑时不丢不重"""
+
+    def __init__(self, filename=OUTPUT_PATH, checkpoint_path=CHECKPOINT_PATH, batch_size=10):
+        self.filename = filename
+        self.checkpoint_path = checkpoint_path
+        self.batch_size = batch_size
+        self.buffer = []  # (关键词, 行数据)
+        self._lock = asyncio.Lock()
+
+    def completed(self):
+        """读取已完成的店铺名称"""
+        if not os.path.exists(self.checkpoint_path):
+            return set()
+        with open(self.checkpoint_path, "r", encoding="utf-8") as f:
+            return {line.strip() for line in f if line.strip()}
+
+    async def add(self, keyword, row):
+        async with self._lock:
+            self.buffer.append((keyword, row))
+            if len(self.buffer) >= self.batch_size:
+                self._flush()
+
+    async def flush(self):
+        async with self._lock:
+            self._flush()
+
+    def _flush(self):
+        if not self.buffer:
+            return
+        write_header = not os.path.exists(self.filename) or os.path.getsize(self.filename) == 0
+        with open(self.filename, 'a', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=CSV_HEADERS)
+            if write_header:
+                writer.writeheader()
+            writer.writerows(row for _, row in self.buffer)
+        with open(self.checkpoint_path, 'a', encoding='utf-8') as f:
+            f.writelines(f"{keyword}\n" for keyword, _ in self.buffer)
+        print(f"已批量写入 {len(self.buffer)} 条结果")
+        self.buffer.clear()
+
+def load_work_queue(dataset_path=DATASET_PATH, completed=()):
+    """从 restaurant_all.csv 读取待补充的店铺名称，跳过已完成的"""
+    with open(dataset_path, "r", encoding="utf-8-sig", newline="") as f:
+        names = [row["name"].strip() for row in csv.DictReader(f) if row.get("name")]
+    seen = set(completed)
+    queue = []
+    for name in names:
+        if name not in seen:
+            seen.add(name)
+            queue.append(name)
+    return queue
+
+def parse_agent_result(keyword, history):
+    """将 Agent 的最终输出解析为一行CSV数据"""
+    text = history.final_result() if history is not None else None
+    if not text:
+        return None
+    try:
+        data = json.loads(text.strip().removeprefix("```json").removesuffix("```"))
+        row = {key: data.get(key, "") for key in CSV_HEADERS}
+        if isinstance(row["评论"], list):
+            row["评论"] = "|".join(str(c) for c in row["评论"])
+    except (json.JSONDecodeError, AttributeError):
+        row = {"店铺名称": keyword, "地址": "", "评分": "", "评论": text}
+    row["店铺名称"] = row["店铺名称"] or keyword
+    return row
+
+async def search_restaurant(context, llm, keyword):
+    """在给定的浏览器上下文（标签页）中搜索单个餐厅信息"""
+    page = await context.get_current_page()
     try:
         # 在每次搜索操作前处理可能的弹窗和验证
-        await handle_popups(browser)
-        await handle_verification(browser)
+        await handle_popups(page)
+        await handle_verification(page)
         
         agent = Agent(
             task=(
                  "1. 在当前页面的店铺搜索框中输入并搜索以下店铺\n"
                 f'2. 搜索 "{keyword}"\n'
                 "3. 点击第一个店铺\n"
-                "4. 返回店铺名称、地址、评分和所有评论"
+                "4. 以 JSON 返回店铺信息，键为: 店铺名称、地址、评分、评论（评论为字符串列表）"
             ),
             llm=llm,
-            browser=browser,
+            browser_context=context,
             use_vision=False,
             #save_conversation_path="logs/conversation"
         )
@@ -39,32 +111,32 @@ async def search_restaurant(browser, llm, keyword):
         result = await agent.run()
         
         # 搜索完成后再次处理可能出现的弹窗
-        await handle_popups(browser)
+        await handle_popups(page)
         return result
         
     except Exception as e:
         print(f"搜索过程中出错: {str(e)}")
         # 出错时也要尝试处理弹窗
-        await handle_popups(browser)
+        await handle_popups(page)
         return None
 
-async def handle_popups(browser):
+async def handle_popups(page):
     """处理各种弹窗的函数"""
     try:
         # 处理APP下载弹窗
-        app_popup = await browser.page.query_selector('xpath=//div[contains(@class, "modal-close")]')
+        app_popup = await page.query_selector('xpath=//div[contains(@class, "modal-close")]')
         if app_popup:
             await app_popup.click()
             await asyncio.sleep(random.uniform(0.8, 1.5))
         
         # 处理登录提示弹窗
-        login_popup = await browser.page.query_selector('xpath=//div[contains(@class, "login-close")]')
+        login_popup = await page.query_selector('xpath=//div[contains(@class, "login-close")]')
         if login_popup:
             await login_popup.click()
             await asyncio.sleep(random.uniform(0.8, 2))
             
         # 处理其他通用弹窗
-        other_popups = await browser.page.query_selector_all('xpath=//*[contains(@class, "close") or contains(@class, "popup")]')
+        other_popups = await page.query_selector_all('xpath=//*[contains(@class, "close") or contains(@class, "popup")]')
         for popup in other_popups:
             await popup.click()
             await asyncio.sleep(random.uniform(0.8, 1))
@@ -72,11 +144,11 @@ async def handle_popups(browser):
     except Exception as e:
         print(f"处理弹窗时出错: {str(e)}")
 
-async def auto_slide_verification(browser):
+async def auto_slide_verification(page):
     """自动处理滑块验证"""
     try:
         # 查找滑块元素
-        slider = await browser.page.query_selector('xpath=//div[contains(@class, "verify-slider")]')
+        slider = await page.query_selector('xpath=//div[contains(@class, "verify-slider")]')
         if slider:
             print("检测到滑块验证，尝试自动滑动...")
             
@@ -84,11 +156,11 @@ async def auto_slide_verification(browser):
             slider_box = await slider.bounding_box()
             
             # 模拟人工滑动
-            await browser.page.mouse.move(
+            await page.mouse.move(
                 slider_box['x'] + 5,  # 滑块左边缘位置
                 slider_box['y'] + slider_box['height']/2  # 滑块中间位置
             )
-            await browser.page.mouse.down()  # 按下鼠标
+            await page.mouse.down()  # 按下鼠标
             
             # 随机速度滑动
             current_x = slider_box['x'] + 5
@@ -97,18 +169,18 @@ async def auto_slide_verification(browser):
             while current_x < target_x:
                 move_step = random.uniform(5, 15)  # 随机步长
                 current_x += move_step
-                await browser.page.mouse.move(
+                await page.mouse.move(
                     current_x,
                     slider_box['y'] + slider_box['height']/2 + random.uniform(-2, 2),  # 添加微小的垂直偏移
                     steps=random.randint(1, 3)  # 随机步数
                 )
                 await asyncio.sleep(random.uniform(0.01, 0.03))  # 随机延迟
                 
-            await browser.page.mouse.up()  # 释放鼠标
+            await page.mouse.up()  # 释放鼠标
             await asyncio.sleep(1)  # 等待验证结果
             
             # 检查验证是否成功
-            is_success = not await browser.page.query_selector('xpath=//div[contains(@class, "verify-slider")]')
+            is_success = not await page.query_selector('xpath=//div[contains(@class, "verify-slider")]')
             if is_success:
                 print("自动滑块验证成功！")
                 return True
@@ -121,74 +193,122 @@ async def auto_slide_verification(browser):
         return False
 
 # 修改原有的 handle_verification 函数
-async def handle_verification(browser):
+async def handle_verification(page):
     """处理验证码"""
     try:
         # 检查是否存在滑块验证
-        slider = await browser.page.query_selector('xpath=//div[contains(@class, "verify-slider")]')
+        slider = await page.query_selector('xpath=//div[contains(@class, "verify-slider")]')
         if slider:
             # 首先尝试自动滑动
-            if not await auto_slide_verification(browser):
+            if not await auto_slide_verification(page):
                 # 自动验证失败，切换到人工验证
                 print("请在30秒内手动完成验证...")
-                await browser.page.wait_for_selector('xpath=//div[contains(@class, "verify-slider")]', state='hidden', timeout=30000)
+                await page.wait_for_selector('xpath=//div[contains(@class, "verify-slider")]', state='hidden', timeout=30000)
             await asyncio.sleep(random.uniform(0.8, 1.5))
         
         # 处理点击验证码（保持不变）
-        click_verify = await browser.page.query_selector('xpath=//div[contains(@class, "verify-image")]')
+        click_verify = await page.query_selector('xpath=//div[contains(@class, "verify-image")]')
         if click_verify:
             print("检测到图片验证码，请在30秒内手动完成验证...")
-            await browser.page.wait_for_selector('xpath=//div[contains(@class, "verify-image")]', state='hidden', timeout=30000)
+            await page.wait_for_selector('xpath=//div[contains(@class, "verify-image")]', state='hidden', timeout=30000)
             await asyncio.sleep(random.uniform(0.8, 1.5))
             
     except Exception as e:
         print(f"处理验证码时出错: {str(e)}")
 
-async def run_multiple_searches():
-    # 配置浏览器
-    config = BrowserConfig(headless=False, disable_security=False)
-    browser = Browser(config=config)
-    
+async def login(browser, llm, skip_login=False):
+    """首次登录并保存 cookie，后续所有标签页共享登录态"""
+    context = await browser.new_context(BrowserContextConfig(cookies_file=COOKIES_FILE))
     try:
-        # 首次登录
+        if skip_login:
+            page = await context.get_current_page()
+            await page.goto(START_URL)
+            return
         login_agent = Agent(
             task=(
-                '1. 打开 https://www.dianping.com/\n'
+                f'1. 打开 {START_URL}\n'
                 '2. 等待30秒\n'#手动登录，切换到美食页面
                 '3. 保持在当前页面\n'
             ),
             llm=llm,
-            browser=browser,
+            browser_context=context,
             use_vision=False
         )
         await login_agent.run()
+    finally:
+        await context.close()  # 关闭时 cookie 写入 COOKIES_FILE
 
-        # 搜索关键词列表
-        search_keywords = [
-            "巴蜀鱼花(南大店)", "陕老顺肉夹馍", "同廣鸣港式烧腊(南京大学店)", "鱼塘鲜专业鱼馆(汉口路店)", 
-            "西安特色面馆(汉口路店)", "荆州锅盔(汉口路小区店)", "兰州拉面刀削面(汉口路店)", 
-            "张亮麻辣烫(南大店)", "老王馄饨", "石锅房"
-        ]
-
-        # 依次搜索每个关键词
-        for keyword in search_keywords:
+async def enrich_worker(worker_id, browser, llm, queue, writer):
+    """每个 worker 持有一个独立的浏览器上下文，从队列中领取店铺逐个搜索"""
+    context = await browser.new_context(BrowserContextConfig(cookies_file=COOKIES_FILE))
+    try:
+        page = await context.get_current_page()
+        await page.goto(START_URL)
+        while True:
+            try:
+                keyword = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
             try:
-                result = await search_restaurant(browser, llm, keyword)
-                save_to_csv(result)
-                print(f"已完成 {keyword} 的搜索并保存")
+                history = await search_restaurant(context, llm, keyword)
+                row = parse_agent_result(keyword, history)
+                if row is not None:
+                    await writer.add(keyword, row)
+                    print(f"[标签页{worker_id}] 已完成 {keyword} 的搜索")
+                else:
+                    print(f"[标签页{worker_id}] {keyword} 未获取到结果，下次重跑时重试")
                 await asyncio.sleep(random.uniform(0.8, 1.5))  # 添加延迟避免请求过快
             except Exception as e:
-                print(f"搜索 {keyword} 时出错: {str(e)}")
-                continue
+                print(f"[标签页{worker_id}] 搜索 {keyword} 时出错: {str(e)}")
+            finally:
+                queue.task_done()
+    finally:
+        await context.close()
 
+async def run_multiple_searches(llm, concurrency=3, dataset_path=DATASET_PATH, output=OUTPUT_PATH,
+                                checkpoint_path=CHECKPOINT_PATH, batch_size=10, headless=False,
+                                skip_login=False):
+    """并发补充大众点评信息：多个标签页并行，结果批量写入，已完成的店铺重跑时跳过"""
+    writer = BatchCSVWriter(output, checkpoint_path, batch_size)
+    names = load_work_queue(dataset_path, writer.completed())
+    print(f"待处理店铺 {len(names)} 家，并发标签页 {concurrency} 个")
+    if not names:
+        return
+
+    queue = asyncio.Queue()
+    for name in names:
+        queue.put_nowait(name)
+
+    # 配置浏览器
+    config = BrowserConfig(headless=headless, disable_security=False)
+    browser = Browser(config=config)
+    try:
+        await login(browser, llm, skip_login)
+        await asyncio.gather(*(
+            enrich_worker(i + 1, browser, llm, queue, writer)
+            for i in range(min(concurrency, len(names)))
+        ))
     finally:
+        await writer.flush()
         await browser.close()
 
 if __name__ == '__main__':
     load_dotenv()
+    parser = argparse.ArgumentParser(description="并发抓取大众点评店铺信息")
+    parser.add_argument("--concurrency", type=int, default=3, help="同时打开的标签页数")
+    parser.add_argument("--dataset", default=str(DATASET_PATH), help="读取店铺名称的CSV")
+    parser.add_argument("--output", default=OUTPUT_PATH)
+    parser.add_argument("--checkpoint", default=CHECKPOINT_PATH)
+    parser.add_argument("--batch-size", type=int, default=10)
+    parser.add_argument("--headless", action="store_true")
+    parser.add_argument("--skip-login", action="store_true", help="使用本地测试页时跳过登录")
+    args = parser.parse_args()
     llm = ChatOpenAI(
         base_url=os.getenv("DEEPSEEK_BASE_URL"),
         model=os.getenv("DEEPSEEK_MODEL_NAME"),
         api_key=os.getenv("DEEPSEEK_API_KEY")
     )
-    asyncio.run(run_multiple_searches())
\ No newline at end of file
+    asyncio.run(run_multiple_searches(
+        llm, args.concurrency, args.dataset, args.output, args.checkpoint,
+        args.batch_size, args.headless, args.skip_login
+    ))
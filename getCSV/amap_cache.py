@@ -0,0 +1,98 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+# ========== 常量定义 ==========
+CACHE_DIR = Path(__file__).parent / "amap_cache"
+DEFAULT_TTL = 7 * 24 * 3600          # 秒
+DEFAULT_MAX_BYTES = 200 * 1024 * 1024
+
+
+class CacheMissError(Exception):
+    """离线模式下请求未命中缓存"""
+
+
+class ResponseCache:
+    """高德接口响应的磁盘缓存：以归一化后的请求参数内容寻址，支持 TTL、容量淘汰与纯离线模式。
+
+    请求参数中的 key 不参与寻址，换 key 不会导致缓存失效。
+    """
+
+    def __init__(self, cache_dir: Path = CACHE_DIR, ttl: float = DEFAULT_TTL,
+                 max_bytes: int = DEFAULT_MAX_BYTES, offline: bool = False):
+        self.cache_dir = Path(cache_dir)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._total_bytes = sum(p.stat().st_size for p in self.cache_dir.glob("*/*.json"))
+
+    @classmethod
+    def from_env(cls) -> "ResponseCache":
+        """按环境变量 AMAP_CACHE_TTL / AMAP_CACHE_MAX_MB / AMAP_OFFLINE 创建"""
+        return cls(
+            ttl=float(os.getenv("AMAP_CACHE_TTL", DEFAULT_TTL)),
+            max_bytes=int(float(os.getenv("AMAP_CACHE_MAX_MB", DEFAULT_MAX_BYTES / 1024 / 1024)) * 1024 * 1024),
+            offline=os.getenv("AMAP_OFFLINE", "0") == "1",
+        )
+
+    @staticmethod
+    def cache_key(url: str, params: Dict) -> str:
+        normalized = {k: str(v) for k, v in params.items() if k != "key" and v not in (None, "")}
+        payload = json.dumps([url, normalized], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.json"
+
+    def get(self, url: str, params: Dict) -> Optional[Dict]:
+        """命中返回响应体；离线模式下未命中抛出 CacheMissError"""
+        path = self._path(self.cache_key(url, params))
+        try:
+            age = time.time() - path.stat().st_mtime
+            if self.offline or age <= self.ttl:
+                with open(path, "r", encoding="utf-8") as f:
+                    result = json.load(f)
+                os.utime(path, (time.time(), path.stat().st_mtime))  # 记录访问时间，用于 LRU 淘汰
+                self.hits += 1
+                return result
+        except (FileNotFoundError, json.JSONDecodeError):
+            pass
+        self.misses += 1
+        if self.offline:
+            raise CacheMissError(f"离线模式下缓存未命中: {params.get('keywords')} 第 {params.get('page_num')} 页")
+        return None
+
+    def put(self, url: str, params: Dict, result: Dict):
+        path = self._path(self.cache_key(url, params))
+        path.parent.mkdir(parents=True, exist_ok=True)
+        data = json.dumps(result, ensure_ascii=False).encode("utf-8")
+        tmp = path.with_suffix(".tmp")
+        with open(tmp, "wb") as f:
+            f.write(data)
+        old_size = path.stat().st_size if path.exists() else 0
+        os.replace(tmp, path)
+        with self._lock:
+            self._total_bytes += len(data) - old_size
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """按最近访问时间淘汰，直到总量降到上限的 90%"""
+        entries = sorted(self.cache_dir.glob("*/*.json"), key=lambda p: p.stat().st_atime)
+        for path in entries:
+            if self._total_bytes <= self.max_bytes * 0.9:
+                break
+            size = path.stat().st_size
+            path.unlink(missing_ok=True)
+            self._total_bytes -= size
+
+    def stats(self) -> Dict:
+        return {"hits": self.hits, "misses": self.misses, "bytes": self._total_bytes, "offline": self.offline}
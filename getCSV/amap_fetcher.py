@@ -0,0 +1,264 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+import aiohttp
+from dotenv import load_dotenv
+
+from amap_cache import ResponseCache
+from getdata_Amap import AMAP_AROUND_URL, build_search_params, save_to_csv
+
+load_dotenv()
+
+# ========== 常量定义 ==========
+CHECKPOINT_DIR = Path(__file__).parent / "amap_checkpoints"
+# 高德返回这些 infocode 表示触发了频率/配额限制，可退避后重试
+RETRYABLE_INFOCODES = {"10014", "10019", "10020", "10021", "10022"}
+
+
+class AmapAPIError(Exception):
+    """高德接口返回 status != 1 且不可重试"""
+
+
+class TokenBucket:
+    """令牌桶限流：平均每秒放行 rate 个请求，允许 capacity 的突发"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class PageCheckpoint:
+    """按"查询 + 页码"落盘的断点，重跑时已完成的页直接从磁盘读取"""
+
+    def __init__(self, root: Path = CHECKPOINT_DIR):
+        self.root = Path(root)
+
+    def query_dir(self, params: Dict, url: str = AMAP_AROUND_URL) -> Path:
+        stable = {k: v for k, v in params.items() if k not in ("key", "page_num")}
+        if url != AMAP_AROUND_URL:
+            stable["_url"] = url
+        digest = hashlib.sha1(json.dumps(stable, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()[:16]
+        return self.root / digest
+
+    def load_page(self, query_dir: Path, page_num: int) -> Optional[Dict]:
+        path = query_dir / f"page_{page_num}.json"
+        if path.exists():
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        return None
+
+    def save_page(self, query_dir: Path, page_num: int, result: Dict):
+        query_dir.mkdir(parents=True, exist_ok=True)
+        tmp = query_dir / f".page_{page_num}.json.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False)
+        os.replace(tmp, query_dir / f"page_{page_num}.json")
+
+    def is_done(self, query_dir: Path) -> bool:
+        return (query_dir / "DONE").exists()
+
+    def mark_done(self, query_dir: Path, pages: int):
+        query_dir.mkdir(parents=True, exist_ok=True)
+        (query_dir / "DONE").write_text(str(pages), encoding="utf-8")
+
+
+class AsyncAmapFetcher:
+    """并发抓取高德周边搜索：共享连接池 + 令牌桶限流 + 逐页断点续传。
+
+    base_url 可指向本地桩服务（或设置 AMAP_BASE_URL 环境变量），便于离线测试。
+    """
+
+    def __init__(self, api_key: str, base_url: Optional[str] = None, qps: float = 3.0,
+                 concurrency: int = 8, page_window: int = 3, max_retries: int = 3,
+                 timeout: float = 15.0, checkpoint_dir: Path = CHECKPOINT_DIR,
+                 cache: Optional[ResponseCache] = None):
+        self.api_key = api_key
+        self.base_url = base_url or os.getenv("AMAP_BASE_URL", AMAP_AROUND_URL)
+        self.bucket = TokenBucket(qps)
+        self.concurrency = concurrency
+        self.page_window = max(1, page_window)
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.checkpoint = PageCheckpoint(checkpoint_dir)
+        self.cache = cache
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.stats = {"requests": 0, "retries": 0, "pages_from_checkpoint": 0, "queries_from_checkpoint": 0}
+
+    async def __aenter__(self) -> "AsyncAmapFetcher":
+        connector = aiohttp.TCPConnector(limit=self.concurrency, keepalive_timeout=30)
+        self.session = aiohttp.ClientSession(connector=connector,
+                                             timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.session.close()
+
+    async def fetch_page(self, params: Dict, url: Optional[str] = None) -> Dict:
+        """请求单页，优先读取响应缓存；遇到限流或网络错误时指数退避重试"""
+        url = url or self.base_url
+        if self.cache is not None:
+            cached = self.cache.get(url, params)  # 离线模式下未命中会抛出 CacheMissError
+            if cached is not None:
+                return cached
+        for attempt in range(self.max_retries + 1):
+            await self.bucket.acquire()
+            self.stats["requests"] += 1
+            try:
+                async with self.session.get(url, params=params) as response:
+                    response.raise_for_status()
+                    result = await response.json(content_type=None)
+                if result.get("status") == "1":
+                    if self.cache is not None:
+                        self.cache.put(url, params, result)
+                    return result
+                if result.get("infocode") not in RETRYABLE_INFOCODES:
+                    raise AmapAPIError(f"{result.get('info')} (infocode={result.get('infocode')})")
+                error = AmapAPIError(result.get("info", "限流"))
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = e
+            if attempt < self.max_retries:
+                self.stats["retries"] += 1
+                await asyncio.sleep(min(30.0, 2 ** attempt))
+        raise error
+
+    async def _load_or_fetch(self, query_dir: Path, params: Dict, url: str) -> Dict:
+        cached = self.checkpoint.load_page(query_dir, params["page_num"])
+        if cached is not None:
+            self.stats["pages_from_checkpoint"] += 1
+            return cached
+        result = await self.fetch_page(params, url)
+        self.checkpoint.save_page(query_dir, params["page_num"], result)
+        return result
+
+    def _replay_done(self, query_dir: Path, page_size: int, max_pages: int) -> Optional[Dict]:
+        """已标记完成的查询直接按顺序读取磁盘上的各页，不经过限流与网络；缺页时返回 None"""
+        all_pois, all_business, all_photos = [], {}, []
+        for page_num in range(1, max_pages + 1):
+            result = self.checkpoint.load_page(query_dir, page_num)
+            if result is None:
+                return None
+            pois = result.get("pois", [])
+            all_pois.extend(pois)
+            all_business.update(result.get("business", {}))
+            all_photos.extend(result.get("photos", []))
+            if len(pois) < page_size:
+                return {"pois": all_pois, "business": all_business, "photos": all_photos,
+                        "pages_full": False, "complete": True}
+        return {"pois": all_pois, "business": all_business, "photos": all_photos,
+                "pages_full": True, "complete": True}
+
+    async def paginate(self, base_params: Dict, url: Optional[str] = None,
+                       max_pages: int = 12, label: str = "") -> Dict:
+        """按窗口并发请求分页，遇到不满页即停止；返回结果中 pages_full 表示是否取满了 max_pages 页。
+
+        complete 为 False 表示中途有页失败，已取得的页保留在断点中，重跑时从失败处继续。
+        """
+        url = url or self.base_url
+        page_size = int(base_params.get("page_size", 25))
+        query_dir = self.checkpoint.query_dir(base_params, url)
+        if self.checkpoint.is_done(query_dir):
+            replayed = self._replay_done(query_dir, page_size, max_pages)
+            if replayed is not None:
+                self.stats["queries_from_checkpoint"] += 1
+                return replayed
+        all_pois, all_business, all_photos = [], {}, []
+
+        page_num, finished = 1, False
+        while page_num <= max_pages and not finished:
+            window = range(page_num, min(max_pages, page_num + self.page_window - 1) + 1)
+            tasks = [self._load_or_fetch(query_dir, {**base_params, "page_num": n}, url) for n in window]
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+            for n, result in zip(window, results):
+                if isinstance(result, Exception):
+                    print(f"[{label}] 获取第 {n} 页时发生错误: {str(result)}，重跑时将从此处继续")
+                    return {"pois": all_pois, "business": all_business, "photos": all_photos,
+                            "pages_full": False, "complete": False}
+                pois = result.get("pois", [])
+                all_pois.extend(pois)
+                all_business.update(result.get("business", {}))
+                all_photos.extend(result.get("photos", []))
+                if len(pois) < page_size:
+                    finished = True
+                    break
+            page_num = window[-1] + 1
+
+        self.checkpoint.mark_done(query_dir, page_num - 1)
+        print(f"[{label}] 完成，共 {len(all_pois)} 条记录")
+        return {"pois": all_pois, "business": all_business, "photos": all_photos,
+                "pages_full": not finished, "complete": True}
+
+    async def search(self, keyword: str, location: str = "", city: str = "", radius: int = 3000,
+                     page_size: int = 25, max_pages: int = 12) -> Dict:
+        """与 GaodeMapAPI.search_pois 返回结构相同的周边搜索"""
+        base_params = build_search_params(self.api_key, keyword, location, city, radius, page_size, 1)
+        return await self.paginate(base_params, max_pages=max_pages, label=f"{keyword}@{location or city}")
+
+    async def search_many(self, queries: Iterable[Dict]) -> List[Dict]:
+        """并发执行多组 (关键词, 位置, 半径...) 查询"""
+        return await asyncio.gather(*(self.search(**q) for q in queries))
+
+
+def dedupe_pois(results: Iterable[Dict]) -> List[Dict]:
+    """合并多个查询结果，按 POI id 去重"""
+    seen, pois = set(), []
+    for result in results:
+        for poi in result["pois"]:
+            poi_id = poi.get("id") or (poi.get("name"), poi.get("location"))
+            if poi_id not in seen:
+                seen.add(poi_id)
+                pois.append(poi)
+    return pois
+
+
+async def run(args):
+    queries = [
+        {"keyword": kw, "location": loc, "city": args.city, "radius": args.radius,
+         "page_size": 25, "max_pages": args.max_pages}
+        for kw in args.keywords for loc in args.locations
+    ]
+    start = time.time()
+    cache = ResponseCache.from_env()
+    async with AsyncAmapFetcher(os.getenv("AMAP_API_KEY"), qps=args.qps,
+                                concurrency=args.concurrency, cache=cache) as fetcher:
+        results = await fetcher.search_many(queries)
+        print(f"请求统计: {fetcher.stats}, 缓存统计: {cache.stats()}")
+    pois = dedupe_pois(results)
+    print(f"{len(queries)} 组查询共获得 {len(pois)} 个去重后的地点，耗时 {time.time() - start:.1f} 秒")
+    save_to_csv(pois, args.output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="并发抓取高德周边 POI（支持断点续传）")
+    parser.add_argument("--keywords", nargs="+", required=True, help="搜索关键词，可多个")
+    parser.add_argument("--locations", nargs="+", default=["118.779711,32.054377"], help="中心点坐标，可多个")
+    parser.add_argument("--city", default="南京")
+    parser.add_argument("--radius", type=int, default=3000)
+    parser.add_argument("--max-pages", type=int, default=12)
+    parser.add_argument("--qps", type=float, default=3.0, help="令牌桶速率，按 API 配额设置")
+    parser.add_argument("--concurrency", type=int, default=8, help="连接池大小")
+    parser.add_argument("--output", default="amap_poi_results.csv")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
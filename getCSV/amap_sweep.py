@@ -0,0 +1,191 @@
+import argparse
+import asyncio
+import csv
+import os
+import sys
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from amap_cache import ResponseCache
+from amap_fetcher import AsyncAmapFetcher
+from getdata_Amap import CSV_FIELDNAMES, poi_to_row
+
+load_dotenv()
+
+# ========== 常量定义 ==========
+AMAP_POLYGON_URL = "https://restapi.amap.com/v5/place/polygon"
+RESTAURANT_TYPES = "050000"  # 餐饮服务
+# 鼓楼区南京大学周边的默认范围 (min_lng, min_lat, max_lng, max_lat)
+DEFAULT_BBOX = (118.750, 32.035, 118.810, 32.075)
+
+
+@dataclass
+class Tile:
+    min_lng: float
+    min_lat: float
+    max_lng: float
+    max_lat: float
+    depth: int = 0
+
+    @property
+    def polygon(self) -> str:
+        """高德矩形多边形参数：左上角|右下角"""
+        return f"{self.min_lng:.6f},{self.max_lat:.6f}|{self.max_lng:.6f},{self.min_lat:.6f}"
+
+    def split(self) -> List["Tile"]:
+        """四等分"""
+        mid_lng = (self.min_lng + self.max_lng) / 2
+        mid_lat = (self.min_lat + self.max_lat) / 2
+        d = self.depth + 1
+        return [
+            Tile(self.min_lng, mid_lat, mid_lng, self.max_lat, d),
+            Tile(mid_lng, mid_lat, self.max_lng, self.max_lat, d),
+            Tile(self.min_lng, self.min_lat, mid_lng, mid_lat, d),
+            Tile(mid_lng, self.min_lat, self.max_lng, mid_lat, d),
+        ]
+
+
+def grid_tiles(bbox, grid: int) -> List[Tile]:
+    min_lng, min_lat, max_lng, max_lat = bbox
+    step_lng = (max_lng - min_lng) / grid
+    step_lat = (max_lat - min_lat) / grid
+    return [
+        Tile(min_lng + i * step_lng, min_lat + j * step_lat,
+             min_lng + (i + 1) * step_lng, min_lat + (j + 1) * step_lat)
+        for i in range(grid) for j in range(grid)
+    ]
+
+
+class StreamingPOIWriter:
+    """边抓取边写入 CSV，按 POI id 去重"""
+
+    def __init__(self, filename: str):
+        self.file = open(filename, "w", newline="", encoding="utf-8-sig")
+        self.writer = csv.DictWriter(self.file, fieldnames=CSV_FIELDNAMES)
+        self.writer.writeheader()
+        self.seen = set()
+        self.duplicates = 0
+
+    def write(self, pois: List[Dict]) -> int:
+        added = 0
+        for poi in pois:
+            poi_id = poi.get("id") or (poi.get("name"), poi.get("location"))
+            if poi_id in self.seen:
+                self.duplicates += 1
+                continue
+            self.seen.add(poi_id)
+            self.writer.writerow(poi_to_row(poi))
+            added += 1
+        self.file.flush()
+        return added
+
+    def close(self):
+        self.file.close()
+
+
+class AreaSweeper:
+    """分块扫描一个矩形区域：各块并行查询，取满页数的块继续四分，直到不再饱和或达到最大深度"""
+
+    def __init__(self, fetcher: AsyncAmapFetcher, writer: StreamingPOIWriter,
+                 keywords: str = "", types: str = RESTAURANT_TYPES, max_pages: int = 4,
+                 max_depth: int = 4, url: Optional[str] = None):
+        self.fetcher = fetcher
+        self.writer = writer
+        self.keywords = keywords
+        self.types = types
+        self.max_pages = max_pages
+        self.max_depth = max_depth
+        self.url = url or os.getenv("AMAP_POLYGON_URL", AMAP_POLYGON_URL)
+        self.stats = {"tiles": 0, "subdivided": 0, "saturated_at_max_depth": 0, "retried": 0}
+        self.incomplete: List[Tile] = []  # 有页请求失败、结果不完整的块
+
+    def _params(self, tile: Tile) -> Dict:
+        params = {
+            "key": self.fetcher.api_key,
+            "polygon": tile.polygon,
+            "types": self.types,
+            "output": "JSON",
+            "page_size": 25,
+            "page_num": 1,
+            "show_fields": "business",
+        }
+        if self.keywords:
+            params["keywords"] = self.keywords
+        return params
+
+    async def sweep_tile(self, tile: Tile):
+        self.stats["tiles"] += 1
+        result = await self.fetcher.paginate(self._params(tile), self.url, self.max_pages,
+                                             label=f"tile d{tile.depth} {tile.polygon}")
+        self.writer.write(result["pois"])
+        if not result["complete"]:
+            # 中途失败：既不能判断是否饱和也不能视为已扫描，留待重试
+            self.incomplete.append(tile)
+            return
+        if not result["pages_full"]:
+            return
+        if tile.depth >= self.max_depth:
+            self.stats["saturated_at_max_depth"] += 1
+            print(f"警告: 块 {tile.polygon} 在最大深度仍然取满，可能有遗漏")
+            return
+        self.stats["subdivided"] += 1
+        await asyncio.gather(*(self.sweep_tile(child) for child in tile.split()))
+
+    async def sweep(self, bbox, grid: int = 4, retries: int = 1) -> List[Tile]:
+        """扫描整个区域，结果不完整的块重试 retries 轮（已取得的页从断点读取），返回最终仍不完整的块"""
+        await asyncio.gather(*(self.sweep_tile(tile) for tile in grid_tiles(bbox, grid)))
+        for _ in range(retries):
+            if not self.incomplete:
+                break
+            tiles, self.incomplete = self.incomplete, []
+            self.stats["retried"] += len(tiles)
+            await asyncio.gather(*(self.sweep_tile(tile) for tile in tiles))
+        self.stats["incomplete"] = len(self.incomplete)
+        return self.incomplete
+
+
+async def run(args):
+    bbox = tuple(float(x) for x in args.bbox.split(","))
+    start = time.time()
+    writer = StreamingPOIWriter(args.output)
+    cache = ResponseCache.from_env()
+    try:
+        async with AsyncAmapFetcher(os.getenv("AMAP_API_KEY"), qps=args.qps,
+                                    concurrency=args.concurrency, cache=cache) as fetcher:
+            sweeper = AreaSweeper(fetcher, writer, keywords=args.keywords, types=args.types,
+                                  max_pages=args.max_pages, max_depth=args.max_depth)
+            incomplete = await sweeper.sweep(bbox, args.grid, args.retries)
+            print(f"扫描统计: {sweeper.stats}, 请求统计: {fetcher.stats}, 缓存统计: {cache.stats()}")
+    finally:
+        writer.close()
+    print(f"共写入 {len(writer.seen)} 个去重后的地点（跨块重复 {writer.duplicates} 条），"
+          f"耗时 {time.time() - start:.1f} 秒，已保存到 {args.output}")
+    for tile in incomplete:
+        print(f"错误: 块 {tile.polygon} (深度 {tile.depth}) 请求失败，结果不完整")
+    if incomplete:
+        print(f"有 {len(incomplete)} 个块未扫描完整，输出存在遗漏；重跑同一命令会从断点继续")
+    return not incomplete
+
+
+def main():
+    parser = argparse.ArgumentParser(description="分块扫描区域内的高德 POI，突破单次查询的分页上限")
+    parser.add_argument("--bbox", default=",".join(str(x) for x in DEFAULT_BBOX),
+                        help="min_lng,min_lat,max_lng,max_lat")
+    parser.add_argument("--grid", type=int, default=4, help="初始网格边长（grid x grid 块）")
+    parser.add_argument("--max-depth", type=int, default=4, help="饱和块最多四分的层数")
+    parser.add_argument("--max-pages", type=int, default=4, help="每块最多请求的页数，取满即视为饱和")
+    parser.add_argument("--types", default=RESTAURANT_TYPES, help="高德 POI 类型编码")
+    parser.add_argument("--keywords", default="", help="可选关键词")
+    parser.add_argument("--qps", type=float, default=3.0)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--retries", type=int, default=1, help="结果不完整的块重试轮数")
+    parser.add_argument("--output", default="amap_sweep_results.csv")
+    if not asyncio.run(run(parser.parse_args())):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,43 +1,64 @@
 import requests
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
 import json
 import os
 import csv  # 添加csv模块导入
 import time
 from dotenv import load_dotenv
+from amap_cache import ResponseCache
 load_dotenv()
+
+AMAP_AROUND_URL = "https://restapi.amap.com/v5/place/around"
+
+def build_search_params(api_key: str, keyword: str, location: str = "", city: str = "",
+                        radius: int = 3000, page_size: int = 25, page_num: int = 1) -> Dict:
+    """构造周边搜索请求参数（同步与异步抓取共用）"""
+    params = {
+        'key': api_key,
+        'keywords': keyword,
+        'region': city,#城市名称(可选)
+        #'types':'050000',
+        'radius': radius,#搜索半径（可调），单位：米
+        'output': 'JSON',
+        'page_size': min(page_size, 25),  # 限制最大值为25
+        'page_num': page_num,
+        'show_fields': 'business',# 指定需要返回的字段'business,photos'#获取照片！！
+        'extensions':'all'
+    }
+    # 如果提供了location，添加到请求参数中
+    if location:
+        params['location'] = location
+    return params
+
 class GaodeMapAPI:
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, cache: Optional[ResponseCache] = None):
         self.api_key = api_key
-        self.base_url = "https://restapi.amap.com/v5/place/around"
+        self.base_url = os.getenv("AMAP_BASE_URL", AMAP_AROUND_URL)
+        self.cache = cache  # 为 None 时不使用缓存
+
+    def _get(self, params: Dict) -> Tuple[Dict, bool]:
+        """发起请求，优先读取响应缓存；返回 (响应体, 是否来自缓存)"""
+        if self.cache is not None:
+            cached = self.cache.get(self.base_url, params)
+            if cached is not None:
+                return cached, True
+        response = requests.get(self.base_url, params=params)
+        response.raise_for_status()
+        result = response.json()
+        if self.cache is not None and result.get('status') == '1':
+            self.cache.put(self.base_url, params, result)
+        return result, False
+
     def search_pois(self, keyword: str, location: str = "", city: str = "", radius: int = 3000, page_size: int = 25, max_pages: int = 5) -> Dict:
         all_pois = []
         all_business = {}
         all_photos = []
     
         for page_num in range(1, max_pages + 1):
-            params = {
-            'key': self.api_key,
-            'keywords': keyword,
-            'region': city,#城市名称(可选)
-            #'types':'050000',
-            'radius': radius,#搜索半径（可调），单位：米
-            'output': 'JSON',
-            'page_size': min(page_size, 25),  # 限制最大值为25
-            'page_num': page_num,
-            'show_fields': 'business',# 指定需要返回的字段'business,photos'#获取照片！！
-            'extensions':'all'
-            }
-        
-        # 如果提供了location，添加到请求参数中
-            if location:
-                params['location'] = location
-                #print(f"参数: {params}")
+            params = build_search_params(self.api_key, keyword, location, city, radius, page_size, page_num)
     
             try:
-                response = requests.get(self.base_url, params=params)
-                response.raise_for_status()
-                result = response.json()
+                result, from_cache = self._get(params)
                 #print("API返回数据:", json.dumps(result, ensure_ascii=False, indent=2))  # 添加这行调试代码
             
                 if result['status'] == '1':
@@ -53,8 +74,8 @@ class GaodeMapAPI:
                     all_photos.extend(result.get('photos', []))
                 
                     print(f"已获取第 {page_num} 页数据，共 {len(pois)} 条记录")
-                    # 添加30秒休眠，但最后一页不需要休眠
-                    if page_num < max_pages:
+                    # 添加30秒休眠，但最后一页和命中缓存的页不需要休眠
+                    if page_num < max_pages and not from_cache:
                         print(f"等待30秒后继续获取下一页...")
                         time.sleep(30)
                     else:
@@ -151,6 +172,30 @@ def format_poi_info(poi: Dict, business: Dict, photos: List) -> str:
 
     return basic_info + contact_info + business_info + restaurant_info + photo_info
 
+# 确定CSV文件的表头（根据POI数据的关键字段）
+CSV_FIELDNAMES = [
+    'name', 'address', 'location', 'type',
+    'tel', 'cost', 'rating', 'opentime_today',
+    'opentime_week', 'tag'
+]
+
+def poi_to_row(poi: Dict) -> Dict:
+    """将单个POI转换为CSV行"""
+    # 提取business信息
+    business = poi.get('business', {})
+    return {
+        'name': poi.get('name', ''),
+        'address': poi.get('address', ''),
+        'location': poi.get('location', ''),
+        'type': poi.get('type', ''),
+        'tel': business.get('tel', ''),
+        'cost': business.get('cost', ''),
+        'rating': business.get('rating', ''),
+        'opentime_today': business.get('opentime_today', ''),
+        'opentime_week': business.get('opentime_week', ''),
+        'tag': business.get('tag', '')
+    }
+
 def save_to_csv(pois: List[Dict], filename: str = "poi_results.csv"):
     """
     将POI数据保存为CSV文件
@@ -162,36 +207,12 @@ def save_to_csv(pois: List[Dict], filename: str = "poi_results.csv"):
         print("没有数据可以保存")
         return
     
-    # 确定CSV文件的表头（根据POI数据的关键字段）
-    fieldnames = [
-        'name', 'address', 'location', 'type',
-        'tel', 'cost', 'rating', 'opentime_today',
-        'opentime_week', 'tag'
-    ]
-    
     try:
         with open(filename, 'w', newline='', encoding='utf-8-sig') as f:
-            writer = csv.DictWriter(f, fieldnames=fieldnames)
+            writer = csv.DictWriter(f, fieldnames=CSV_FIELDNAMES)
             writer.writeheader()
-            
             for poi in pois:
-                # 提取business信息
-                business = poi.get('business', {})
-                
-                # 构建每一行的数据
-                row = {
-                    'name': poi.get('name', ''),
-                    'address': poi.get('address', ''),
-                    'location': poi.get('location', ''),
-                    'type': poi.get('type', ''),
-                    'tel': business.get('tel', ''),
-                    'cost': business.get('cost', ''),
-                    'rating': business.get('rating', ''),
-                    'opentime_today': business.get('opentime_today', ''),
-                    'opentime_week': business.get('opentime_week', ''),
-                    'tag': business.get('tag', '')
-                }
-                writer.writerow(row)
+                writer.writerow(poi_to_row(poi))
         print(f"数据已保存到 {filename}")
     except Exception as e:
         print(f"保存CSV文件时出错: {str(e)}")
@@ -200,7 +221,7 @@ def save_to_csv(pois: List[Dict], filename: str = "poi_results.csv"):
 
 def main():
     API_KEY = os.getenv("AMAP_API_KEY")
-    gaode = GaodeMapAPI(API_KEY)
+    gaode = GaodeMapAPI(API_KEY, cache=ResponseCache.from_env())
     
     #INPUT-para 获取用户输入
     keyword = input("请输入要搜索的地点: ")
@@ -221,6 +242,7 @@ def main():
         max_pages=max_pages
     )
     pois = result['pois']
+    print(f"缓存统计: {gaode.cache.stats()}")
     #business = result['business']
     #photos = result['photos']
 
@@ -0,0 +1,219 @@
+import argparse
+import csv
+import re
+import time
+import unicodedata
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+# ========== 常量定义 ==========
+AMAP_FIELDS = ["address", "location", "type", "tel", "cost", "rating",
+               "opentime_today", "opentime_week", "tag"]
+DIANPING_FIELDS = ["dp_cost", "dp_rating", "dp_taste_rating", "dp_env_rating",
+                   "dp_service_rating", "dp_comment_num", "dp_recommendation_dish",
+                   "dp_comment_keywords", "dp_top3_comments"]
+# 与 backend/restaurant_all.csv 相同的列顺序，末尾追加匹配置信度
+OUTPUT_FIELDS = ["name"] + DIANPING_FIELDS + AMAP_FIELDS + ["match_confidence"]
+
+# 双方都有分店后缀且后缀相似度低于该值时视为同一品牌的不同分店，不匹配
+BRANCH_MIN_SIMILARITY = 0.5
+
+_BRANCH_RE = re.compile(r"[(（]([^()（）]*)[)）]")
+_NOISE_RE = re.compile(r"[\s·•・\-—_'\"“”‘’,，.。!！&/]+")
+_GEOHASH_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def normalize_name(name: str) -> Tuple[str, str]:
+    """拆分店名主体与分店后缀：'巴蜀鱼花(南大店)' -> ('巴蜀鱼花', '南大')"""
+    name = unicodedata.normalize("NFKC", name or "").lower()
+    branches = _BRANCH_RE.findall(name)
+    base = _NOISE_RE.sub("", _BRANCH_RE.sub("", name))
+    branch = _NOISE_RE.sub("", "".join(branches))
+    branch = branch[:-1] if branch.endswith(("店", "馆")) and len(branch) > 1 else branch
+    return base, branch
+
+
+def normalize_text(text: str) -> str:
+    return _NOISE_RE.sub("", unicodedata.normalize("NFKC", text or "").lower())
+
+
+def ngrams(text: str, n: int = 2) -> Set[str]:
+    if len(text) < n:
+        return {text} if text else set()
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+def dice(a: Set[str], b: Set[str]) -> float:
+    if not a or not b:
+        return 0.0
+    return 2 * len(a & b) / (len(a) + len(b))
+
+
+def normalize_phones(tel: str) -> Set[str]:
+    return {re.sub(r"\D", "", t)[-8:] for t in re.split(r"[;,，/ ]", tel or "") if len(re.sub(r"\D", "", t)) >= 7}
+
+
+def geohash(lng: float, lat: float, precision: int = 6) -> str:
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    bits, bit_count, even, result = 0, 0, True, []
+    while len(result) < precision:
+        rng, value = (lng_range, lng) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        if value >= mid:
+            bits = (bits << 1) | 1
+            rng[0] = mid
+        else:
+            bits <<= 1
+            rng[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            result.append(_GEOHASH_BASE32[bits])
+            bits, bit_count = 0, 0
+    return "".join(result)
+
+
+def neighbor_geohashes(location: str, precision: int = 6) -> Set[str]:
+    """位置所在及相邻的 geohash 格子（约 1.2km x 0.6km），避免边界两侧漏配"""
+    try:
+        lng, lat = (float(x) for x in location.split(","))
+    except (AttributeError, ValueError):
+        return set()
+    step_lng, step_lat = 0.011, 0.0055
+    return {geohash(lng + dx * step_lng, lat + dy * step_lat, precision)
+            for dx in (-1, 0, 1) for dy in (-1, 0, 1)}
+
+
+class _Record:
+    __slots__ = ("row", "base", "branch", "grams", "address", "phones", "cells")
+
+    def __init__(self, row: Dict):
+        self.row = row
+        self.base, self.branch = normalize_name(row.get("name", ""))
+        self.grams = ngrams(self.base)
+        self.address = ngrams(normalize_text(row.get("address", "")))
+        self.phones = normalize_phones(row.get("tel", ""))
+        self.cells = neighbor_geohashes(row.get("location", ""))
+
+
+class POIJoiner:
+    """高德 POI 与大众点评记录的模糊连接：先分块（电话 / geohash / 名称 n-gram）再打分"""
+
+    def __init__(self, dianping_rows: Iterable[Dict], threshold: float = 0.6, max_gram_postings: int = 3):
+        self.records = [_Record(r) for r in dianping_rows]
+        self.threshold = threshold
+        self.max_gram_postings = max_gram_postings
+        self.by_phone: Dict[str, List[int]] = defaultdict(list)
+        self.by_cell: Dict[str, List[int]] = defaultdict(list)
+        self.by_gram: Dict[str, List[int]] = defaultdict(list)
+        for i, rec in enumerate(self.records):
+            for phone in rec.phones:
+                self.by_phone[phone].append(i)
+            for cell in rec.cells:
+                self.by_cell[cell].append(i)
+            for gram in rec.grams:
+                self.by_gram[gram].append(i)
+
+    def candidates(self, rec: _Record) -> Set[int]:
+        found = set()
+        for phone in rec.phones:
+            found.update(self.by_phone.get(phone, ()))
+        # 名称分块只取最稀有的几个 n-gram，避免"面馆""小吃"这类高频片段带来大量候选
+        grams = sorted(rec.grams, key=lambda g: len(self.by_gram.get(g, ())))
+        for gram in grams[:self.max_gram_postings]:
+            postings = self.by_gram.get(gram, ())
+            if rec.cells and any(self.records[i].cells for i in postings):
+                postings = [i for i in postings if not self.records[i].cells or rec.cells & self.records[i].cells]
+            found.update(postings)
+        return found
+
+    def score(self, a: _Record, b: _Record) -> float:
+        if a.phones & b.phones and dice(a.grams, b.grams) >= 0.3:
+            return 1.0
+        name_score = dice(a.grams, b.grams)
+        if a.base and a.base == b.base:
+            name_score = 1.0
+        if a.branch and b.branch:
+            branch_score = dice(ngrams(a.branch), ngrams(b.branch))
+            if branch_score < BRANCH_MIN_SIMILARITY:
+                # 同一连锁的不同分店：评分和评论不能合并到另一家店
+                return 0.0
+            name_score = 0.8 * name_score + 0.2 * branch_score
+        if a.address and b.address:
+            return 0.75 * name_score + 0.25 * dice(a.address, b.address)
+        return name_score
+
+    def match(self, amap_rows: Iterable[Dict]) -> List[Tuple[Dict, Optional[Dict], float]]:
+        """一对一匹配：按得分从高到低贪心分配，每条点评记录最多匹配一次"""
+        amap_records = [_Record(r) for r in amap_rows]
+        pairs = []
+        for ai, rec in enumerate(amap_records):
+            for di in self.candidates(rec):
+                s = self.score(rec, self.records[di])
+                if s >= self.threshold:
+                    pairs.append((s, ai, di))
+        pairs.sort(reverse=True)
+        assigned: Dict[int, Tuple[int, float]] = {}
+        used = set()
+        for s, ai, di in pairs:
+            if ai in assigned or di in used:
+                continue
+            assigned[ai] = (di, s)
+            used.add(di)
+        results = []
+        for ai, rec in enumerate(amap_records):
+            if ai in assigned:
+                di, s = assigned[ai]
+                results.append((rec.row, self.records[di].row, s))
+            else:
+                results.append((rec.row, None, 0.0))
+        return results
+
+
+def has_dianping_data(dp_row: Optional[Dict]) -> bool:
+    """点评记录是否含有任何评分/评论数据（抓取失败的行只有店名）"""
+    return bool(dp_row) and any((dp_row.get(field) or "").strip() for field in DIANPING_FIELDS)
+
+
+def merge_rows(amap_row: Dict, dp_row: Optional[Dict], confidence: float) -> Dict:
+    merged = {"name": amap_row.get("name", "")}
+    for field in DIANPING_FIELDS:
+        merged[field] = dp_row.get(field, "") if dp_row else ""
+    for field in AMAP_FIELDS:
+        merged[field] = amap_row.get(field, "")
+    merged["match_confidence"] = f"{confidence:.3f}" if dp_row else ""
+    return merged
+
+
+def read_csv(path: str) -> List[Dict]:
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        return list(csv.DictReader(f))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="模糊连接高德 POI 与大众点评数据，生成 init_vectordb 使用的统一 CSV")
+    parser.add_argument("--amap", default="Amap-results_NJU-Gulou-3000m.csv")
+    parser.add_argument("--dianping", default="Dianping_Gulou_100.csv")
+    parser.add_argument("--output", default="restaurant_all.csv")
+    parser.add_argument("--threshold", type=float, default=0.6, help="低于该置信度的候选不匹配")
+    args = parser.parse_args()
+
+    start = time.time()
+    amap_rows = read_csv(args.amap)
+    joiner = POIJoiner(read_csv(args.dianping), threshold=args.threshold)
+    results = joiner.match(amap_rows)
+    with open(args.output, "w", newline="", encoding="utf-8-sig") as f:
+        writer = csv.DictWriter(f, fieldnames=OUTPUT_FIELDS)
+        writer.writeheader()
+        for amap_row, dp_row, confidence in results:
+            writer.writerow(merge_rows(amap_row, dp_row, confidence))
+    matched = sum(1 for _, dp_row, _ in results if dp_row)
+    with_data = sum(1 for _, dp_row, _ in results if has_dianping_data(dp_row))
+    print(f"高德 {len(amap_rows)} 条，点评 {len(joiner.records)} 条，匹配 {matched} 条"
+          f"（其中含点评数据 {with_data} 条），耗时 {time.time() - start:.2f} 秒，已保存到 {args.output}")
+    if not joiner.by_phone and not joiner.by_cell:
+        print("注意: 点评数据没有 tel / location 列，电话与 geohash 分块未生效，仅按店名分块和打分")
+
+
+if __name__ == "__main__":
+    main()